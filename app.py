@@ -1,14 +1,18 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import json
 from pathlib import Path
 
+from caching import cache_stats, enable_copy_on_write
+from instrumentation import (
+    MAX_RERUNS, chrome_trace, clear_traces, instrumentation_enabled, instrumented, rerun, rerun_summary,
+    top_offenders, traces_json
+)
+from memory import acquire_tracing
+from precompute import load_or_build_analysis_results
+from spatial import build_station_index
 from utils import (
     load_data,
     prepare_station_data,
     prepare_price_data,
-    prepare_volume_data,
     scatter_population_vs_stations,
     bar_chart_stations_by_state,
     bar_chart_top_municipalities,
@@ -21,6 +25,7 @@ from utils import (
     boxplot_price_distribution_by_state,
     histogram_prices_by_type_and_state,
     product_availability_stats,
+    station_map,
     volume_analysis_charts,
     historical_volume_chart
 )
@@ -29,15 +34,180 @@ from utils import (
 DATA_DIR = Path("data")
 ANALYSIS_RESULTS_FILE = DATA_DIR / "analysis_results.json"
 
+# Render only the section picked in the navigation bar; False renders every section in st.tabs
+LAZY_SECTIONS = True
+SECTIONS = ["Station Analysis", "Station Map", "Price Analysis", "Volume Analysis", "Interpretation"]
+
+@instrumented()
 def load_analysis_results():
-    """Load pre-computed analysis results if available."""
+    """
+    Load pre-computed analysis results, rebuilding them from the CSV files
+    when the artifact is missing, from an older schema or built from different inputs.
+    """
+    return load_or_build_analysis_results(
+        gas_prices_path=DATA_DIR / "gas_prices_clean.csv",
+        population_path=DATA_DIR / "population.csv",
+        volumes_path=DATA_DIR / "volumes.csv",
+        results_path=ANALYSIS_RESULTS_FILE
+    )
+
+@instrumented()
+def load_station_index():
+    """Spatial index over the prepared station table, shared across sessions."""
+    df_gas, df_pop, _ = load_data(
+        DATA_DIR / "gas_prices_clean.csv",
+        DATA_DIR / "population.csv",
+        DATA_DIR / "volumes.csv"
+    )
+    return build_station_index(prepare_price_data(prepare_station_data(df_gas, df_pop)))
+
+# -------------------------------------------------------------------------
+# Sections
+# Widgets live inside st.fragment functions, so changing one only reruns
+# its fragment; the figures themselves are cached per widget state in utils.
+# Each section is an instrumentation span, and so is each fragment rerun.
+# -------------------------------------------------------------------------
+
+@instrumented("section:station_analysis")
+def render_station_analysis(analysis_results):
+    st.subheader("Population vs. Number of Stations by State")
+    fig_scatter = scatter_population_vs_stations(analysis_results["stations_by_state"])
+    st.plotly_chart(fig_scatter, use_container_width=True)
+
+    st.subheader("Number of Stations per State")
+    fig_stations_state = bar_chart_stations_by_state(analysis_results["stations_by_state"])
+    st.plotly_chart(fig_stations_state, use_container_width=True)
+
+    st.subheader("Product Availability Statistics")
+    product_availability_stats(analysis_results["availability"])
+
+    st.subheader("Top 15 Municipalities by Number of Stations")
+    fig_top_mun = bar_chart_top_municipalities(analysis_results["stations_by_municipality"])
+    st.plotly_chart(fig_top_mun, use_container_width=True)
+
+    st.subheader("Average Stations per Municipality by State")
+    fig_avg_stations = bar_chart_stations_per_municipality(analysis_results["stations_by_state"])
+    st.plotly_chart(fig_avg_stations, use_container_width=True)
+
+@st.fragment
+@instrumented("fragment:station_map")
+def render_station_map(analysis_results):
+    # Panning and zooming only rerun this fragment
+    station_map(analysis_results["station_clusters"], load_station_index())
+
+@st.fragment
+@instrumented("fragment:price_histograms")
+def render_price_histograms(analysis_results):
+    histogram_prices_by_type_and_state(
+        analysis_results["price_histograms"],
+        analysis_results["stations_by_state"]["state_name"].tolist()
+    )
+
+@instrumented("section:price_analysis")
+def render_price_analysis(analysis_results):
+    national_avg = analysis_results["national_avg_prices"]
+
+    st.subheader("National Average Prices by Fuel Type")
+    display_national_avg_prices(national_avg)
+
+    st.subheader("Average Price per State by Fuel Type")
+    display_state_price_triplet(analysis_results["state_prices"])  # 3 side-by-side bar charts
+
+    st.subheader("Price Deviation from National Average by State")
+    display_state_price_deviation_triplet(analysis_results["state_prices"], national_avg)  # 3 side-by-side deviation charts
+
+    st.subheader("Top 15 Municipalities: Highest Average Price by Fuel Type")
+    display_municipality_price_triplet(analysis_results["municipality_prices"], national_avg)  # 3 side-by-side bar charts
+
+    st.subheader("Top 15 Municipalities: Price Deviation from National Average")
+    display_municipality_price_deviation_triplet(analysis_results["municipality_prices"], national_avg)  # 3 side-by-side deviation charts
+
+    st.subheader("Box Plot: Price Distribution by State")
+    figures = boxplot_price_distribution_by_state(analysis_results["state_prices"])
+    for fig in figures:
+        st.plotly_chart(fig, use_container_width=True)
+
+    st.subheader("Histogram of Prices by Fuel Type and State")
+    render_price_histograms(analysis_results)
+
+@st.fragment
+@instrumented("fragment:volume_charts")
+def render_volume_charts(analysis_results):
+    volume_analysis_charts(
+        analysis_results["volume_by_fuel"],
+        analysis_results["volume_by_state_fuel"],
+        analysis_results["volume_by_state"],
+        analysis_results["volume_national"]
+    )
+
+@st.fragment
+@instrumented("fragment:historical_volume")
+def render_historical_volume(analysis_results):
+    hist_fig = historical_volume_chart(analysis_results["historical_volume"])
+    st.plotly_chart(hist_fig, use_container_width=True)
+
+@instrumented("section:volume_analysis")
+def render_volume_analysis(analysis_results):
+    render_volume_charts(analysis_results)
+    st.subheader("Historical Volume Analysis")
+    render_historical_volume(analysis_results)
+
+@instrumented("section:interpretation")
+def render_interpretation(analysis_results):
     try:
-        with open(ANALYSIS_RESULTS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open("interpretation.md", "r", encoding="utf-8") as file:
+            interpretation_content = file.read()
+            st.markdown(interpretation_content)
     except FileNotFoundError:
-        return None
-
-def main():
+        st.error("interpretation.md file not found. Please create this file with your interpretation content.")
+
+SECTION_RENDERERS = {
+    "Station Analysis": render_station_analysis,
+    "Station Map": render_station_map,
+    "Price Analysis": render_price_analysis,
+    "Volume Analysis": render_volume_analysis,
+    "Interpretation": render_interpretation
+}
+
+# -------------------------------------------------------------------------
+# Performance Panel
+# Developer-only sidebar of the last reruns, shown when PERF_PANEL=1 is set
+# (see instrumentation.py).
+# -------------------------------------------------------------------------
+
+def render_performance_panel():
+    with st.sidebar:
+        st.header("Performance")
+        st.caption(f"Last {MAX_RERUNS} reruns; spans are the loaders, preparation steps, charts and sections.")
+
+        tracing = st.checkbox("Trace allocations", key="perf_trace_allocations",
+                              help="Records the peak bytes allocated during each span. Memory is measured for "
+                                   "the whole process, so it includes other sessions' work running at the same "
+                                   "time (tracemalloc slows reruns down).")
+        # Tracing is process-wide: each session holds it at most once, and it stays on
+        # while any session holds it (the hold is released with the session's state)
+        hold = st.session_state.get("perf_tracing_hold")
+        if tracing and hold is None:
+            st.session_state["perf_tracing_hold"] = acquire_tracing()
+        elif not tracing and hold is not None:
+            hold.release()
+            del st.session_state["perf_tracing_hold"]
+
+        st.subheader("Reruns")
+        st.dataframe(rerun_summary().iloc[::-1], hide_index=True, use_container_width=True)
+
+        st.subheader("Top Offenders")
+        st.dataframe(top_offenders(), hide_index=True, use_container_width=True)
+
+        stats = cache_stats()
+        st.caption(f"Cache: {stats['hits']} hits, {stats['misses']} misses")
+
+        st.download_button("Download traces (JSON)", traces_json(), file_name="traces.json", mime="application/json")
+        st.download_button("Download Chrome trace", chrome_trace(), file_name="chrome_trace.json", mime="application/json")
+        if st.button("Clear traces"):
+            clear_traces()
+
+def render_dashboard():
     st.set_page_config(page_title="Gasoline MX Dashboard", page_icon="⛽", layout="wide")
     st.title("Comprehensive Analysis of Gasoline Prices and Volumes in Mexico")
 
@@ -46,91 +216,18 @@ def main():
         "***Disclaimer**: The data for stations and volumens has been extracted from the CRE (Comisión Reguladora de Energía) databases.*"
     )
 
-    # Try to load pre-computed analysis results
+    # All sections render from the pre-computed aggregates
     analysis_results = load_analysis_results()
-    
-    if analysis_results:
-        st.success("Using pre-computed analysis results")
-        # TODO: Implement visualization using analysis_results
-    else:
-        # Load data from CSV files
-        df_gas, df_pop, df_vol = load_data(
-            gas_prices_path=DATA_DIR / "gas_prices_clean.csv",
-            population_path=DATA_DIR / "population.csv",
-            volumes_path=DATA_DIR / "volumes.csv"
-        )
-
-        # Prepare data
-        df_station = prepare_station_data(df_gas, df_pop)
-        df_price = prepare_price_data(df_station)
-        df_volume = prepare_volume_data(df_vol)
 
+    if LAZY_SECTIONS:
+        # Only the selected section is computed on each rerun
+        section = st.radio("Section", SECTIONS, horizontal=True, label_visibility="collapsed", key="section")
+        SECTION_RENDERERS[section](analysis_results)
+    else:
         # Create tabs
-        tab_stations, tab_prices, tab_volumes, tab_interpretation = st.tabs([
-            "Station Analysis", "Price Analysis", "Volume Analysis", "Interpretation"
-        ])
-
-        # ---------- Station Analysis ----------
-        with tab_stations:
-            st.subheader("Population vs. Number of Stations by State")
-            fig_scatter = scatter_population_vs_stations(df_station, df_pop)
-            st.plotly_chart(fig_scatter, use_container_width=True)
-
-            st.subheader("Number of Stations per State")
-            fig_stations_state = bar_chart_stations_by_state(df_station, df_pop)
-            st.plotly_chart(fig_stations_state, use_container_width=True)
-
-            st.subheader("Product Availability Statistics")
-            product_availability_stats(df_station)
-
-            st.subheader("Top 15 Municipalities by Number of Stations")
-            fig_top_mun = bar_chart_top_municipalities(df_station)
-            st.plotly_chart(fig_top_mun, use_container_width=True)
-
-            st.subheader("Average Stations per Municipality by State")
-            fig_avg_stations = bar_chart_stations_per_municipality(df_station)
-            st.plotly_chart(fig_avg_stations, use_container_width=True)
-
-        # ---------- Price Analysis ----------
-        with tab_prices:
-            st.subheader("National Average Prices by Fuel Type")
-            display_national_avg_prices(df_price)
-
-            st.subheader("Average Price per State by Fuel Type")
-            display_state_price_triplet(df_price, df_pop)  # 3 side-by-side bar charts
-
-            st.subheader("Price Deviation from National Average by State")
-            display_state_price_deviation_triplet(df_price, df_pop)  # 3 side-by-side deviation charts
-
-            st.subheader("Top 15 Municipalities: Highest Average Price by Fuel Type")
-            display_municipality_price_triplet(df_price)  # 3 side-by-side bar charts
-
-            st.subheader("Top 15 Municipalities: Price Deviation from National Average")
-            display_municipality_price_deviation_triplet(df_price)  # 3 side-by-side deviation charts
-
-            st.subheader("Box Plot: Price Distribution by State")
-            figures = boxplot_price_distribution_by_state(df_price)
-            for fig in figures:
-                st.plotly_chart(fig, use_container_width=True)
-
-            st.subheader("Histogram of Prices by Fuel Type and State")
-            histogram_prices_by_type_and_state(df_price)
-
-        # ---------- Volume Analysis ----------
-        with tab_volumes:
-            volume_analysis_charts(df_volume, df_price, df_station, df_pop)
-            st.subheader("Historical Volume Analysis")
-            hist_fig = historical_volume_chart(df_volume)
-            st.plotly_chart(hist_fig, use_container_width=True)
-
-    # ---------- Interpretation ----------
-    with tab_interpretation:
-        try:
-            with open("interpretation.md", "r", encoding="utf-8") as file:
-                interpretation_content = file.read()
-                st.markdown(interpretation_content)
-        except FileNotFoundError:
-            st.error("interpretation.md file not found. Please create this file with your interpretation content.")
+        for tab, section in zip(st.tabs(SECTIONS), SECTIONS):
+            with tab:
+                SECTION_RENDERERS[section](analysis_results)
 
     # Footer (for all tabs)
     st.markdown("---")
@@ -139,5 +236,14 @@ def main():
         '**[CRE](https://www.cre.gob.mx/ConsultaPrecios/GasolinasyDiesel/GasolinasyDiesel.html)** (Comisión Reguladora de Energía) and independent research.'
     )
 
+def main():
+    # Cached frames are shared across sessions as copy-on-write views
+    enable_copy_on_write()
+    with rerun("main"):
+        render_dashboard()
+    if instrumentation_enabled():
+        # After the rerun, so the panel includes it
+        render_performance_panel()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
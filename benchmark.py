@@ -0,0 +1,332 @@
+"""
+Benchmarks of the data preparation steps and chart builders in utils.py.
+
+Every case runs headlessly: Streamlit calls are replaced by a stub that returns
+each widget's default value and collects the figures passed to st.plotly_chart.
+Cases run on the shipped data and on copies of the station table scaled by
+each factor in --scales (every station repeated with a new place_id, jittered
+coordinates and prices). The volume and population tables stay as shipped; the
+interactive map (st_folium) is not covered.
+
+For each case and scale the results record:
+
+    seconds        best wall time of --repeat cold runs (caches cleared before each run,
+                   after one untimed warm-up run at the first scale)
+    peak_bytes     bytes allocated at the peak of one run (see memory.py)
+    figure_bytes   size of the figure JSON the case produced
+
+Results are written as JSON. With --baseline, every case that got slower, used
+more memory or produced larger figures than the baseline allows is listed, and
+the exit status is 1.
+
+Usage:
+    python benchmark.py [--scales 1,10,100,1000] [--output benchmark_results.json] [--baseline baseline.json]
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+import utils
+from caching import clear_cache, enable_copy_on_write
+from memory import memory_report, start_memory_accounting, stop_memory_accounting, track_memory
+from precompute import compute_analysis_results
+
+# Configuration
+DATA_DIR = Path("data")
+RESULTS_FILE = Path("benchmark_results.json")
+DEFAULT_SCALES = [1, 10, 100, 1000]
+DEFAULT_REPEAT = 3
+SEED = 0
+FUEL_COLUMNS = ["regular_price", "premium_price", "diesel_price"]
+# Relative increase over the baseline reported as a regression, per metric
+TOLERANCES = {"seconds": 0.25, "peak_bytes": 0.10, "figure_bytes": 0.05}
+# Timings below this many seconds are too noisy to compare
+MIN_SECONDS = 0.005
+
+# -------------------------------------------------------------------------
+# Headless Streamlit
+# -------------------------------------------------------------------------
+
+class HeadlessStreamlit:
+    """
+    Stand-in for the streamlit module: widgets return their default value,
+    st.plotly_chart collects the figure, every other call does nothing.
+    """
+
+    def __init__(self, figures=None):
+        self.figures = [] if figures is None else figures
+        self.session_state = {}
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def plotly_chart(self, fig, *args, **kwargs):
+        self.figures.append(fig)
+
+    def columns(self, spec, *args, **kwargs):
+        n = spec if isinstance(spec, int) else len(spec)
+        return [HeadlessStreamlit(self.figures) for _ in range(n)]
+
+    def checkbox(self, label, value=False, *args, **kwargs):
+        return value
+
+    def selectbox(self, label, options, index=0, *args, **kwargs):
+        options = list(options)
+        return options[index] if options else None
+
+    def multiselect(self, label, options, default=None, *args, **kwargs):
+        return list(default or [])
+
+@contextmanager
+def headless():
+    """Swap utils' streamlit module for a HeadlessStreamlit; yields it."""
+    original = utils.st
+    utils.st = HeadlessStreamlit()
+    try:
+        yield utils.st
+    finally:
+        utils.st = original
+
+# -------------------------------------------------------------------------
+# Datasets
+# -------------------------------------------------------------------------
+
+def scale_stations(df_gas, factor, seed=SEED):
+    """
+    The station table repeated factor times: copies get new place_ids, coordinates
+    moved by up to 0.01 degrees and prices multiplied by a ~2% log-normal factor.
+    """
+    if factor == 1:
+        return df_gas
+    rng = np.random.default_rng(seed)
+    n = len(df_gas)
+    df = df_gas.iloc[np.tile(np.arange(n), factor)].reset_index(drop=True)
+    copy = np.repeat(np.arange(factor), n)
+    changed = copy > 0
+    span = int(df_gas["place_id"].max()) + 1
+    updates = {"place_id": df["place_id"].to_numpy(dtype=np.int64) + copy * span}
+    for col in ["longitude", "latitude"]:
+        values = df[col].to_numpy(dtype=float, copy=True)
+        values[changed] += rng.uniform(-0.01, 0.01, changed.sum())
+        updates[col] = values
+    for col in FUEL_COLUMNS:
+        values = df[col].to_numpy(dtype=float, copy=True)
+        values[changed] *= rng.lognormal(0, 0.02, changed.sum())
+        updates[col] = np.round(values, 2).astype(df_gas[col].dtype)
+    return df.assign(**updates)
+
+def build_context(df_gas, df_pop, df_volume):
+    """Inputs of every case: raw, prepared and pre-computed tables."""
+    df_station = utils.prepare_station_data.uncached(df_gas, df_pop)
+    df_price = utils.prepare_price_data.uncached(df_station)
+    results = compute_analysis_results(df_station, df_price, df_volume, df_pop)
+    return {
+        "df_gas": df_gas, "df_pop": df_pop, "df_volume": df_volume,
+        "df_station": df_station, "df_price": df_price, "results": results
+    }
+
+# -------------------------------------------------------------------------
+# Cases
+# -------------------------------------------------------------------------
+
+def _states(results):
+    return results["stations_by_state"]["state_name"].tolist()
+
+# name -> function of the context; chart cases return their figure(s) or draw them through st
+CASES = {
+    "prepare_station_data": lambda c: utils.prepare_station_data.uncached(c["df_gas"], c["df_pop"]),
+    "prepare_price_data": lambda c: utils.prepare_price_data.uncached(c["df_station"]),
+    "remove_price_outliers": lambda c: utils.remove_price_outliers(c["df_station"], "regular_price"),
+    "compute_analysis_results": lambda c: compute_analysis_results(
+        c["df_station"], c["df_price"], c["df_volume"], c["df_pop"]
+    ),
+    "scatter_population_vs_stations": lambda c: utils.scatter_population_vs_stations(
+        c["results"]["stations_by_state"]
+    ),
+    "bar_chart_stations_by_state": lambda c: utils.bar_chart_stations_by_state(c["results"]["stations_by_state"]),
+    "bar_chart_top_municipalities": lambda c: utils.bar_chart_top_municipalities(
+        c["results"]["stations_by_municipality"]
+    ),
+    "bar_chart_stations_per_municipality": lambda c: utils.bar_chart_stations_per_municipality(
+        c["results"]["stations_by_state"]
+    ),
+    "display_state_price_triplet": lambda c: utils.display_state_price_triplet(c["results"]["state_prices"]),
+    "display_municipality_price_triplet": lambda c: utils.display_municipality_price_triplet(
+        c["results"]["municipality_prices"], c["results"]["national_avg_prices"]
+    ),
+    "boxplot_price_distribution_by_state": lambda c: utils.boxplot_price_distribution_by_state(
+        c["results"]["state_prices"]
+    ),
+    "histogram_prices_by_type_and_state": lambda c: utils.histogram_prices_by_type_and_state(
+        c["results"]["price_histograms"], _states(c["results"])
+    ),
+    "display_state_price_deviation_triplet": lambda c: utils.display_state_price_deviation_triplet(
+        c["results"]["state_prices"], c["results"]["national_avg_prices"]
+    ),
+    "display_municipality_price_deviation_triplet": lambda c: utils.display_municipality_price_deviation_triplet(
+        c["results"]["municipality_prices"], c["results"]["national_avg_prices"]
+    ),
+    "volume_analysis_charts": lambda c: utils.volume_analysis_charts(
+        c["results"]["volume_by_fuel"], c["results"]["volume_by_state_fuel"],
+        c["results"]["volume_by_state"], c["results"]["volume_national"]
+    ),
+    "historical_volume_chart": lambda c: utils.historical_volume_chart(c["results"]["historical_volume"]),
+}
+
+def _figure_bytes(value, figures):
+    """JSON size of the figures drawn through st plus any returned (alone or in a list)."""
+    returned = value if isinstance(value, (list, tuple)) else [value]
+    figures = figures + [fig for fig in returned if isinstance(fig, go.Figure)]
+    return sum(len(fig.to_json()) for fig in figures)
+
+def run_case(case, context, repeat=DEFAULT_REPEAT, warmup=False):
+    """
+    seconds, peak_bytes and figure_bytes of one case (caches cleared before every run).
+    warmup adds an untimed first run, so one-time costs (imports, Plotly's validators)
+    are not charged to the case.
+    """
+    func = CASES[case]
+    times = []
+    if warmup:
+        with headless():
+            func(context)
+    for _ in range(repeat):
+        clear_cache()
+        with headless():
+            start = time.perf_counter()
+            func(context)
+            times.append(time.perf_counter() - start)
+
+    clear_cache()
+    start_memory_accounting()
+    try:
+        with headless() as st, track_memory(case):
+            value = func(context)
+        report = memory_report().set_index("stage")
+    finally:
+        stop_memory_accounting()
+    return {
+        "seconds": min(times),
+        "peak_bytes": int(report.loc[case, "allocated"]),
+        "figure_bytes": _figure_bytes(value, st.figures)
+    }
+
+def run_benchmarks(gas_prices_path, population_path, volumes_path, scales=DEFAULT_SCALES,
+                   cases=None, repeat=DEFAULT_REPEAT, log=None):
+    """One result row per case and scale (rows of the scaled station table included)."""
+    df_gas, df_pop, df_volume = utils.load_data(gas_prices_path, population_path, volumes_path)
+    rows = []
+    for i, scale in enumerate(scales):
+        context = build_context(scale_stations(df_gas, scale), df_pop, df_volume)
+        for case in cases or CASES:
+            row = {"case": case, "scale": scale, "rows": len(context["df_gas"])}
+            row.update(run_case(case, context, repeat, warmup=i == 0))
+            rows.append(row)
+            if log is not None:
+                log(row)
+        del context
+    return rows
+
+# -------------------------------------------------------------------------
+# Baseline
+# -------------------------------------------------------------------------
+
+def compare(results, baseline, tolerances=TOLERANCES):
+    """
+    Regressions of results against a baseline (both lists of result rows): one row per
+    case, scale and metric over its tolerance, with the baseline and current values.
+    """
+    previous = {(row["case"], row["scale"]): row for row in baseline}
+    regressions = []
+    for row in results:
+        base = previous.get((row["case"], row["scale"]))
+        if base is None:
+            continue
+        for metric, tolerance in tolerances.items():
+            before, after = base.get(metric), row.get(metric)
+            if before is None or after is None:
+                continue
+            if metric == "seconds" and after < MIN_SECONDS:
+                continue
+            if after > before * (1 + tolerance):
+                regressions.append({
+                    "case": row["case"], "scale": row["scale"], "metric": metric,
+                    "baseline": before, "current": after,
+                    "change": after / before - 1 if before else None
+                })
+    return regressions
+
+def write_results(results, path, regressions=None):
+    document = {
+        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "results": results,
+        "regressions": regressions
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2)
+
+def read_results(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+def _print_row(row):
+    print(
+        f"{row['case']:<46} x{row['scale']:<5} {row['seconds'] * 1000:>10.1f} ms "
+        f"{row['peak_bytes'] / 1024 ** 2:>9.1f} MB {row['figure_bytes'] / 1024:>9.1f} KB"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark data preparation and chart building.")
+    parser.add_argument("--gas-prices", default=DATA_DIR / "gas_prices_clean.csv", type=Path)
+    parser.add_argument("--population", default=DATA_DIR / "population.csv", type=Path)
+    parser.add_argument("--volumes", default=DATA_DIR / "volumes.csv", type=Path)
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)),
+                        help="Comma-separated scale factors of the station table")
+    parser.add_argument("--cases", help=f"Comma-separated subset of: {', '.join(CASES)}")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--output", default=RESULTS_FILE, type=Path)
+    parser.add_argument("--baseline", type=Path, help="Results file to compare against")
+    args = parser.parse_args()
+
+    enable_copy_on_write()
+
+    scales = [int(scale) for scale in args.scales.split(",")]
+    cases = args.cases.split(",") if args.cases else None
+    unknown = sorted(set(cases or []) - set(CASES))
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+
+    results = run_benchmarks(
+        args.gas_prices, args.population, args.volumes, scales, cases, args.repeat, log=_print_row
+    )
+    regressions = compare(results, read_results(args.baseline)) if args.baseline else None
+    write_results(results, args.output, regressions)
+    print(f"Wrote {args.output}")
+    if regressions:
+        for regression in regressions:
+            print(
+                f"REGRESSION {regression['case']} x{regression['scale']} {regression['metric']}: "
+                f"{regression['baseline']:,.4g} -> {regression['current']:,.4g}"
+            )
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
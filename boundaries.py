@@ -0,0 +1,256 @@
+"""
+Point-in-polygon lookup of municipalities, used to backfill the geography of
+stations that have coordinates but no state/municipality.
+
+Boundaries are read from a GeoJSON file of municipality polygons in
+longitude/latitude (WGS84), e.g. INEGI's Marco Geoestadístico exported to
+EPSG:4326, with CVEGEO (or CVE_ENT + CVE_MUN) and NOMGEO properties.
+
+Polygon edges are stored sorted by polygon, and every polygon is registered
+in the cells of a longitude/latitude grid covered by its bounding box. A point
+is only tested against the polygons of its cell, and only against the edges
+that cross the cell's latitude band; the even-odd ray test runs on a
+points x edges array per cell.
+
+Usage:
+    python boundaries.py data/gas_prices_clean.csv --boundaries data/municipalities.geojson
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from geography import MUNICIPALITY_FACTOR, UNKNOWN, state_names
+from spatial import COORDINATE_BOUNDS, _expand_ranges
+
+# Configuration
+DATA_DIR = Path("data")
+BOUNDARIES_FILE = DATA_DIR / "municipalities.geojson"
+DEFAULT_CELL_DEGREES = 0.1
+# Points per block of the points x edges crossing test
+POINT_BLOCK = 256
+
+# -------------------------------------------------------------------------
+# Loading
+# -------------------------------------------------------------------------
+
+def _rings(geometry):
+    """Coordinate arrays of every ring (outer and holes) of a Polygon or MultiPolygon."""
+    polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+    for polygon in polygons:
+        for ring in polygon:
+            yield np.asarray(ring, dtype=float)[:, :2]
+
+def _municipality_id(properties):
+    if "CVEGEO" in properties:
+        return int(properties["CVEGEO"])
+    return int(properties["CVE_ENT"]) * MUNICIPALITY_FACTOR + int(properties["CVE_MUN"])
+
+def load_boundaries(path=BOUNDARIES_FILE, cell_degrees=DEFAULT_CELL_DEGREES):
+    """BoundaryIndex over the municipality polygons of a GeoJSON FeatureCollection."""
+    with open(path, "r", encoding="utf-8") as f:
+        features = json.load(f)["features"]
+    municipality_ids, names, rings, owners = [], [], [], []
+    for feature in features:
+        if not feature.get("geometry"):
+            continue
+        for ring in _rings(feature["geometry"]):
+            rings.append(ring)
+            owners.append(len(municipality_ids))
+        municipality_ids.append(_municipality_id(feature["properties"]))
+        names.append(feature["properties"].get("NOMGEO"))
+    return BoundaryIndex(municipality_ids, names, rings, owners, cell_degrees)
+
+# -------------------------------------------------------------------------
+# Index
+# -------------------------------------------------------------------------
+
+class BoundaryIndex:
+    """Grid-prefiltered point-in-polygon index over municipality polygons."""
+
+    def __init__(self, municipality_ids, names, rings, owners, cell_degrees=DEFAULT_CELL_DEGREES):
+        """
+        municipality_ids/names: one entry per polygon; rings: (n, 2) lon/lat arrays,
+        owners: polygon position of each ring (holes and multi-part rings share it).
+        """
+        self.municipality_ids = np.asarray(municipality_ids, dtype=np.int32)
+        self.names = np.asarray(names, dtype=object)
+        self.cell_degrees = cell_degrees
+        n_polygons = len(self.municipality_ids)
+
+        # Edges of every ring (closed if the file leaves it open), grouped by polygon
+        starts, ends, edge_owner = [], [], []
+        for ring, owner in zip(rings, owners):
+            if len(ring) and not np.array_equal(ring[0], ring[-1]):
+                ring = np.vstack([ring, ring[:1]])
+            starts.append(ring[:-1])
+            ends.append(ring[1:])
+            edge_owner.append(np.full(len(ring) - 1, owner, dtype=np.int64))
+        edge_owner = np.concatenate(edge_owner) if edge_owner else np.zeros(0, dtype=np.int64)
+        order = np.argsort(edge_owner, kind="stable")
+        starts = np.concatenate(starts)[order] if starts else np.zeros((0, 2))
+        ends = np.concatenate(ends)[order] if ends else np.zeros((0, 2))
+        self.x1, self.y1 = starts[:, 0], starts[:, 1]
+        self.x2, self.y2 = ends[:, 0], ends[:, 1]
+        self.edge_ymin = np.minimum(self.y1, self.y2)
+        self.edge_ymax = np.maximum(self.y1, self.y2)
+        self.edge_offsets = np.concatenate(([0], np.cumsum(np.bincount(edge_owner, minlength=n_polygons))))
+
+        # Polygon bounding boxes (empty polygons get an empty box)
+        has_edges = np.diff(self.edge_offsets) > 0
+        self.bbox = np.tile([np.inf, np.inf, -np.inf, -np.inf], (n_polygons, 1))
+        if has_edges.any():
+            first = self.edge_offsets[:-1][has_edges]
+            edge_xmin, edge_xmax = np.minimum(self.x1, self.x2), np.maximum(self.x1, self.x2)
+            self.bbox[has_edges] = np.column_stack([
+                np.minimum.reduceat(edge_xmin, first), np.minimum.reduceat(self.edge_ymin, first),
+                np.maximum.reduceat(edge_xmax, first), np.maximum.reduceat(self.edge_ymax, first)
+            ])
+        self.min_lon = float(self.bbox[has_edges, 0].min()) if has_edges.any() else 0.0
+        self.min_lat = float(self.bbox[has_edges, 1].min()) if has_edges.any() else 0.0
+        self.nx = int((self.bbox[has_edges, 2].max() - self.min_lon) // cell_degrees) + 1 if has_edges.any() else 1
+        self.ny = int((self.bbox[has_edges, 3].max() - self.min_lat) // cell_degrees) + 1 if has_edges.any() else 1
+
+        # Cell -> polygons whose bounding box covers the cell, stored CSR-style
+        polygons = np.flatnonzero(has_edges)
+        cx0, cy0 = self._cell_x(self.bbox[polygons, 0]), self._cell_y(self.bbox[polygons, 1])
+        cx1, cy1 = self._cell_x(self.bbox[polygons, 2]), self._cell_y(self.bbox[polygons, 3])
+        rows, owner = _expand_ranges(cy0, cy1 + 1)
+        cells, row_owner = _expand_ranges(rows * self.nx + cx0[owner], rows * self.nx + cx1[owner] + 1)
+        cell_polygons = polygons[owner[row_owner]]
+        order = np.lexsort((cell_polygons, cells))
+        self.cell_polygons = cell_polygons[order]
+        self.cell_offsets = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=self.nx * self.ny))))
+
+    def __len__(self):
+        return len(self.municipality_ids)
+
+    def _cell_x(self, lon):
+        return np.clip(((lon - self.min_lon) // self.cell_degrees).astype(np.int64), 0, self.nx - 1)
+
+    def _cell_y(self, lat):
+        return np.clip(((lat - self.min_lat) // self.cell_degrees).astype(np.int64), 0, self.ny - 1)
+
+    def _locate_cell(self, cell, lon, lat):
+        """Polygon position containing each point of one cell (-1 when none)."""
+        polygons = self.cell_polygons[self.cell_offsets[cell]:self.cell_offsets[cell + 1]]
+        found = np.full(len(lon), -1, dtype=np.int64)
+        if not len(polygons):
+            return found
+
+        # Edges of the candidate polygons crossing the cell's latitude band
+        band_min = self.min_lat + (cell // self.nx) * self.cell_degrees
+        edges, edge_polygon = _expand_ranges(self.edge_offsets[polygons], self.edge_offsets[polygons + 1])
+        in_band = (self.edge_ymax[edges] >= min(band_min, lat.min())) & (
+            self.edge_ymin[edges] <= max(band_min + self.cell_degrees, lat.max())
+        )
+        edges, edge_polygon = edges[in_band], edge_polygon[in_band]
+        if not len(edges):
+            return found
+        present, first = np.unique(edge_polygon, return_index=True)
+        x1, y1, x2, y2 = self.x1[edges], self.y1[edges], self.x2[edges], self.y2[edges]
+        bbox = self.bbox[polygons[present]]
+
+        for block in range(0, len(lon), POINT_BLOCK):
+            px = lon[block:block + POINT_BLOCK, None]
+            py = lat[block:block + POINT_BLOCK, None]
+            # Even-odd rule: a ray towards +x crosses the boundary an odd number of times
+            straddles = (y1 > py) != (y2 > py)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            crossings = np.add.reduceat(straddles & (px < x_cross), first, axis=1)
+            inside = (crossings % 2 == 1) & (
+                (px >= bbox[:, 0]) & (px <= bbox[:, 2]) & (py >= bbox[:, 1]) & (py <= bbox[:, 3])
+            )
+            hit = inside.any(axis=1)
+            found[block:block + POINT_BLOCK][hit] = polygons[present[inside[hit].argmax(axis=1)]]
+        return found
+
+    def locate(self, lon, lat):
+        """Polygon position containing each point (-1 when outside every polygon or not finite)."""
+        lon = np.atleast_1d(np.asarray(lon, dtype=float))
+        lat = np.atleast_1d(np.asarray(lat, dtype=float))
+        found = np.full(len(lon), -1, dtype=np.int64)
+        valid = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat))
+        if not len(valid) or not len(self):
+            return found
+        cells = self._cell_y(lat[valid]) * self.nx + self._cell_x(lon[valid])
+        order = np.argsort(cells, kind="stable")
+        valid, cells = valid[order], cells[order]
+        occupied, first = np.unique(cells, return_index=True)
+        for cell, start, stop in zip(occupied, first, np.append(first[1:], len(cells))):
+            points = valid[start:stop]
+            found[points] = self._locate_cell(cell, lon[points], lat[points])
+        return found
+
+    def municipality_at(self, lon, lat):
+        """Municipality id (CVEGEO as an integer) at each point, UNKNOWN outside every polygon."""
+        found = self.locate(lon, lat)
+        return np.where(found >= 0, self.municipality_ids[found], UNKNOWN)
+
+# -------------------------------------------------------------------------
+# Backfill
+# -------------------------------------------------------------------------
+
+def backfill_geography(df_gas, boundaries):
+    """
+    Fill EntidadFederativaId, MunicipioId, state_name and municipality_name of the
+    stations that have coordinates inside Mexico but no state or municipality,
+    from the municipality polygon containing them. Returns (DataFrame, report) with
+    report {"missing": stations without geography, "backfilled": stations filled}.
+    """
+    missing = (df_gas["state_name"].isna() | df_gas["municipality_name"].isna()).to_numpy()
+    lon = df_gas["longitude"].to_numpy(dtype=float, na_value=np.nan)
+    lat = df_gas["latitude"].to_numpy(dtype=float, na_value=np.nan)
+    min_lon, min_lat, max_lon, max_lat = COORDINATE_BOUNDS
+    # 0, 0 placeholders and unsigned longitudes cannot be placed
+    candidates = np.flatnonzero(missing & (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat))
+
+    found = boundaries.locate(lon[candidates], lat[candidates])
+    rows, found = candidates[found >= 0], found[found >= 0]
+    report = {"missing": int(missing.sum()), "backfilled": len(rows)}
+    if not len(rows):
+        return df_gas, report
+
+    municipality_ids = boundaries.municipality_ids[found]
+    df_gas = df_gas.copy()
+    for col, values in [
+        ("EntidadFederativaId", municipality_ids // MUNICIPALITY_FACTOR),
+        ("MunicipioId", municipality_ids % MUNICIPALITY_FACTOR)
+    ]:
+        column = df_gas[col].to_numpy(dtype=float, na_value=np.nan, copy=True)
+        column[rows] = values
+        df_gas[col] = pd.Series(column, index=df_gas.index).astype(df_gas[col].dtype)
+    for col, values in [
+        ("state_name", state_names(municipality_ids // MUNICIPALITY_FACTOR)),
+        ("municipality_name", boundaries.names[found])
+    ]:
+        column = df_gas[col].to_numpy(dtype=object, copy=True)
+        column[rows] = values
+        df_gas[col] = column
+    return df_gas, report
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill station geography from municipality polygons.")
+    parser.add_argument("gas_prices", nargs="?", default=DATA_DIR / "gas_prices_clean.csv", type=Path)
+    parser.add_argument("--boundaries", default=BOUNDARIES_FILE, type=Path)
+    parser.add_argument("--output", type=Path, help="Defaults to overwriting the input file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    boundaries = load_boundaries(args.boundaries)
+    loaded = time.perf_counter()
+    df_gas, report = backfill_geography(pd.read_csv(args.gas_prices, dtype={"cre_id": str}), boundaries)
+    elapsed = time.perf_counter() - loaded
+    output = args.output or args.gas_prices
+    df_gas.to_csv(output, index=False)
+    print(
+        f"Backfilled {report['backfilled']:,} of {report['missing']:,} stations without geography "
+        f"({len(boundaries):,} polygons loaded in {loaded - start:.2f}s, located in {elapsed:.2f}s); wrote {output}"
+    )
+
+if __name__ == "__main__":
+    main()
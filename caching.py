@@ -0,0 +1,247 @@
+"""
+Process-wide cache for loaded and prepared DataFrames and the chart figures built from them.
+
+Entries are shared by every Streamlit session served by the same process:
+- keys are content hashes of the input files (and, for preparation steps,
+  the keys of the frames they were derived from); figures are keyed on
+  their input tables plus the widget values they depend on (args_key)
+- cached values are handed out read-only or as copies, so a session never
+  changes what other sessions see: frames become copy-on-write views (deep
+  copies unless enable_copy_on_write() was called), arrays read-only views and
+  Plotly figures copies
+- entries expire after CACHE_TTL_SECONDS and the least recently used ones
+  are evicted once the cache holds more than CACHE_MAX_BYTES
+"""
+import functools
+import hashlib
+import threading
+import weakref
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from cachetools import TLRUCache
+
+# Configuration
+CACHE_MAX_BYTES = 512 * 1024 ** 2
+CACHE_TTL_SECONDS = 60 * 60
+
+def enable_copy_on_write():
+    """
+    Turn on pandas copy-on-write (always on from pandas 3.0), so cached frames are
+    shared as shallow views. Called by the entry points (app, precompute, benchmark),
+    not on import, as it changes pandas semantics for the whole process.
+    """
+    if int(pd.__version__.split(".")[0]) < 3:
+        pd.set_option("mode.copy_on_write", True)
+
+def _copy_on_write():
+    return int(pd.__version__.split(".")[0]) >= 3 or pd.get_option("mode.copy_on_write") is True
+
+# -------------------------------------------------------------------------
+# Content Hashing
+# -------------------------------------------------------------------------
+
+# (resolved path, mtime_ns, size) -> sha256, so unchanged files are only read once
+_file_digests = {}
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents, memoized on its path, mtime and size."""
+    path = Path(path)
+    stat = path.stat()
+    memo_key = (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+    digest = _file_digests.get(memo_key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        _file_digests[memo_key] = digest
+    return digest
+
+def hash_files(paths):
+    """SHA-256 over the names and contents of the given files (missing files hash as such)."""
+    sha = hashlib.sha256()
+    for path in paths:
+        path = Path(path)
+        sha.update(path.name.encode("utf-8"))
+        sha.update(file_digest(path).encode("ascii") if path.exists() else b"<missing>")
+    return sha.hexdigest()
+
+# Frames returned by the cache remember the key they were produced under,
+# so downstream steps can be keyed on their inputs' lineage without re-hashing them.
+_frame_keys = {}
+
+def _register_frame(df, key):
+    frame_id = id(df)
+    _frame_keys[frame_id] = (weakref.ref(df, lambda _: _frame_keys.pop(frame_id, None)), key)
+
+def frame_key(df):
+    """Cache key of a DataFrame: its lineage key if it came from the cache, else a content hash."""
+    entry = _frame_keys.get(id(df))
+    if entry is not None and entry[0]() is df:
+        return entry[1]
+    sha = hashlib.sha256()
+    sha.update(repr(list(df.columns)).encode("utf-8"))
+    sha.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return sha.hexdigest()
+
+# JSON size of figures by object, measured once when a figure enters the cache and
+# passed on to every copy handed out, so cached figures are never serialized again
+_figure_sizes = {}
+
+def _register_figure(fig, size):
+    figure_id = id(fig)
+    _figure_sizes[figure_id] = (weakref.ref(fig, lambda _: _figure_sizes.pop(figure_id, None)), size)
+
+def figure_size(fig):
+    """JSON size of a Plotly figure as built (or as cached), memoized per figure object."""
+    entry = _figure_sizes.get(id(fig))
+    if entry is not None and entry[0]() is fig:
+        return entry[1]
+    size = len(fig.to_json())
+    _register_figure(fig, size)
+    return size
+
+def value_key(value):
+    """Hashable key of an argument: frame keys for DataFrames, structural keys for containers."""
+    if isinstance(value, pd.DataFrame):
+        return frame_key(value)
+    if isinstance(value, pd.Series):
+        return frame_key(value.to_frame())
+    if isinstance(value, np.ndarray):
+        return (str(value.dtype), value.shape, hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest())
+    if isinstance(value, dict):
+        return tuple((k, value_key(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(v, float) for v in value):
+            # Long numeric lists (e.g. price samples) hash as one array
+            return value_key(np.asarray(value, dtype=float))
+        return tuple(value_key(v) for v in value)
+    return value
+
+def args_key(*args, **kwargs):
+    """Key function for cached() covering every positional and keyword argument."""
+    return value_key(args), value_key(dict(sorted(kwargs.items())))
+
+# -------------------------------------------------------------------------
+# Cache
+# -------------------------------------------------------------------------
+
+def _nbytes(value):
+    """Approximate memory held by a cached value (figures count their JSON payload)."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, go.Figure):
+        return figure_size(value)
+    if hasattr(value, "nbytes"):
+        # Arrays, and objects summing their arrays (StationIndex, VolumeSeries)
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_nbytes(item) for item in value.values())
+    return 64
+
+class _FrameCache(TLRUCache):
+    """TTL + size bounded LRU cache that counts evictions."""
+
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize=maxsize, ttu=lambda key, value, now: now + ttl, getsizeof=_nbytes)
+        self.evictions = 0
+
+    def popitem(self):
+        self.evictions += 1
+        return super().popitem()
+
+_cache = _FrameCache(maxsize=CACHE_MAX_BYTES, ttl=CACHE_TTL_SECONDS)
+_lock = threading.RLock()
+_stats = {"hits": 0, "misses": 0}
+
+def _freeze(value):
+    """Mark the arrays of a value being cached read-only."""
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            _freeze(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _freeze(item)
+
+def _share(value, key):
+    """
+    Hand out a cached value: frames become views (or copies) tagged with their key,
+    arrays read-only views and figures copies. Other objects are shared as they are
+    and must not be modified (StationIndex and VolumeSeries keep read-only arrays).
+    """
+    if isinstance(value, pd.DataFrame):
+        shared = value.copy(deep=not _copy_on_write())
+        _register_frame(shared, key)
+        return shared
+    if isinstance(value, np.ndarray):
+        return value.view()
+    if isinstance(value, go.Figure):
+        shared = go.Figure(value)
+        _register_figure(shared, figure_size(value))
+        return shared
+    if isinstance(value, tuple):
+        return tuple(_share(item, (key, i)) for i, item in enumerate(value))
+    if isinstance(value, list):
+        return [_share(item, (key, i)) for i, item in enumerate(value)]
+    if isinstance(value, dict):
+        return {k: _share(item, (key, k)) for k, item in value.items()}
+    return value
+
+def cached(key_func):
+    """
+    Decorator caching a function's result in the shared cache.
+    key_func receives the same arguments and returns the content-based key.
+    The undecorated function stays available as .uncached.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__module__, func.__qualname__, key_func(*args, **kwargs))
+            with _lock:
+                value = _cache.get(key)
+                if value is not None:
+                    _stats["hits"] += 1
+                    return _share(value, key)
+                _stats["misses"] += 1
+
+            value = func(*args, **kwargs)
+            _freeze(value)
+            with _lock:
+                try:
+                    _cache[key] = value
+                except ValueError:
+                    # Larger than the whole cache: serve it without caching
+                    pass
+            return _share(value, key)
+
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+def cache_stats():
+    """Hit/miss/eviction counters plus the current number of entries and bytes held."""
+    with _lock:
+        _cache.expire()
+        return {
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "evictions": _cache.evictions,
+            "entries": len(_cache),
+            "bytes": int(_cache.currsize),
+            "max_bytes": int(_cache.maxsize)
+        }
+
+def clear_cache():
+    """Drop every entry (counters are kept)."""
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,371 @@
+"""
+Station entity resolution across the CRE registries.
+
+Links the stations of the price table (place_id, cre_id) to the records of the
+other registries and writes a crosswalk with a match confidence per link:
+
+    place_id, cre_id, source, source_id, method, confidence
+
+Matching runs in two passes:
+1. "permit": exact join on the normalized permit number (PL/<n>/EXP/<type>/<year>),
+   for the registries that carry one; confidence 1.
+2. "fuzzy": the remaining records are compared on normalized name and address
+   tokens. Candidate pairs come from a blocking index on (state, token): only
+   records sharing a rare token (street name, house number, km marker, permit
+   prefix) in the same state are compared, never every pair. Records without a
+   state (on either side) are compared with every record sharing a token that
+   is rare nationally. Pairs are scored with an IDF-weighted cosine similarity
+   and assigned one-to-one, best first. A pair must share a word that names the
+   street or station (not a street type such as CALLE), two numbers (numbered
+   streets, as in Yucatán) or all of its tokens: a house number alone does not
+   make a link.
+
+ESTSERV.csv has no permit numbers or names; its postal code only gives its state.
+The other registries carry no postal code (fewer than 0.1% of their addresses
+include one), so postal codes are not a blocking key of their own.
+
+Usage:
+    python crosswalk.py                      # writes data/station_crosswalk.csv
+"""
+import argparse
+import functools
+import re
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from geography import UNKNOWN, state_ids
+
+# Configuration
+DATA_DIR = Path("data")
+CROSSWALK_FILE = DATA_DIR / "station_crosswalk.csv"
+MIN_CONFIDENCE = 0.5
+# Links below this confidence are kept in the crosswalk but not used to enrich stations
+ENRICH_MIN_CONFIDENCE = 0.65
+# (state, token) blocks holding more records than this are too common to block on
+MAX_BLOCK_SIZE = 30
+ESTSERV_PRODUCTS = {"MAGNA": "sells_regular", "PREMIUM": "sells_premium", "DIESEL": "sells_diesel", "DME": "sells_dme"}
+
+# Abbreviations expanded before tokenizing, and words that never identify a station
+ABBREVIATIONS = {
+    "AV": "AVENIDA", "AVE": "AVENIDA", "AVDA": "AVENIDA",
+    "BLVD": "BOULEVARD", "BLVR": "BOULEVARD", "BOULERVARD": "BOULEVARD", "BULEVAR": "BOULEVARD",
+    "CARR": "CARRETERA", "CARRET": "CARRETERA", "CTRA": "CARRETERA",
+    "CALZ": "CALZADA", "PROL": "PROLONGACION", "LIB": "LIBRAMIENTO", "PERIF": "PERIFERICO",
+    "GRAL": "GENERAL", "STA": "SANTA", "STO": "SANTO", "FRACC": "FRACCIONAMIENTO",
+    "OTE": "ORIENTE", "PTE": "PONIENTE", "NTE": "NORTE"
+}
+STOPWORDS = {
+    "DE", "DEL", "LA", "LAS", "LOS", "EL", "Y", "A", "E", "EN", "AL",
+    "N", "NO", "NUM", "NUMERO", "SN", "S", "SIN", "C", "P", "CP", "COL", "COLONIA", "ESQ", "ESQUINA",
+    # company boilerplate in station names
+    "SA", "CV", "SAPI", "RL", "SRL", "SC", "SPR", "AC", "ESTACION", "SERVICIO", "SERVICIOS",
+    "GASOLINERA", "GASOLINERAS", "CARGA", "GRUPO"
+}
+
+# Mexican postal codes start with a state-specific two-digit prefix
+POSTAL_PREFIX_STATES = [
+    (1, 16, "Ciudad de México"), (20, 20, "Aguascalientes"), (21, 22, "Baja California"),
+    (23, 23, "Baja California Sur"), (24, 24, "Campeche"), (25, 27, "Coahuila de Zaragoza"),
+    (28, 28, "Colima"), (29, 30, "Chiapas"), (31, 33, "Chihuahua"), (34, 35, "Durango"),
+    (36, 38, "Guanajuato"), (39, 41, "Guerrero"), (42, 43, "Hidalgo"), (44, 49, "Jalisco"),
+    (50, 57, "México"), (58, 61, "Michoacán de Ocampo"), (62, 62, "Morelos"), (63, 63, "Nayarit"),
+    (64, 67, "Nuevo León"), (68, 71, "Oaxaca"), (72, 75, "Puebla"), (76, 76, "Querétaro"),
+    (77, 77, "Quintana Roo"), (78, 79, "San Luis Potosí"), (80, 82, "Sinaloa"), (83, 85, "Sonora"),
+    (86, 86, "Tabasco"), (87, 89, "Tamaulipas"), (90, 90, "Tlaxcala"),
+    (91, 96, "Veracruz de Ignacio de la Llave"), (97, 97, "Yucatán"), (98, 99, "Zacatecas")
+]
+INVALID_POSTAL_CODES = {"00000", "99999"}
+
+PERMIT_PATTERN = re.compile(r"PL/0*(\d+)/EXP/([A-Z]+(?:/[A-Z]+)?)/(\d{4})")
+# House numbers and km markers: shared alone, they link unrelated stations on different streets
+NUMBER_PATTERN = r"\d+|KM[\d.+]+"
+# Words naming a kind of street rather than a street ("Periférico Oriente" and "Libramiento Sur" are names)
+STREET_TYPES = {
+    "CALLE", "AVENIDA", "BOULEVARD", "CALZADA", "CARRETERA", "PROLONGACION", "CAMINO",
+    "PRIVADA", "CERRADA", "CIRCUITO", "ANDADOR", "VIA", "LOTE", "MANZANA"
+}
+
+# -------------------------------------------------------------------------
+# Normalization
+# -------------------------------------------------------------------------
+
+@functools.lru_cache(maxsize=None)
+def normalize_text(value):
+    """Uppercase ASCII words of a string: accents stripped, punctuation removed, abbreviations expanded."""
+    if not isinstance(value, str):
+        return ""
+    text = unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode("ascii").upper()
+    # "KM. 41.5" / "KM 0+300" -> one KM41.5 / KM0+300 token
+    text = re.sub(r"\bKM\.?\s*(\d[\d.+]*)", lambda m: "KM" + m.group(1).rstrip("."), text)
+    words = re.findall(r"KM[\d.+]+|[A-Z0-9]+", text)
+    return " ".join(ABBREVIATIONS.get(word, word) for word in words)
+
+def normalize_permit(value):
+    """Canonical PL/<n>/EXP/<type>/<year> permit number, or None if value is not one."""
+    if not isinstance(value, str):
+        return None
+    compact = re.sub(r"[\s]+", "", value.upper()).replace("-", "/").replace("_", "/")
+    match = PERMIT_PATTERN.search(re.sub(r"/+", "/", compact))
+    if match is None:
+        return None
+    number, kind, year = match.groups()
+    return f"PL/{int(number)}/EXP/{kind}/{year}"
+
+def postal_code_state(postal_code):
+    """State name for a postal code (None when missing or not a valid code)."""
+    if not isinstance(postal_code, str) or not postal_code.strip().isdigit():
+        return None
+    postal_code = postal_code.strip().zfill(5)
+    if len(postal_code) != 5 or postal_code in INVALID_POSTAL_CODES:
+        return None
+    prefix = int(postal_code[:2])
+    for first, last, state in POSTAL_PREFIX_STATES:
+        if first <= prefix <= last:
+            return state
+    return None
+
+def _tokens(text, field):
+    return {f"{field}:{word}" for word in text.split() if word not in STOPWORDS and len(word) > 1}
+
+def record_tokens(records):
+    """Field-tagged token set per record: name words, address words and the permit prefix."""
+    tokens = []
+    for name, address, permit in zip(records["name"], records["address"], records["permit"]):
+        record = _tokens(normalize_text(name), "name") | _tokens(normalize_text(address), "address")
+        if permit is not None:
+            # Permit number prefix + year, to catch typos in the last digits
+            number, year = permit.split("/")[1], permit.split("/")[-1]
+            record.add(f"permit:{number[:-1] or '0'}x/{year}")
+        tokens.append(record)
+    return tokens
+
+# -------------------------------------------------------------------------
+# Registries
+# -------------------------------------------------------------------------
+# Each registry is reduced to the same record layout:
+# source_id, state (state_id, see geography.py), permit (normalized or None), name, address
+
+def _records(source_id, state, permit, name, address):
+    return pd.DataFrame({
+        "source_id": source_id.astype(str).to_numpy(),
+        "state": state_ids(state),
+        "permit": [normalize_permit(value) for value in permit],
+        "name": name.to_numpy(dtype=object),
+        "address": address.to_numpy(dtype=object)
+    })
+
+def station_records(df_station):
+    """Records of the price table, keyed on place_id."""
+    df_station = df_station.drop_duplicates(subset=["place_id"])
+    records = _records(
+        df_station["place_id"], df_station["state_name"], df_station["cre_id"],
+        df_station["name"], df_station["address"]
+    )
+    records["cre_id"] = df_station["cre_id"].to_numpy(dtype=object)
+    return records
+
+def load_registry_records(path=DATA_DIR / "gasolineras_mx.csv"):
+    df = pd.read_csv(path, dtype=str)
+    return _records(df["Numero"], df["EntidadNombre"], df["Numero"], df["Nombre"], df["Direccion"])
+
+def load_cdmx_records(path=DATA_DIR / "Gasolineras CDMX (generated).csv"):
+    df = pd.read_csv(path, dtype=str)
+    return _records(
+        df["No de Permiso"], df["Entidad Federativa"], df["No de Permiso"],
+        df["Nombre de la gasolinera"], df["Dirección"]
+    )
+
+def load_estserv(path=DATA_DIR / "ESTSERV.csv"):
+    """ESTSERV table (latin-1, two header rows) with its S/N product columns as booleans."""
+    df = pd.read_csv(path, header=1, encoding="latin-1", dtype=str)
+    df = df.dropna(subset=["NO. ES"])[["NO. ES", "UBICACION", "COLONIA", "CP", *ESTSERV_PRODUCTS]]
+    for column in ESTSERV_PRODUCTS:
+        df[column] = df[column].str.strip().eq("S")
+    return df.reset_index(drop=True)
+
+def estserv_records(df_estserv):
+    """ESTSERV has no permit numbers or names: records carry the address and the postal code's state."""
+    return _records(
+        df_estserv["NO. ES"], df_estserv["CP"].map(postal_code_state), pd.Series([None] * len(df_estserv)),
+        pd.Series([None] * len(df_estserv), dtype=object), df_estserv["UBICACION"]
+    )
+
+# -------------------------------------------------------------------------
+# Matching
+# -------------------------------------------------------------------------
+
+def _permit_matches(left, right):
+    """Exact joins on the normalized permit (unique permits on both sides only)."""
+    left_ids = left[left["permit"].notna()].drop_duplicates("permit", keep=False)
+    right_ids = right[right["permit"].notna()].drop_duplicates("permit", keep=False)
+    pairs = left_ids.reset_index().merge(right_ids.reset_index(), on="permit", suffixes=("_left", "_right"))
+    return pd.DataFrame({
+        "left": pairs["index_left"].to_numpy(),
+        "right": pairs["index_right"].to_numpy(),
+        "confidence": 1.0
+    })
+
+def _token_table(records, tokens, fields):
+    """One row per (record, token) for tokens of the compared fields."""
+    rows = [
+        (i, token) for i, record in enumerate(tokens)
+        for token in record if token.split(":", 1)[0] in fields
+    ]
+    table = pd.DataFrame(rows, columns=["record", "token"])
+    table["state"] = records["state"].to_numpy()[table["record"].to_numpy()]
+    return table
+
+def _fuzzy_matches(left, right, fields, exclude_left=(), exclude_right=()):
+    """
+    Best one-to-one pairs by IDF-weighted token cosine among candidates sharing
+    a rare (state, token) block. Records without a state, on either or both sides,
+    block on the tokens that are rare nationally. Pairs sharing only numbers and
+    street types count when they share two numbers ("21 X 36 Y 38 No. 130") or
+    every token, never on one house number.
+    """
+    left_tokens = _token_table(left, record_tokens(left), fields)
+    right_tokens = _token_table(right, record_tokens(right), fields)
+    left_tokens = left_tokens[~left_tokens["record"].isin(exclude_left)]
+    right_tokens = right_tokens[~right_tokens["record"].isin(exclude_right)]
+    if left_tokens.empty or right_tokens.empty:
+        return pd.DataFrame({"left": [], "right": [], "confidence": []})
+
+    # IDF over both sides; each record's norm covers all its compared tokens
+    both = pd.concat([left_tokens, right_tokens], ignore_index=True)
+    n_records = left_tokens["record"].nunique() + right_tokens["record"].nunique()
+    idf = np.log(n_records / both.groupby("token").size())
+    left_tokens["weight"] = left_tokens["token"].map(idf)
+    right_tokens["weight"] = right_tokens["token"].map(idf)
+    left_norm = np.sqrt((left_tokens["weight"] ** 2).groupby(left_tokens["record"]).sum())
+    right_norm = np.sqrt((right_tokens["weight"] ** 2).groupby(right_tokens["record"]).sum())
+
+    # Blocking index: (state, token) keys small enough to compare every pair inside them
+    block_sizes = both.groupby(["state", "token"]).size()
+    national_sizes = both.groupby("token").size()
+    candidates = []
+    for side_left, side_right in [(True, True), (False, True), (True, False), (False, False)]:
+        # stated x stated on (state, token); missing states on the token alone
+        lhs = left_tokens[(left_tokens["state"] != UNKNOWN) == side_left]
+        rhs = right_tokens[(right_tokens["state"] != UNKNOWN) == side_right]
+        if side_left and side_right:
+            sizes = block_sizes.reindex(pd.MultiIndex.from_frame(lhs[["state", "token"]])).to_numpy()
+            lhs = lhs[sizes <= MAX_BLOCK_SIZE]
+            pairs = lhs.merge(rhs, on=["state", "token"], suffixes=("_left", "_right"))
+        else:
+            lhs = lhs[lhs["token"].map(national_sizes).to_numpy() <= MAX_BLOCK_SIZE]
+            pairs = lhs.merge(rhs, on="token", suffixes=("_left", "_right"))
+        candidates.append(pairs[["record_left", "record_right"]])
+    candidates = pd.concat(candidates, ignore_index=True).drop_duplicates()
+    if candidates.empty:
+        return pd.DataFrame({"left": [], "right": [], "confidence": []})
+
+    # Cosine over every token a candidate pair shares
+    shared = candidates.merge(
+        left_tokens[["record", "token", "weight"]].rename(columns={"record": "record_left"}), on="record_left"
+    ).merge(
+        right_tokens[["record", "token"]].rename(columns={"record": "record_right"}), on=["record_right", "token"]
+    )
+    shared["weight"] = shared["weight"] ** 2
+    words = shared["token"].str.split(":", n=1).str[1]
+    shared["numbers"] = words.str.fullmatch(NUMBER_PATTERN)
+    shared["words"] = ~shared["numbers"] & ~words.isin(STREET_TYPES)
+    scores = shared.groupby(["record_left", "record_right"])[["weight", "numbers", "words"]].sum().reset_index()
+    scores["confidence"] = scores["weight"] / (
+        scores["record_left"].map(left_norm).to_numpy() * scores["record_right"].map(right_norm).to_numpy()
+    )
+    # Rounded so ties break on record order, whatever the summation order
+    scores["confidence"] = scores["confidence"].round(9)
+    # A shared house number alone links unrelated stations ("BOULEVARD FORJADORES 2612" /
+    # "CALLE 4 NORTE 2612"): pairs also need a shared street or station word, two shared
+    # numbers (numbered streets) or the same tokens on both sides ("CALLE 6 N 1450")
+    evidence = (scores["words"] > 0) | (scores["numbers"] >= 2) | (scores["confidence"] >= 1)
+    scores = scores[evidence & (scores["confidence"] >= MIN_CONFIDENCE)].sort_values(
+        ["confidence", "record_left", "record_right"], ascending=[False, True, True]
+    )
+
+    # Greedy one-to-one assignment, best pair first
+    used_left, used_right, kept = set(), set(), []
+    for record_left, record_right, confidence in zip(scores["record_left"], scores["record_right"], scores["confidence"]):
+        if record_left in used_left or record_right in used_right:
+            continue
+        used_left.add(record_left)
+        used_right.add(record_right)
+        kept.append((record_left, record_right, min(float(confidence), 1.0)))
+    return pd.DataFrame(kept, columns=["left", "right", "confidence"])
+
+def match_records(left, right, fields=("name", "address", "permit")):
+    """
+    Links between the station records (left) and a registry's records (right):
+    DataFrame of left/right positions, method ("permit" or "fuzzy") and confidence.
+    """
+    exact = _permit_matches(left, right)
+    exact["method"] = "permit"
+    fuzzy = _fuzzy_matches(left, right, fields, exact["left"], exact["right"])
+    fuzzy["method"] = "fuzzy"
+    return pd.concat([exact, fuzzy], ignore_index=True)
+
+def build_crosswalk(df_station, sources):
+    """
+    Crosswalk of the price table's stations to every registry in sources:
+    {source name: (records, compared fields)}.
+    """
+    left = station_records(df_station)
+    tables = []
+    for source, (records, fields) in sources.items():
+        links = match_records(left, records, fields)
+        positions_left = links["left"].to_numpy(dtype=np.int64)
+        positions_right = links["right"].to_numpy(dtype=np.int64)
+        tables.append(pd.DataFrame({
+            "place_id": left["source_id"].to_numpy()[positions_left].astype(np.int64),
+            "cre_id": left["cre_id"].to_numpy()[positions_left],
+            "source": source,
+            "source_id": records["source_id"].to_numpy()[positions_right],
+            "method": links["method"].to_numpy(),
+            "confidence": links["confidence"].round(3).to_numpy()
+        }))
+    return pd.concat(tables, ignore_index=True)
+
+def default_sources(data_dir=DATA_DIR):
+    """The registries shipped in data/ and the fields each one can be compared on."""
+    data_dir = Path(data_dir)
+    return {
+        "gasolineras_mx": (load_registry_records(data_dir / "gasolineras_mx.csv"), ("name", "address", "permit")),
+        "cdmx": (load_cdmx_records(data_dir / "Gasolineras CDMX (generated).csv"), ("name", "address", "permit")),
+        "estserv": (estserv_records(load_estserv(data_dir / "ESTSERV.csv")), ("address",))
+    }
+
+# -------------------------------------------------------------------------
+# Enrichment
+# -------------------------------------------------------------------------
+
+def add_estserv_products(df_station, crosswalk, df_estserv, min_confidence=ENRICH_MIN_CONFIDENCE):
+    """
+    Add ESTSERV's product flags (sells_regular, sells_premium, sells_diesel, sells_dme)
+    to the stations linked with at least min_confidence; NA for unlinked stations.
+    """
+    links = crosswalk[(crosswalk["source"] == "estserv") & (crosswalk["confidence"] >= min_confidence)]
+    flags = df_estserv.rename(columns={"NO. ES": "source_id", **ESTSERV_PRODUCTS})
+    flags = links[["place_id", "source_id"]].merge(flags[["source_id", *ESTSERV_PRODUCTS.values()]], on="source_id")
+    df = df_station.merge(flags.drop(columns="source_id"), on="place_id", how="left")
+    df[list(ESTSERV_PRODUCTS.values())] = df[list(ESTSERV_PRODUCTS.values())].astype("boolean")
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description="Link the price table's stations to the other registries.")
+    parser.add_argument("--gas-prices", default=DATA_DIR / "gas_prices_clean.csv", type=Path)
+    parser.add_argument("--data-dir", default=DATA_DIR, type=Path)
+    parser.add_argument("--output", default=CROSSWALK_FILE, type=Path)
+    args = parser.parse_args()
+
+    crosswalk = build_crosswalk(pd.read_csv(args.gas_prices, dtype={"cre_id": str}), default_sources(args.data_dir))
+    crosswalk.to_csv(args.output, index=False)
+    counts = crosswalk.groupby(["source", "method"]).size()
+    print(f"Wrote {len(crosswalk):,} links to {args.output}")
+    for (source, method), count in counts.items():
+        print(f"  {source:15s} {method:7s} {count:,}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Aggregation cube over the station/price frame.
+
+build_cube makes one pass over the prepared price frame and returns every
+statistic the Station and Price tabs need, per (state, municipality, fuel)
+plus state and national rollups:
+
+    level         "municipality", "state" or "national"
+    state_name    None at national level
+    municipality_name
+                  None at state and national level
+    fuel          "all" (every station row) or a price column, e.g. "regular_price"
+    count         rows with a value (all stations for fuel="all")
+    stations      distinct place_id among those rows
+    listed        distinct stations listing a price before outlier removal
+    municipalities
+                  distinct municipalities among those rows
+    sum, mean, min, max, q1, median, q3
+                  price statistics (NaN for fuel="all"); quartiles use linear interpolation
+    lower_fence, upper_fence
+                  box-plot whiskers: the most extreme values within 1.5 IQR of the quartiles
+"""
+import numpy as np
+import pandas as pd
+
+from geography import UNKNOWN
+
+# Configuration
+FUEL_COLUMNS = ["regular_price", "premium_price", "diesel_price"]
+ALL_FUELS = "all"
+LEVELS = ["municipality", "state", "national"]
+QUANTILES = {"q1": 0.25, "median": 0.5, "q3": 0.75}
+WHISKER_IQR = 1.5
+STAT_COLUMNS = ["sum", "mean", "min", "max", *QUANTILES, "lower_fence", "upper_fence"]
+
+# -------------------------------------------------------------------------
+# Grouped Statistics
+# -------------------------------------------------------------------------
+
+def _distinct_per_group(group_ids, values, n_groups):
+    """Number of distinct non-negative values per group."""
+    valid = values >= 0
+    group_ids, values = group_ids[valid], values[valid]
+    order = np.lexsort((values, group_ids))
+    g, v = group_ids[order], values[order]
+    first = np.ones(len(g), dtype=bool)
+    first[1:] = (g[1:] != g[:-1]) | (v[1:] != v[:-1])
+    return np.bincount(g[first], minlength=n_groups)
+
+def _group_stats(group_ids, values, place_codes, municipality_codes, n_groups):
+    """
+    Count, distinct stations/municipalities, sum, min, max and quartiles of values per group.
+    Rows whose value is NaN are ignored.
+    """
+    valid = ~np.isnan(values)
+    group_ids, values = group_ids[valid], values[valid]
+    place_codes, municipality_codes = place_codes[valid], municipality_codes[valid]
+
+    counts = np.bincount(group_ids, minlength=n_groups)
+    stats = {
+        "count": counts,
+        "stations": _distinct_per_group(group_ids, place_codes, n_groups),
+        "municipalities": _distinct_per_group(group_ids, municipality_codes, n_groups),
+        "sum": np.bincount(group_ids, weights=values, minlength=n_groups),
+    }
+
+    # Sort by (group, value) once; min/max/quantiles are positional lookups
+    order = np.lexsort((values, group_ids))
+    sorted_values = values[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    has_rows = counts > 0
+    last = np.maximum(counts - 1, 0)
+
+    def at(positions):
+        out = np.full(n_groups, np.nan)
+        out[has_rows] = sorted_values[positions[has_rows]]
+        return out
+
+    stats["min"] = at(starts)
+    stats["max"] = at(starts + last)
+    for name, q in QUANTILES.items():
+        position = starts + q * last
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        weight = position - lower
+        stats[name] = at(lower) * (1 - weight) + at(upper) * weight
+
+    # Whiskers: reduce each group's values inside its fences
+    iqr = stats["q3"] - stats["q1"]
+    sorted_groups = group_ids[order]
+    low = stats["q1"][sorted_groups] - WHISKER_IQR * iqr[sorted_groups]
+    high = stats["q3"][sorted_groups] + WHISKER_IQR * iqr[sorted_groups]
+    stats["lower_fence"] = np.full(n_groups, np.nan)
+    stats["upper_fence"] = np.full(n_groups, np.nan)
+    if has_rows.any():
+        group_starts = starts[has_rows]
+        stats["lower_fence"][has_rows] = np.minimum.reduceat(
+            np.where(sorted_values >= low, sorted_values, np.inf), group_starts)
+        stats["upper_fence"][has_rows] = np.maximum.reduceat(
+            np.where(sorted_values <= high, sorted_values, -np.inf), group_starts)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stats["mean"] = np.where(has_rows, stats["sum"] / counts, np.nan)
+    return stats
+
+def _first_rows(group_ids, n_groups):
+    """Index of the first row of each group (used to label the groups)."""
+    valid = np.flatnonzero(group_ids >= 0)
+    groups, first = np.unique(group_ids[valid], return_index=True)
+    rows = np.zeros(n_groups, dtype=np.int64)
+    rows[groups] = valid[first]
+    return rows
+
+# -------------------------------------------------------------------------
+# Cube
+# -------------------------------------------------------------------------
+
+def build_cube(df_price, df_station=None):
+    """
+    Build the aggregation cube from the prepared price frame (with the municipality_id
+    column added by prepare_station_data).
+    df_station (the frame before outlier removal, same rows) only feeds the
+    "listed" column; without it "listed" equals "stations".
+    """
+    df = df_price[df_price["place_id"].notna()]
+    state_codes, _ = pd.factorize(df["state_name"], sort=True)
+    # Municipalities are grouped on their integer id (see geography.py), not their spelling
+    mun_ids = df["municipality_id"].to_numpy(dtype=float, na_value=np.nan)
+    mun_ids = np.where(np.isnan(mun_ids), UNKNOWN, mun_ids).astype(np.int64)
+    mun_codes = np.full(len(df), -1, dtype=np.int64)
+    known = mun_ids != UNKNOWN
+    mun_codes[known] = np.unique(mun_ids[known], return_inverse=True)[1]
+    place_codes, _ = pd.factorize(df["place_id"])
+
+    # Group ids of each level; municipalities are keyed within their state
+    has_pair = (state_codes >= 0) & (mun_codes >= 0)
+    pair_codes = state_codes.astype(np.int64) * (mun_codes.max() + 1) + mun_codes
+    municipality_ids = np.full(len(df), -1, dtype=np.int64)
+    municipality_ids[has_pair] = np.unique(pair_codes[has_pair], return_inverse=True)[1]
+    # Number the municipalities in (state, name) order, the order the tables list them in
+    n_municipalities = municipality_ids.max() + 1 if len(df) else 0
+    first = _first_rows(municipality_ids, n_municipalities)
+    names = df["municipality_name"].astype(str).to_numpy()[first]
+    rank = np.empty(n_municipalities, dtype=np.int64)
+    rank[np.lexsort((names, state_codes[first]))] = np.arange(n_municipalities)
+    municipality_ids[has_pair] = rank[municipality_ids[has_pair]]
+    level_groups = {
+        "municipality": municipality_ids,
+        "state": state_codes.astype(np.int64),
+        "national": np.zeros(len(df), dtype=np.int64)
+    }
+
+    state_labels = df["state_name"].astype(object).to_numpy()
+    mun_labels = df["municipality_name"].astype(object).to_numpy()
+
+    value_columns = {ALL_FUELS: np.zeros(len(df))}
+    for fuel in FUEL_COLUMNS:
+        value_columns[fuel] = df[fuel].to_numpy(dtype=float, na_value=np.nan)
+    listed_source = df_station.loc[df.index] if df_station is not None else df
+
+    frames = []
+    for level in LEVELS:
+        ids = level_groups[level]
+        in_level = ids >= 0
+        if not in_level.any():
+            continue
+        n_groups = ids.max() + 1
+        rows = _first_rows(ids, n_groups)
+        for fuel, values in value_columns.items():
+            stats = _group_stats(ids[in_level], values[in_level], place_codes[in_level],
+                                 mun_codes[in_level], n_groups)
+            if fuel == ALL_FUELS:
+                for name in STAT_COLUMNS:
+                    stats[name] = np.full(n_groups, np.nan)
+                stats["listed"] = stats["stations"]
+            else:
+                listed = in_level & listed_source[fuel].notna().to_numpy()
+                stats["listed"] = _distinct_per_group(ids[listed], place_codes[listed], n_groups)
+            frame = pd.DataFrame(stats)
+            frame.insert(0, "level", level)
+            frame.insert(1, "state_name", state_labels[rows] if level != "national" else None)
+            frame.insert(2, "municipality_name", mun_labels[rows] if level == "municipality" else None)
+            frame.insert(3, "fuel", fuel)
+            frames.append(frame)
+
+    cube = pd.concat(frames, ignore_index=True)
+    return cube[["level", "state_name", "municipality_name", "fuel", "count", "stations", "listed",
+                 "municipalities", *STAT_COLUMNS]]
+
+def cube_slice(cube, level, fuel=ALL_FUELS):
+    """Rows of one level and fuel, without the constant level/fuel columns."""
+    rows = cube[(cube["level"] == level) & (cube["fuel"] == fuel)]
+    return rows.drop(columns=["level", "fuel"]).reset_index(drop=True)
+
+def national_value(cube, fuel, stat):
+    """A single national statistic, e.g. national_value(cube, "regular_price", "mean")."""
+    rows = cube_slice(cube, "national", fuel)
+    return rows[stat].iloc[0] if len(rows) else np.nan
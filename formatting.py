@@ -0,0 +1,153 @@
+"""
+Vectorized number formatting for chart labels and tooltips.
+
+Every function takes a scalar, list, NumPy array or pandas Series and formats all
+values at once with NumPy string operations (no per-row Python calls).
+Array-like input returns a NumPy array of strings, scalar input returns a str.
+
+Conventions (same as the f-strings the charts used before):
+    format_number(1234.5, 1, thousands=True)     -> "1,234.5"
+    format_number(0.25, 2, sign=True)            -> "+0.25"   (no "+" for zero, no "-" for -0.0)
+    format_price(24.259)                         -> "$24.26"
+    format_percent(-1.25, 1, sign=True)          -> "-1.2%"
+    format_population(1500412)                   -> "1.5M"     (below 1M: "800K")
+    format_volume(1.5e9)                         -> "1.50B liters"
+    format_currency(1.2e13, True, True)          -> "$12.00T MXN (USD 600.00B)"
+
+Missing values format as "nan", like Python's f-strings. tests/test_formatting.py
+checks these conventions and the output of the per-row formatters they replaced.
+"""
+import numpy as np
+import pandas as pd
+
+# Configuration
+MXN_PER_USD = 20
+
+# -------------------------------------------------------------------------
+# Core Helpers
+# -------------------------------------------------------------------------
+
+def _as_float_array(values):
+    """Values as a float64 array plus whether the input was a scalar."""
+    if isinstance(values, (pd.Series, pd.Index)):
+        return values.to_numpy(dtype=float, na_value=np.nan), False
+    array = np.asarray(values, dtype=float)
+    return np.atleast_1d(array), array.ndim == 0
+
+def _result(strings, scalar):
+    return str(strings[0]) if scalar else strings
+
+def _group_thousands(whole):
+    """Digits of non-negative integers with "," between groups of three."""
+    groups = np.zeros(whole.shape, dtype=np.int64)
+    remaining = whole // 1000
+    while (remaining > 0).any():
+        groups += remaining > 0
+        remaining //= 1000
+
+    result = np.full(whole.shape, "", dtype=object).astype(str)
+    for k in range(int(groups.max()) if len(groups) else 0, -1, -1):
+        group = ((whole // 1000 ** k) % 1000).astype(str)
+        result = np.where(
+            k == groups,
+            group,
+            np.where(k < groups, np.char.add(np.char.add(result, ","), np.char.zfill(group, 3)), result)
+        )
+    return result
+
+def concat(*parts):
+    """Element-wise concatenation of string arrays and plain strings."""
+    result = None
+    for part in parts:
+        part = part.to_numpy(dtype=str) if isinstance(part, pd.Series) else np.asarray(part, dtype=str)
+        result = part if result is None else np.char.add(result, part)
+    return result
+
+# -------------------------------------------------------------------------
+# Numbers
+# -------------------------------------------------------------------------
+
+def format_number(values, decimals=0, thousands=False, sign=False):
+    """
+    Fixed-point formatting, like f"{x:.{decimals}f}" / f"{x:,.{decimals}f}".
+    sign=True prefixes "+" to positive values (zero stays unsigned).
+    Values exactly half-way between two outputs may round the other way than
+    the f-string would (e.g. 0.165 -> "0.17" instead of "0.16").
+    """
+    x, scalar = _as_float_array(values)
+    finite = np.isfinite(x)
+    scale = 10 ** decimals
+    # Round the fractional part on its own: |x| * scale loses precision for large values
+    magnitude = np.abs(np.where(finite, x, 0))
+    if decimals == 0:
+        magnitude = np.rint(magnitude)
+    whole = np.floor(magnitude)
+    fraction = np.round((magnitude - whole) * scale).astype(np.int64)
+    carry = fraction >= scale
+    whole = whole.astype(np.int64) + carry
+    fraction = np.where(carry, fraction - scale, fraction)
+
+    digits = _group_thousands(whole) if thousands else whole.astype(str)
+    if decimals > 0:
+        digits = concat(digits, ".", np.char.zfill(fraction.astype(str), decimals))
+
+    prefix = np.where(x < 0, "-", np.where(sign & (x > 0), "+", ""))
+    out = np.char.add(prefix, digits)
+    out = np.where(finite, out, np.char.add(prefix, np.char.lower(np.abs(x).astype(str))))
+    return _result(out, scalar)
+
+def format_price(values, decimals=2, thousands=False):
+    """Prices with a "$" prefix, e.g. "$24.26"."""
+    x, scalar = _as_float_array(values)
+    return _result(concat("$", format_number(x, decimals, thousands=thousands)), scalar)
+
+def format_percent(values, decimals=1, sign=False):
+    """Percentages with a "%" suffix, e.g. "12.3%" or "+1.2%" with sign=True."""
+    x, scalar = _as_float_array(values)
+    return _result(concat(format_number(x, decimals, sign=sign), "%"), scalar)
+
+def format_population(values):
+    """Population as "1.5M" (one decimal) from one million, otherwise truncated thousands "800K"."""
+    x, scalar = _as_float_array(values)
+    millions = concat(format_number(x / 1e6, 1), "M")
+    thousands = concat(np.trunc(np.where(np.isfinite(x), x, 0) / 1000).astype(np.int64).astype(str), "K")
+    out = np.where(x >= 1e6, millions, np.where(np.isfinite(x), thousands, "nan"))
+    return _result(out, scalar)
+
+# -------------------------------------------------------------------------
+# Volumes & Currency
+# -------------------------------------------------------------------------
+
+def _scaled(x, units):
+    """Format x in the first unit (threshold, suffix) it reaches; the last unit is the fallback."""
+    conditions = [x >= threshold for threshold, _ in units[:-1]]
+    choices = [concat(format_number(x / threshold, 2), suffix) for threshold, suffix in units]
+    return np.select(conditions, choices[:-1], default=choices[-1])
+
+def format_volume(values, include_label=True):
+    """Volumes in billions ("1.50B") or millions ("350.25M") of liters, 2 decimals."""
+    x, scalar = _as_float_array(values)
+    out = _scaled(x, [(1e9, "B"), (1e6, "M")])
+    if include_label:
+        out = concat(out, " liters")
+    return _result(out, scalar)
+
+def format_currency(values, include_currency=False, include_usd=False, mxn_per_usd=MXN_PER_USD):
+    """
+    Pesos in trillions, billions or millions, e.g. "$1.25T".
+    include_currency appends " MXN"; include_usd appends the dollar value,
+    e.g. "(USD 62.50B)" (shown in billions until it reaches a trillion).
+    """
+    x, scalar = _as_float_array(values)
+    out = concat("$", _scaled(x, [(1e12, "T"), (1e9, "B"), (1e6, "M")]))
+    if include_currency:
+        out = concat(out, " MXN")
+    if include_usd:
+        usd = x / mxn_per_usd
+        usd_text = np.where(
+            (x >= 1e9) & (usd < 1e12),
+            concat(format_number(usd / 1e9, 2), "B"),
+            _scaled(usd, [(1e12, "T"), (1e6, "M")])
+        )
+        out = concat(out, " (USD ", usd_text, ")")
+    return _result(out, scalar)
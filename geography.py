@@ -0,0 +1,111 @@
+"""
+Canonical geography keys.
+
+The datasets spell the same place differently ("Ciudad de Mexico" / "Ciudad de
+México", "ABASOLO" / "Abasolo", "Coahuila" / "Coahuila de Zaragoza"). Names are
+reduced to a normalization key (accents stripped, uppercase, single spaces) and
+mapped to integer ids, so joins run on integer columns:
+
+    state_id          INEGI state code, 1-32 (-1 when the name is not recognized)
+    municipality_id   state_id * 1000 + INEGI municipality code (CVEGEO as an integer)
+
+Normalization runs once per distinct spelling, not once per row:
+
+    state_ids(df["EntidadFederativa"])              # int16 array
+    municipality_ids(df_gas)                        # from EntidadFederativaId/MunicipioId
+
+Station tables carry INEGI codes, so municipalities are keyed on them rather than
+on their names (the cube groups on municipality_id, see cube.py).
+"""
+import numpy as np
+import pandas as pd
+
+# Configuration
+UNKNOWN = -1
+# INEGI state codes; names as spelled in population.csv and gas_prices_clean.csv
+STATES = {
+    1: "Aguascalientes", 2: "Baja California", 3: "Baja California Sur", 4: "Campeche",
+    5: "Coahuila de Zaragoza", 6: "Colima", 7: "Chiapas", 8: "Chihuahua",
+    9: "Ciudad de México", 10: "Durango", 11: "Guanajuato", 12: "Guerrero",
+    13: "Hidalgo", 14: "Jalisco", 15: "México", 16: "Michoacán de Ocampo",
+    17: "Morelos", 18: "Nayarit", 19: "Nuevo León", 20: "Oaxaca",
+    21: "Puebla", 22: "Querétaro", 23: "Quintana Roo", 24: "San Luis Potosí",
+    25: "Sinaloa", 26: "Sonora", 27: "Tabasco", 28: "Tamaulipas",
+    29: "Tlaxcala", 30: "Veracruz de Ignacio de la Llave", 31: "Yucatán", 32: "Zacatecas"
+}
+# Other spellings in use, as normalization keys
+STATE_ALIASES = {
+    "CDMX": 9, "DISTRITO FEDERAL": 9, "CIUDAD DE MEXICO CDMX": 9,
+    "COAHUILA": 5, "MICHOACAN": 16, "VERACRUZ": 30,
+    "ESTADO DE MEXICO": 15, "EDO DE MEXICO": 15, "EDO MEX": 15,
+    "QUERETARO DE ARTEAGA": 22
+}
+MUNICIPALITY_FACTOR = 1000
+
+# -------------------------------------------------------------------------
+# Normalization
+# -------------------------------------------------------------------------
+
+def _factorized_keys(values):
+    """Codes of values (-1 when missing) and the normalization key of each distinct value."""
+    codes, uniques = pd.factorize(pd.Series(values).astype(object))
+    keys = (
+        pd.Series(np.asarray(uniques, dtype=object), dtype=object)
+        .str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii")
+        .str.upper().str.replace(r"[^A-Z0-9]+", " ", regex=True).str.strip()
+    )
+    return codes, keys.to_numpy(dtype=object)
+
+def normalize_names(values):
+    """Normalization key of each value ("Ciudad de  México" -> "CIUDAD DE MEXICO"); None when missing."""
+    codes, keys = _factorized_keys(values)
+    normalized = np.append(keys, None)
+    return normalized[np.where(codes >= 0, codes, len(keys))]
+
+def _lookup(values, table, dtype):
+    """Vectorized dict lookup through the distinct normalization keys; UNKNOWN when absent."""
+    codes, keys = _factorized_keys(values)
+    ids = np.array([table.get(key, UNKNOWN) for key in keys] + [UNKNOWN], dtype=dtype)
+    return ids[np.where(codes >= 0, codes, len(keys))]
+
+# -------------------------------------------------------------------------
+# States
+# -------------------------------------------------------------------------
+
+STATE_KEYS = {
+    **dict(zip(normalize_names(list(STATES.values())), STATES)),
+    **STATE_ALIASES
+}
+
+def state_ids(values):
+    """INEGI state code of each state name, whatever its accents or case (int16, UNKNOWN if unrecognized)."""
+    return _lookup(values, STATE_KEYS, np.int16)
+
+def state_names(ids):
+    """Canonical name of each state id (None for UNKNOWN)."""
+    names = np.array([None, *STATES.values()], dtype=object)
+    ids = np.asarray(ids, dtype=np.int64)
+    return names[np.where((ids >= 1) & (ids <= len(STATES)), ids, 0)]
+
+def canonical_state_names(values):
+    """
+    Canonical spelling of each state name as a Categorical; unrecognized names are kept
+    as they are. Only the distinct values are looked up.
+    """
+    codes, uniques = pd.factorize(pd.Series(values).astype(object))
+    uniques = np.asarray(uniques, dtype=object)
+    names = state_names(state_ids(uniques))
+    names = np.where(pd.isna(names), uniques, names)
+    name_codes, categories = pd.factorize(names, sort=True)
+    return pd.Categorical.from_codes(np.where(codes >= 0, name_codes[codes], -1), categories)
+
+# -------------------------------------------------------------------------
+# Municipalities
+# -------------------------------------------------------------------------
+
+def municipality_ids(df):
+    """municipality_id of each row of a frame with EntidadFederativaId/MunicipioId (UNKNOWN when missing)."""
+    state = df["EntidadFederativaId"].to_numpy(dtype=float, na_value=np.nan)
+    municipality = df["MunicipioId"].to_numpy(dtype=float, na_value=np.nan)
+    ids = state * MUNICIPALITY_FACTOR + municipality
+    return np.where(np.isnan(ids), UNKNOWN, ids).astype(np.int32)
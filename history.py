@@ -0,0 +1,315 @@
+"""
+Append-only price history built from the daily CRE feeds.
+
+Every ingested feed date is one partition file, grouped in month directories:
+
+    data/history/stations.arrow              station dictionary (code = row number)
+    data/history/2025-02/2025-02-13.arrow    station, fuel, price rows of one date
+
+Rows hold a dictionary-encoded station code (int32), a fuel code (int8) and the
+price in integer centavos (int32). Only changes are stored: a date's partition
+lists the (station, fuel) prices that differ from the previous date, plus a
+DELISTED row when a station stops listing a fuel. The first date of every month
+is a keyframe listing every price, so a date range is answered from the
+partitions of the months it overlaps and never reads the rest of the history.
+
+Usage:
+    python history.py                                   # every YYMMDD_places/prices.xml pair in data/
+    python history.py path/to/feeds --history data/history --workers 16
+"""
+import argparse
+import os
+import time
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from ingest import find_feeds, iter_clean_tables, report_progress
+from validation import DUPLICATE_POLICIES, DUPLICATE_POLICY
+
+# Configuration
+DATA_DIR = Path("data")
+HISTORY_DIR = DATA_DIR / "history"
+STATIONS_FILE = "stations.arrow"
+PARTITION_SUFFIX = ".arrow"
+FUEL_COLUMNS = ["regular_price", "premium_price", "diesel_price"]
+STATION_COLUMNS = ["place_id", "cre_id", "state_name", "municipality_name"]
+DELISTED = -1
+
+# -------------------------------------------------------------------------
+# Encoding
+# -------------------------------------------------------------------------
+
+def to_centavos(prices):
+    """Prices in MXN as int32 centavos (NaN is not allowed)."""
+    return np.rint(np.asarray(prices, dtype=float) * 100).astype(np.int32)
+
+def _keys(stations, fuels):
+    """(station, fuel) pairs as one int64 key, ordered by station then fuel."""
+    return stations.astype(np.int64) * len(FUEL_COLUMNS) + fuels
+
+def _last_per_key(keys, prices):
+    """Final price of each key, given rows in date order (keys sorted, DELISTED dropped)."""
+    order = np.argsort(keys, kind="stable")
+    keys, prices = keys[order], prices[order]
+    last = np.ones(len(keys), dtype=bool)
+    last[:-1] = keys[1:] != keys[:-1]
+    keys, prices = keys[last], prices[last]
+    listed = prices != DELISTED
+    return keys[listed], prices[listed]
+
+# -------------------------------------------------------------------------
+# Store
+# -------------------------------------------------------------------------
+
+class PriceHistory:
+    """Price history store rooted at a directory (created by the first append)."""
+
+    def __init__(self, root=HISTORY_DIR):
+        self.root = Path(root)
+        self._stations = None
+        self._latest = None
+
+    # ---------------------------------------------------------------------
+    # Layout
+    # ---------------------------------------------------------------------
+
+    def _partition_path(self, day):
+        return self.root / f"{day:%Y-%m}" / f"{day:%Y-%m-%d}{PARTITION_SUFFIX}"
+
+    def dates(self):
+        """Every ingested date, oldest first."""
+        return sorted(
+            date.fromisoformat(path.stem)
+            for path in self.root.glob(f"????-??/*{PARTITION_SUFFIX}")
+        )
+
+    def stations(self):
+        """Station dictionary: one row per station code with its place_id, cre_id and geography."""
+        if self._stations is None:
+            path = self.root / STATIONS_FILE
+            if path.exists():
+                self._stations = feather.read_table(path).to_pandas()
+            else:
+                self._stations = pd.DataFrame({col: pd.Series(dtype=object) for col in STATION_COLUMNS})
+                self._stations["place_id"] = self._stations["place_id"].astype(np.int64)
+        return self._stations
+
+    def _write(self, table, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        feather.write_feather(table, tmp_path, compression="zstd")
+        tmp_path.replace(path)
+
+    def _read_partition(self, day):
+        table = feather.read_table(self._partition_path(day))
+        return (
+            table.column("station").to_numpy(),
+            table.column("fuel").to_numpy(),
+            table.column("price").to_numpy()
+        )
+
+    # ---------------------------------------------------------------------
+    # Appending
+    # ---------------------------------------------------------------------
+
+    def _station_codes(self, df_clean):
+        """Codes of the stations in df_clean, adding unseen place_ids to the dictionary."""
+        stations = self.stations()
+        known = pd.Index(stations["place_id"])
+        codes = known.get_indexer(df_clean["place_id"])
+        new = codes < 0
+        if new.any():
+            added = df_clean.loc[new, STATION_COLUMNS].astype({"place_id": np.int64})
+            added[STATION_COLUMNS[1:]] = added[STATION_COLUMNS[1:]].astype(object)
+            stations = pd.concat([stations, added], ignore_index=True)
+            self._write(pa.Table.from_pandas(stations, preserve_index=False), self.root / STATIONS_FILE)
+            self._stations = stations
+            codes[new] = np.arange(len(known), len(stations))
+        return codes.astype(np.int32)
+
+    def _latest_prices(self, dates):
+        """Sorted (keys, prices) listed on the last ingested date, replayed from its month's keyframe."""
+        if self._latest is None:
+            last = dates[-1]
+            month = [day for day in dates if (day.year, day.month) == (last.year, last.month)]
+            stations, fuels, prices = (np.concatenate(parts) for parts in zip(*map(self._read_partition, month)))
+            self._latest = _last_per_key(_keys(stations, fuels), prices)
+        return self._latest
+
+    def append(self, day, df_clean):
+        """
+        Store the prices of one feed date (a table with the gas_prices_clean.csv columns).
+        Dates must be appended in order; a date already stored is skipped (returns False).
+        """
+        dates = self.dates()
+        if dates and day <= dates[-1]:
+            if day in dates:
+                return False
+            raise ValueError(f"Cannot append {day}: the history already ends on {dates[-1]}")
+
+        df_clean = df_clean.drop_duplicates(subset=["place_id"])
+        codes = self._station_codes(df_clean)
+        key_parts, price_parts = [], []
+        for fuel_code, fuel in enumerate(FUEL_COLUMNS):
+            prices = df_clean[fuel].to_numpy(dtype=float, na_value=np.nan)
+            listed = ~np.isnan(prices)
+            key_parts.append(_keys(codes[listed], fuel_code))
+            price_parts.append(to_centavos(prices[listed]))
+        keys = np.concatenate(key_parts)
+        prices = np.concatenate(price_parts)
+        order = np.argsort(keys, kind="stable")
+        keys, prices = keys[order], prices[order]
+
+        if dates:
+            previous_keys, previous_prices = self._latest_prices(dates)
+        else:
+            previous_keys, previous_prices = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)
+        position = np.minimum(np.searchsorted(previous_keys, keys), max(len(previous_keys) - 1, 0))
+        seen = (previous_keys[position] == keys) if len(previous_keys) else np.zeros(len(keys), dtype=bool)
+        keyframe = not dates or (day.year, day.month) != (dates[-1].year, dates[-1].month)
+        # A keyframe lists every price; other dates only what changed since the previous date
+        changed = np.ones(len(keys), dtype=bool) if keyframe else ~seen | (previous_prices[position] != prices)
+        gone = previous_keys[~np.isin(previous_keys, keys, assume_unique=True)]
+
+        row_keys = np.concatenate([keys[changed], gone])
+        row_prices = np.concatenate([prices[changed], np.full(len(gone), DELISTED, dtype=np.int32)])
+        order = np.argsort(row_keys, kind="stable")
+        row_keys, row_prices = row_keys[order], row_prices[order]
+        table = pa.table({
+            "station": (row_keys // len(FUEL_COLUMNS)).astype(np.int32),
+            "fuel": (row_keys % len(FUEL_COLUMNS)).astype(np.int8),
+            "price": row_prices
+        })
+        self._write(table, self._partition_path(day))
+        self._latest = (keys, prices)
+        return True
+
+    def ingest_feeds(self, feed_dir, registry_path=DATA_DIR / "gasolineras_mx.csv", workers=None, progress=None,
+                     policy=DUPLICATE_POLICY):
+        """
+        Append every feed pair in feed_dir newer than the stored history. Returns the dates added.
+        Feeds are parsed in parallel by `workers` processes, validated with the duplicate
+        policy (see ingest.clean_feed) and appended in date order; a feed failing validation
+        raises ValueError before it is appended. progress(day, done, total, rows, seconds)
+        is called after each date.
+        """
+        dates = self.dates()
+        feeds = [feed for feed in find_feeds(feed_dir) if not dates or feed[0] > dates[-1]]
+        tables = iter_clean_tables([(places, prices) for _, places, prices in feeds], registry_path, workers, policy)
+
+        start = time.perf_counter()
+        added, rows = [], 0
+        for (day, _, _), df_clean in zip(feeds, tables):
+            self.append(day, df_clean)
+            added.append(day)
+            rows += len(df_clean)
+            if progress is not None:
+                progress(day, len(added), len(feeds), rows, time.perf_counter() - start)
+        return added
+
+    # ---------------------------------------------------------------------
+    # Queries
+    # ---------------------------------------------------------------------
+
+    def _rows(self, start, end, station_codes=None):
+        """
+        Rows needed to rebuild prices over [start, end] (defaults: the whole history).
+        Returns the dates from the month keyframe before start through end, start itself,
+        and (date position, key, price) arrays in date order.
+        """
+        dates = self.dates()
+        empty = np.empty(0, dtype=np.int64)
+        if not dates:
+            return [], start, empty, empty, np.empty(0, dtype=np.int32)
+        start = start or dates[0]
+        end = end or dates[-1]
+        anchor = max([day for day in dates if day <= start], default=dates[0])
+        window = [day for day in dates if date(anchor.year, anchor.month, 1) <= day <= end]
+
+        day_parts, key_parts, price_parts = [empty], [empty], [np.empty(0, dtype=np.int32)]
+        for position, day in enumerate(window):
+            stations, fuels, prices = self._read_partition(day)
+            if station_codes is not None:
+                keep = np.isin(stations, station_codes)
+                stations, fuels, prices = stations[keep], fuels[keep], prices[keep]
+            day_parts.append(np.full(len(stations), position))
+            key_parts.append(_keys(stations, fuels))
+            price_parts.append(prices)
+        return window, start, np.concatenate(day_parts), np.concatenate(key_parts), np.concatenate(price_parts)
+
+    def station_series(self, place_id, start=None, end=None):
+        """
+        Daily prices (MXN) of one station over [start, end] (default: the whole history),
+        one column per fuel, NaN on dates it did not list the fuel.
+        """
+        codes = np.flatnonzero(self.stations()["place_id"].to_numpy() == place_id)
+        window, start, days, keys, prices = self._rows(start, end, codes)
+        # Changes only: carry each price forward until the next row for its fuel
+        matrix = np.full((len(window), len(FUEL_COLUMNS)), np.nan)
+        matrix[days, keys % len(FUEL_COLUMNS)] = prices
+        series = pd.DataFrame(matrix, index=pd.Index(window, name="date"), columns=FUEL_COLUMNS).ffill()
+        series = series.where(series != DELISTED) / 100
+        return series[series.index >= start]
+
+    def region_series(self, state_name=None, municipality_name=None, start=None, end=None):
+        """
+        Daily mean price (MXN) per fuel and number of stations listing it ("<fuel>_count")
+        over [start, end], for a state, a municipality or the whole country.
+        """
+        stations = self.stations()
+        selected = np.ones(len(stations), dtype=bool)
+        if state_name is not None:
+            selected &= (stations["state_name"] == state_name).to_numpy()
+        if municipality_name is not None:
+            selected &= (stations["municipality_name"] == municipality_name).to_numpy()
+        codes = None if selected.all() else np.flatnonzero(selected)
+        window, start, days, keys, prices = self._rows(start, end, codes)
+
+        # Each row changes its key's contribution to the sum and count from its date on
+        order = np.lexsort((days, keys))
+        days, keys, prices = days[order], keys[order], prices[order]
+        previous = np.full_like(prices, DELISTED)
+        previous[1:] = np.where(keys[1:] == keys[:-1], prices[:-1], DELISTED)
+        listed, was_listed = prices != DELISTED, previous != DELISTED
+        delta_sum = np.where(listed, prices, 0).astype(np.int64) - np.where(was_listed, previous, 0)
+        delta_count = listed.astype(np.int64) - was_listed
+
+        n_days, n_fuels = len(window), len(FUEL_COLUMNS)
+        cell = days * n_fuels + keys % n_fuels
+        sums = np.bincount(cell, weights=delta_sum, minlength=n_days * n_fuels).reshape(n_days, n_fuels).cumsum(axis=0)
+        counts = np.bincount(cell, weights=delta_count, minlength=n_days * n_fuels).reshape(n_days, n_fuels).cumsum(axis=0)
+
+        series = pd.DataFrame(index=pd.Index(window, name="date"))
+        for i, fuel in enumerate(FUEL_COLUMNS):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                series[fuel] = np.where(counts[:, i] > 0, sums[:, i] / counts[:, i] / 100, np.nan)
+            series[f"{fuel}_count"] = counts[:, i].astype(np.int64)
+        return series[series.index >= start]
+
+def main():
+    parser = argparse.ArgumentParser(description="Append the dated CRE feeds to the price history.")
+    parser.add_argument("feed_dir", nargs="?", default=DATA_DIR, type=Path)
+    parser.add_argument("--registry", default=DATA_DIR / "gasolineras_mx.csv", type=Path)
+    parser.add_argument("--history", default=HISTORY_DIR, type=Path)
+    parser.add_argument("--workers", default=os.cpu_count(), type=int, help="Parser processes (default: one per core)")
+    parser.add_argument("--policy", default=DUPLICATE_POLICY, choices=DUPLICATE_POLICIES,
+                        help="How repeated prices and duplicate stations are merged")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        added = PriceHistory(args.history).ingest_feeds(
+            args.feed_dir, args.registry, args.workers, report_progress, args.policy
+        )
+    except ValueError as error:
+        raise SystemExit(str(error))
+    elapsed = time.perf_counter() - start
+    print(f"Appended {len(added)} feed dates to {args.history} in {elapsed:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+Build the clean station table (gas_prices_clean.csv) from the CRE feeds.
+
+Usage:
+    python ingest.py
+    python ingest.py --places data/250213_places.xml --prices data/250213_prices.xml \
+        --registry data/gasolineras_mx.csv --output data/gas_prices_clean.csv \
+        --boundaries data/municipalities.geojson
+    python ingest.py --feeds data/ --workers 16     # every dated feed pair -> data/stations_by_date.arrow
+"""
+import argparse
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from boundaries import BOUNDARIES_FILE, backfill_geography, load_boundaries
+from validation import DUPLICATE_POLICIES, DUPLICATE_POLICY, reduce_duplicates, validate_stations, write_report
+
+# Configuration
+DATA_DIR = Path("data")
+FUEL_TYPES = ["regular", "premium", "diesel"]
+CLEAN_COLUMNS = [
+    "place_id", "name", "cre_id", "longitude", "latitude",
+    "regular_price", "premium_price", "diesel_price",
+    "EntidadFederativaId", "MunicipioId", "state_name", "municipality_name",
+    "station_name", "address"
+]
+# Arrow types of the clean table, used to ship tables from workers and write batch output
+CLEAN_SCHEMA = pa.schema([
+    ("place_id", pa.int64()), ("name", pa.string()), ("cre_id", pa.string()),
+    ("longitude", pa.float64()), ("latitude", pa.float64()),
+    ("regular_price", pa.float64()), ("premium_price", pa.float64()), ("diesel_price", pa.float64()),
+    ("EntidadFederativaId", pa.float64()), ("MunicipioId", pa.float64()),
+    ("state_name", pa.string()), ("municipality_name", pa.string()),
+    ("station_name", pa.string()), ("address", pa.string())
+])
+BATCH_FILE = DATA_DIR / "stations_by_date.arrow"
+FEED_PATTERN = re.compile(r"^(\d{6})_places\.xml$")
+# Parsed feeds waiting to be consumed, per worker; bounds memory when the consumer is slower than the pool
+PREFETCH_PER_WORKER = 2
+
+# -------------------------------------------------------------------------
+# Streaming XML Parsing
+# -------------------------------------------------------------------------
+
+def _iter_place_elements(path):
+    """
+    Yield each completed <place> element of a CRE feed.
+    The root is cleared after every place so memory stays flat regardless of feed size.
+    """
+    context = ET.iterparse(path, events=("start", "end"))
+    _, root = next(context)
+    for event, elem in context:
+        if event == "end" and elem.tag == "place":
+            yield elem
+            root.clear()
+
+def parse_places(path):
+    """
+    Stream the places feed into column arrays:
+    place_id, name, cre_id, longitude, latitude.
+    """
+    place_ids, names, cre_ids, longitudes, latitudes = [], [], [], [], []
+    for elem in _iter_place_elements(path):
+        place_ids.append(int(elem.get("place_id")))
+        names.append(elem.findtext("name") or "")
+        cre_ids.append((elem.findtext("cre_id") or "").strip())
+        longitudes.append(elem.findtext("location/x"))
+        latitudes.append(elem.findtext("location/y"))
+
+    return {
+        "place_id": np.array(place_ids, dtype=np.int64),
+        "name": np.array(names, dtype=object),
+        "cre_id": np.array(cre_ids, dtype=object),
+        "longitude": np.array(longitudes, dtype=float),
+        "latitude": np.array(latitudes, dtype=float),
+    }
+
+def parse_prices(path, policy=DUPLICATE_POLICY):
+    """
+    Stream the prices feed and pivot <gas_price type=...> into one column per fuel.
+    A place can appear several times in the feed; repeated prices for the same
+    fuel are merged with policy ("first", "last", "min" or "mean", see validation.py)
+    and different fuels are combined into a single row.
+    Returns place_id plus regular_price/premium_price/diesel_price arrays.
+    """
+    fuel_index = {fuel: i for i, fuel in enumerate(FUEL_TYPES)}
+    place_ids, fuels, prices = [], [], []
+    for elem in _iter_place_elements(path):
+        place_id = int(elem.get("place_id"))
+        for gas_price in elem.iter("gas_price"):
+            fuel = fuel_index.get(gas_price.get("type"))
+            if fuel is None or not gas_price.text:
+                continue
+            place_ids.append(place_id)
+            fuels.append(fuel)
+            prices.append(float(gas_price.text))
+
+    place_ids = np.array(place_ids, dtype=np.int64)
+    fuels = np.array(fuels, dtype=np.int64)
+    prices = np.array(prices, dtype=float)
+
+    # Pivot (place_id, fuel) pairs into a place x fuel matrix, merging repeated pairs
+    unique_ids, row = np.unique(place_ids, return_inverse=True)
+    keys, merged = reduce_duplicates(row * len(FUEL_TYPES) + fuels, prices, policy)
+    matrix = np.full(len(unique_ids) * len(FUEL_TYPES), np.nan)
+    matrix[keys] = merged
+    matrix = np.round(matrix.reshape(len(unique_ids), len(FUEL_TYPES)), 2)
+
+    columns = {"place_id": unique_ids}
+    for i, fuel in enumerate(FUEL_TYPES):
+        columns[f"{fuel}_price"] = matrix[:, i]
+    return columns
+
+# -------------------------------------------------------------------------
+# Clean Table
+# -------------------------------------------------------------------------
+
+def load_registry(path):
+    """Load the station registry (gasolineras_mx.csv) with geography for each permit."""
+    df_registry = pd.read_csv(
+        path,
+        usecols=["EntidadNombre", "EntidadFederativaId", "MunicipioNombre", "MunicipioId",
+                 "Numero", "Nombre", "Direccion"],
+        dtype={"Numero": str}
+    )
+    df_registry = df_registry.drop_duplicates(subset=["Numero"])
+    return df_registry.rename(columns={
+        "Numero": "cre_id",
+        "EntidadNombre": "state_name",
+        "MunicipioNombre": "municipality_name",
+        "Nombre": "station_name",
+        "Direccion": "address"
+    })
+
+def join_feeds(places, prices, df_registry):
+    """
+    Join parsed places and prices columns on place_id and enrich each station with
+    state/municipality from the registry (joined on cre_id).
+    Returns a DataFrame with the gas_prices_clean.csv schema, sorted by cre_id.
+    """
+    df_places = pd.DataFrame(places)
+    df_places = df_places.drop_duplicates(subset=["place_id"])
+    df_prices = pd.DataFrame(prices)
+
+    df_clean = df_places.merge(df_prices, on="place_id", how="left")
+    df_clean = df_clean.merge(df_registry, on="cre_id", how="left")
+    df_clean = df_clean.sort_values("cre_id", kind="stable").reset_index(drop=True)
+    return df_clean[CLEAN_COLUMNS]
+
+def build_clean_table(places_path, prices_path, registry_path, policy=DUPLICATE_POLICY):
+    """Clean station table of one places/prices feed pair (see join_feeds)."""
+    return join_feeds(parse_places(places_path), parse_prices(prices_path, policy), load_registry(registry_path))
+
+# -------------------------------------------------------------------------
+# Feed Discovery
+# -------------------------------------------------------------------------
+
+def feed_date(places_path):
+    """Date encoded in a YYMMDD_places.xml file name."""
+    match = FEED_PATTERN.match(Path(places_path).name)
+    if match is None:
+        raise ValueError(f"Not a dated places feed: {places_path}")
+    return datetime.strptime(match.group(1), "%y%m%d").date()
+
+def find_feeds(feed_dir):
+    """(date, places_path, prices_path) for every complete feed pair in feed_dir, oldest first."""
+    feeds = []
+    for places_path in Path(feed_dir).glob("*_places.xml"):
+        if FEED_PATTERN.match(places_path.name) is None:
+            continue
+        prices_path = places_path.with_name(places_path.name.replace("_places", "_prices"))
+        if prices_path.exists():
+            feeds.append((feed_date(places_path), places_path, prices_path))
+    return sorted(feeds)
+
+# -------------------------------------------------------------------------
+# Batch Ingestion
+# -------------------------------------------------------------------------
+
+def clean_feed(places_path, prices_path, df_registry, policy=DUPLICATE_POLICY):
+    """
+    Validated clean table of one feed pair, with repeated prices and duplicate stations
+    merged with policy (see validation.py). Raises ValueError when the table fails
+    validation, so a bad feed never reaches a batch file, the history or a diff.
+    """
+    df_clean = join_feeds(parse_places(places_path), parse_prices(prices_path, policy), df_registry)
+    df_clean, quality = validate_stations(df_clean, policy)
+    if not quality["passed"]:
+        raise ValueError(f"{places_path} failed validation: " + "; ".join(quality["errors"]))
+    return df_clean.reset_index(drop=True)
+
+# Registry and duplicate policy set once per worker process by _init_worker
+_worker_registry = None
+_worker_policy = DUPLICATE_POLICY
+
+def _init_worker(registry_path, policy):
+    global _worker_registry, _worker_policy
+    _worker_registry = load_registry(registry_path)
+    _worker_policy = policy
+
+def _to_ipc(df_clean):
+    """Clean table as one Arrow IPC record batch: column buffers, not pickled Python objects."""
+    batch = pa.RecordBatch.from_pandas(df_clean, schema=CLEAN_SCHEMA, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, CLEAN_SCHEMA) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue()
+
+def _from_ipc(buffer):
+    return pa.ipc.open_stream(buffer).read_all().to_pandas()
+
+def _clean_batch(feed_pair):
+    """Worker task: clean table of one (places_path, prices_path) pair as Arrow IPC bytes."""
+    return _to_ipc(clean_feed(feed_pair[0], feed_pair[1], _worker_registry, _worker_policy))
+
+def iter_clean_tables(feed_pairs, registry_path, workers=None, policy=DUPLICATE_POLICY):
+    """
+    Validated clean station table of each (places_path, prices_path) pair, in input
+    order (see clean_feed; a feed failing validation raises ValueError).
+    XML parsing is spread over a pool of `workers` processes (default: one per core);
+    workers=1 parses in this process. At most PREFETCH_PER_WORKER parsed tables per
+    worker wait for the consumer, so a slow consumer does not hold every feed in memory.
+    """
+    feed_pairs = list(feed_pairs)
+    if workers == 1 or len(feed_pairs) <= 1:
+        df_registry = load_registry(registry_path)
+        for places_path, prices_path in feed_pairs:
+            yield clean_feed(places_path, prices_path, df_registry, policy)
+        return
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(registry_path, policy)) as pool:
+        pending = deque()
+        remaining = iter(feed_pairs)
+        for feed_pair in remaining:
+            pending.append(pool.submit(_clean_batch, feed_pair))
+            if len(pending) >= workers * PREFETCH_PER_WORKER:
+                break
+        while pending:
+            # Results are yielded in submission order, whichever worker finishes first
+            buffer = pending.popleft().result()
+            feed_pair = next(remaining, None)
+            if feed_pair is not None:
+                pending.append(pool.submit(_clean_batch, feed_pair))
+            yield _from_ipc(buffer)
+
+def report_progress(day, done, total, rows, seconds):
+    """Progress callback printing feeds done and files/rows per second."""
+    rate = max(seconds, 1e-9)
+    print(
+        f"[{done}/{total}] {day}: {rows:,} rows | "
+        f"{2 * done / rate:.1f} files/s, {rows / rate:,.0f} rows/s"
+    )
+
+def ingest_feeds(feed_dir, registry_path, output_path=BATCH_FILE, workers=None, progress=None,
+                 policy=DUPLICATE_POLICY):
+    """
+    Clean and validate every dated feed pair in feed_dir and write them to one Arrow
+    file with a "date" column; nothing is written if a feed fails validation.
+    Feeds are parsed in parallel and merged in date order (each table keeps its
+    cre_id order), so the output is the same whatever the number of workers.
+    progress(day, done, total, rows, seconds) is called after each date.
+    Returns the dates written and the number of rows.
+    """
+    feeds = find_feeds(feed_dir)
+    tables = iter_clean_tables([(places, prices) for _, places, prices in feeds], registry_path, workers, policy)
+    schema = pa.schema([("date", pa.date32()), *CLEAN_SCHEMA])
+
+    output_path = Path(output_path)
+    tmp_path = output_path.with_suffix(".tmp")
+    start = time.perf_counter()
+    days, rows = [], 0
+    try:
+        with pa.OSFile(str(tmp_path), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            for (day, _, _), df_clean in zip(feeds, tables):
+                batch = pa.RecordBatch.from_pandas(df_clean, schema=CLEAN_SCHEMA, preserve_index=False)
+                dates = pa.array(np.full(len(batch), day), type=pa.date32())
+                writer.write_batch(pa.RecordBatch.from_arrays([dates, *batch.columns], schema=schema))
+                days.append(day)
+                rows += len(batch)
+                if progress is not None:
+                    progress(day, len(days), len(feeds), rows, time.perf_counter() - start)
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    tmp_path.replace(output_path)
+    return days, rows
+
+def ingest(places_path, prices_path, registry_path, output_path, boundaries_path=None,
+           policy=DUPLICATE_POLICY, report_path=None):
+    """
+    Stable entry point: rebuild the clean station table and write it to CSV.
+    With boundaries_path (municipality polygons, see boundaries.py) stations missing
+    from the registry get their state/municipality from their coordinates.
+    The table is validated before it is written (see validation.py); the quality
+    report goes to report_path when given, and a table failing validation is not
+    written (ValueError).
+    Returns the table and {"backfill": report or None, "quality": report}.
+    """
+    df_clean = build_clean_table(places_path, prices_path, registry_path, policy)
+    backfill = None
+    if boundaries_path is not None:
+        df_clean, backfill = backfill_geography(df_clean, load_boundaries(boundaries_path))
+    df_clean, quality = validate_stations(df_clean, policy)
+    if report_path is not None:
+        write_report(quality, report_path)
+    if not quality["passed"]:
+        raise ValueError(f"{places_path} failed validation: " + "; ".join(quality["errors"]))
+    df_clean.to_csv(output_path, index=False)
+    return df_clean, {"backfill": backfill, "quality": quality}
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the clean station table from the CRE XML feeds.")
+    parser.add_argument("--places", default=DATA_DIR / "250213_places.xml", type=Path)
+    parser.add_argument("--prices", default=DATA_DIR / "250213_prices.xml", type=Path)
+    parser.add_argument("--registry", default=DATA_DIR / "gasolineras_mx.csv", type=Path)
+    parser.add_argument("--output", type=Path,
+                        help=f"Output file (default: data/gas_prices_clean.csv, or {BATCH_FILE} with --feeds)")
+    parser.add_argument(
+        "--boundaries", default=BOUNDARIES_FILE, type=Path,
+        help="Municipality polygons (GeoJSON) to backfill missing geography; skipped if the file does not exist"
+    )
+    parser.add_argument("--policy", default=DUPLICATE_POLICY, choices=DUPLICATE_POLICIES,
+                        help="How repeated prices of a station and fuel are merged")
+    parser.add_argument("--report", type=Path, help="Write the data-quality report (JSON) here")
+    parser.add_argument("--feeds", type=Path, help="Ingest every dated feed pair in this directory into one file")
+    parser.add_argument("--workers", default=os.cpu_count(), type=int, help="Parser processes for --feeds")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.feeds is not None:
+        output = args.output or BATCH_FILE
+        try:
+            days, rows = ingest_feeds(args.feeds, args.registry, output, args.workers, report_progress, args.policy)
+        except ValueError as error:
+            raise SystemExit(str(error))
+        print(f"Wrote {rows:,} rows of {len(days)} feed dates to {output} in {time.perf_counter() - start:.2f}s")
+        return
+
+    args.output = args.output or DATA_DIR / "gas_prices_clean.csv"
+    boundaries_path = args.boundaries if args.boundaries.exists() else None
+    try:
+        df_clean, report = ingest(
+            args.places, args.prices, args.registry, args.output, boundaries_path, args.policy, args.report
+        )
+    except ValueError as error:
+        raise SystemExit(str(error))
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {len(df_clean):,} stations to {args.output} in {elapsed:.2f}s")
+    if report["backfill"] is not None:
+        backfill = report["backfill"]
+        print(f"Backfilled the geography of {backfill['backfilled']:,} of {backfill['missing']:,} stations without it")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Hot-path instrumentation of the dashboard's loaders, preparation steps, chart
+functions and sections.
+
+Functions decorated with @instrumented(), and blocks wrapped in span(name), record
+one span per call while instrumentation is on:
+
+    name, start, seconds   wall time (start relative to the rerun's start)
+    depth                  nesting level within the rerun
+    rows_in, rows_out      rows of the DataFrame arguments / of the DataFrame(s) returned
+    allocated              peak bytes allocated, when memory accounting is on (see memory.py)
+    figure_bytes           JSON size of the Plotly figure(s) returned
+
+Spans are grouped by rerun: app.main runs inside rerun(), and a span opened outside
+of one (e.g. an st.fragment rerunning alone) starts its own. The last MAX_RERUNS
+reruns are kept for the performance panel and can be exported as JSON or in the
+Chrome trace event format (chrome://tracing, Perfetto).
+
+Instrumentation is off unless PERF_PANEL=1 is set in the environment (or
+enable_instrumentation() is called): a decorated function then costs one flag check,
+plus the per-stage memory accounting of memory.track_memory when that is on, so the
+hooks stay in production builds.
+"""
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+import plotly.graph_objects as go
+
+from caching import figure_size
+from memory import track_memory
+
+# Configuration
+MAX_RERUNS = 20
+TOP_OFFENDERS = 10
+
+_enabled = os.environ.get("PERF_PANEL", "") not in ("", "0")
+_lock = threading.Lock()
+_reruns = deque(maxlen=MAX_RERUNS)
+# Rerun being recorded by each script thread
+_local = threading.local()
+
+def enable_instrumentation(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+def instrumentation_enabled():
+    return _enabled
+
+def clear_traces():
+    with _lock:
+        _reruns.clear()
+
+# -------------------------------------------------------------------------
+# Measurements
+# -------------------------------------------------------------------------
+
+def _rows(value):
+    """Rows of a DataFrame, or of the DataFrames in a tuple/list (None when there are none)."""
+    if isinstance(value, pd.DataFrame):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        counts = [len(item) for item in value if isinstance(item, pd.DataFrame)]
+        return sum(counts) if counts else None
+    return None
+
+def _figure_bytes(value):
+    """JSON size of the figure(s) returned; cached figures carry the size measured when cached."""
+    figures = value if isinstance(value, (list, tuple)) else [value]
+    sizes = [figure_size(fig) for fig in figures if isinstance(fig, go.Figure)]
+    return sum(sizes) if sizes else None
+
+# -------------------------------------------------------------------------
+# Spans & Reruns
+# -------------------------------------------------------------------------
+
+@contextmanager
+def rerun(label="rerun"):
+    """Group the spans recorded by this thread until the block exits into one rerun."""
+    if not _enabled or getattr(_local, "rerun", None) is not None:
+        yield
+        return
+    record = {
+        "label": label,
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "thread": threading.get_ident(),
+        "spans": [],
+        "_start": time.perf_counter(),
+        "_depth": 0
+    }
+    _local.rerun = record
+    try:
+        yield
+    finally:
+        _local.rerun = None
+        record["seconds"] = time.perf_counter() - record.pop("_start")
+        del record["_depth"]
+        with _lock:
+            _reruns.append(record)
+
+@contextmanager
+def span(name, args=(), kwargs=None):
+    """
+    Record the enclosed block as a span of the current rerun; yields the span dict,
+    whose "result" key may be set to the block's result to measure its output.
+    """
+    if not _enabled:
+        yield {}
+        return
+    if getattr(_local, "rerun", None) is None:
+        # Fragment reruns and background work get a rerun of their own
+        with rerun(name), span(name, args, kwargs) as record:
+            yield record
+        return
+
+    current = _local.rerun
+    rows_in = [_rows(value) for value in (*args, *(kwargs or {}).values())]
+    rows_in = [rows for rows in rows_in if rows is not None]
+    record = {
+        "name": name,
+        "depth": current["_depth"],
+        "rows_in": sum(rows_in) if rows_in else None
+    }
+    current["_depth"] += 1
+    start = time.perf_counter()
+    try:
+        with track_memory(name) as measurement:
+            yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        record["start"] = start - current["_start"]
+        current["_depth"] -= 1
+        result = record.pop("result", None)
+        record["rows_out"] = _rows(result)
+        record["allocated"] = measurement.get("allocated")
+        record["figure_bytes"] = _figure_bytes(result)
+        current["spans"].append(record)
+
+def instrumented(name=None):
+    """
+    Decorator recording a span per call (named after the function by default); the
+    span is also a memory.track_memory stage, accounted even while instrumentation is off.
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                if not tracemalloc.is_tracing():
+                    return func(*args, **kwargs)
+                with track_memory(span_name):
+                    return func(*args, **kwargs)
+            with span(span_name, args, kwargs) as record:
+                record["result"] = func(*args, **kwargs)
+                return record["result"]
+        return wrapper
+    return decorator
+
+# -------------------------------------------------------------------------
+# Reports & Export
+# -------------------------------------------------------------------------
+
+def recent_reruns():
+    """The recorded reruns, oldest first."""
+    with _lock:
+        return list(_reruns)
+
+def rerun_summary(reruns=None):
+    """One row per rerun: start time, label, wall time, spans and its slowest top-level span."""
+    rows = []
+    for record in reruns if reruns is not None else recent_reruns():
+        top_level = [s for s in record["spans"] if s["depth"] == 0]
+        slowest = max(top_level or record["spans"], key=lambda s: s["seconds"], default=None)
+        rows.append({
+            "started_at": record["started_at"],
+            "label": record["label"],
+            "seconds": record["seconds"],
+            "spans": len(record["spans"]),
+            "slowest": slowest["name"] if slowest else None,
+            "slowest_seconds": slowest["seconds"] if slowest else None
+        })
+    return pd.DataFrame(rows, columns=["started_at", "label", "seconds", "spans", "slowest", "slowest_seconds"])
+
+def top_offenders(reruns=None, n=TOP_OFFENDERS):
+    """Spans aggregated by name over the reruns, by total wall time."""
+    spans = [s for record in (reruns if reruns is not None else recent_reruns()) for s in record["spans"]]
+    columns = ["name", "calls", "seconds", "mean_seconds", "max_seconds", "rows_in", "rows_out", "allocated", "figure_bytes"]
+    if not spans:
+        return pd.DataFrame(columns=columns)
+    df = pd.DataFrame(spans)
+    table = df.groupby("name").agg(
+        calls=("seconds", "size"),
+        seconds=("seconds", "sum"),
+        mean_seconds=("seconds", "mean"),
+        max_seconds=("seconds", "max"),
+        rows_in=("rows_in", "max"),
+        rows_out=("rows_out", "max"),
+        allocated=("allocated", "max"),
+        figure_bytes=("figure_bytes", "max")
+    ).reset_index()
+    return table.sort_values("seconds", ascending=False).head(n)[columns].reset_index(drop=True)
+
+def traces_json(reruns=None):
+    reruns = reruns if reruns is not None else recent_reruns()
+    return json.dumps({"reruns": reruns}, indent=2, default=str)
+
+def chrome_trace(reruns=None):
+    """Reruns as Chrome trace events ("X" complete events, microseconds), one track per thread."""
+    events = []
+    origin = None
+    for record in reruns if reruns is not None else recent_reruns():
+        started = datetime.fromisoformat(record["started_at"]).timestamp() * 1e6
+        origin = started if origin is None else origin
+        base = started - origin
+        events.append({
+            "name": record["label"], "cat": "rerun", "ph": "X", "pid": 1, "tid": record["thread"],
+            "ts": base, "dur": record["seconds"] * 1e6
+        })
+        for s in record["spans"]:
+            events.append({
+                "name": s["name"], "cat": "span", "ph": "X", "pid": 1, "tid": record["thread"],
+                "ts": base + s["start"] * 1e6, "dur": s["seconds"] * 1e6,
+                "args": {key: s[key] for key in ["rows_in", "rows_out", "allocated", "figure_bytes"] if s.get(key) is not None}
+            })
+    return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})
@@ -0,0 +1,69 @@
+"""
+Estimated market value of the fuel sold in each state.
+
+market_values prices every (state, fuel) volume at that state's mean station price
+for the fuel, read from the aggregation cube (see cube.py), and falls back to the
+national mean price where the state lists no price for the fuel. The state x fuel
+price matrix is gathered for all rows at once, so the whole table is one
+vectorized lookup:
+
+    EntidadFederativa, SubProducto, volume, state_id,
+    Avg_Price      price used (MXN per litre)
+    Price_Source   "state" or "national"
+    Market_Value   volume x Avg_Price
+"""
+import numpy as np
+import pandas as pd
+
+from cube import cube_slice, national_value
+from geography import STATES, UNKNOWN, state_ids
+from volumes import VOLUME_COLUMN
+
+# Configuration
+# Price column of each volume sub-product (diesel variants already folded, see volumes.py)
+FUEL_PRICES = {"Regular": "regular_price", "Premium": "premium_price", "Diesel": "diesel_price"}
+FUELS = list(FUEL_PRICES)
+
+def price_matrix(cube):
+    """
+    Mean prices as (state_id x fuel matrix, national vector), columns in FUELS order.
+    Row 0 and states without prices for a fuel are NaN.
+    """
+    by_state = np.full((len(STATES) + 1, len(FUELS)), np.nan)
+    national = np.full(len(FUELS), np.nan)
+    for j, fuel in enumerate(FUELS):
+        rows = cube_slice(cube, "state", FUEL_PRICES[fuel])
+        ids = state_ids(rows["state_name"])
+        known = ids != UNKNOWN
+        by_state[ids[known], j] = rows["mean"].to_numpy(dtype=float)[known]
+        national[j] = national_value(cube, FUEL_PRICES[fuel], "mean")
+    return by_state, national
+
+def market_values(df_volume, cube):
+    """
+    Market value table of (EntidadFederativa, SubProducto, volume) rows: each row's
+    state price for its fuel, the national price where the state has none.
+    Fuels without a price column get no price and no market value.
+    """
+    by_state, national = price_matrix(cube)
+    ids = state_ids(df_volume["EntidadFederativa"]).astype(np.int64)
+    fuels = pd.Categorical(df_volume["SubProducto"].astype(str), categories=FUELS).codes.astype(np.int64)
+    priced = fuels >= 0
+
+    state_price = np.full(len(df_volume), np.nan)
+    has_state = priced & (ids != UNKNOWN)
+    state_price[has_state] = by_state[ids[has_state], fuels[has_state]]
+    national_price = np.where(priced, national[np.maximum(fuels, 0)], np.nan)
+    use_state = ~np.isnan(state_price)
+    price = np.where(use_state, state_price, national_price)
+
+    volume = df_volume[VOLUME_COLUMN].to_numpy(dtype=float)
+    return pd.DataFrame({
+        "EntidadFederativa": df_volume["EntidadFederativa"].to_numpy(),
+        "SubProducto": df_volume["SubProducto"].to_numpy(),
+        VOLUME_COLUMN: volume,
+        "state_id": ids,
+        "Avg_Price": price,
+        "Price_Source": np.where(use_state, "state", np.where(priced, "national", None)),
+        "Market_Value": volume * price
+    })
@@ -0,0 +1,134 @@
+"""
+Memory accounting per pipeline stage.
+
+Stages are wrapped in track_memory(stage); while accounting is on (tracemalloc
+tracing, which NumPy and pandas buffers report to), each run of a stage records:
+
+    allocated   peak bytes held above the stage's starting point (temporaries included)
+    retained    bytes still held when the stage returned (its result)
+
+Nested stages are measured independently and also count towards the stage
+around them. Each thread keeps its own stack of open stages, but tracemalloc
+counts the whole process: while stages run in several threads at once (e.g. two
+dashboard sessions tracing), each one's bytes include what the other threads
+allocated meanwhile. Buffers allocated by Arrow's own memory pool (e.g. while
+reading snapshots) are not seen by tracemalloc. Accounting is off by default and
+track_memory is then a no-op. Scripts turn it on for the whole run:
+
+    start_memory_accounting()
+    build_analysis_results(...)
+    print(memory_report())
+
+tracemalloc is process-wide, so the dashboard's sessions share it through
+acquire_tracing(): tracing starts with the first hold and stops when the last
+one is released (or garbage-collected with its session).
+"""
+import threading
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Configuration
+# Frames of call stack kept per allocation (1 is enough for byte totals and cheapest)
+TRACEBACK_FRAMES = 1
+
+_lock = threading.Lock()
+_records = {}
+# Stages being measured by each thread (script threads of different sessions):
+# thread id -> [[starting bytes, peak bytes seen so far], ...], innermost last
+_open_stages = {}
+
+def start_memory_accounting():
+    """Start tracing allocations and clear previous records."""
+    with _lock:
+        _records.clear()
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEBACK_FRAMES)
+
+def stop_memory_accounting():
+    tracemalloc.stop()
+
+# -------------------------------------------------------------------------
+# Shared Tracing
+# -------------------------------------------------------------------------
+
+# Live TracingHolds, and whether tracing was started by them (and so is theirs to stop)
+_holds = 0
+_started_by_holds = False
+
+def _release_hold():
+    global _holds, _started_by_holds
+    with _lock:
+        _holds -= 1
+        if not _holds and _started_by_holds:
+            tracemalloc.stop()
+            _started_by_holds = False
+
+class TracingHold:
+    """A claim on allocation tracing; released once, by release() or when garbage-collected."""
+
+    def __init__(self):
+        global _holds, _started_by_holds
+        with _lock:
+            _holds += 1
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEBACK_FRAMES)
+                _started_by_holds = True
+        self._finalizer = weakref.finalize(self, _release_hold)
+
+    def release(self):
+        self._finalizer()
+
+def acquire_tracing():
+    """Keep allocation tracing on until the returned TracingHold is released."""
+    return TracingHold()
+
+@contextmanager
+def track_memory(stage):
+    """
+    Record the bytes allocated and retained by the enclosed block under stage.
+    Yields a dict that receives this run's "allocated" and "retained" bytes on exit
+    (left empty when accounting is off).
+    """
+    measurement = {}
+    if not tracemalloc.is_tracing():
+        yield measurement
+        return
+    thread = threading.get_ident()
+    with _lock:
+        current, peak = tracemalloc.get_traced_memory()
+        # reset_peak below is process-wide: it would lose the peak so far of every
+        # open stage, in this thread (enclosing stages) and in the others
+        for stages in _open_stages.values():
+            stages[-1][1] = max(stages[-1][1], peak)
+        tracemalloc.reset_peak()
+        _open_stages.setdefault(thread, []).append([current, current])
+    try:
+        yield measurement
+    finally:
+        with _lock:
+            stages = _open_stages[thread]
+            start, inner_peak = stages.pop()
+            if not stages:
+                del _open_stages[thread]
+            if not tracemalloc.is_tracing():
+                # Tracing was stopped while the stage ran: nothing to measure
+                return
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, inner_peak)
+            if stages:
+                stages[-1][1] = max(stages[-1][1], peak)
+            record = _records.setdefault(stage, {"calls": 0, "allocated": 0, "retained": 0})
+            measurement["allocated"] = peak - start
+            measurement["retained"] = current - start
+            record["calls"] += 1
+            record["allocated"] = max(record["allocated"], measurement["allocated"])
+            record["retained"] = max(record["retained"], measurement["retained"])
+
+def memory_report():
+    """One row per stage measured: calls and the largest allocated/retained bytes of a call."""
+    with _lock:
+        rows = [{"stage": stage, **record} for stage, record in _records.items()]
+    return pd.DataFrame(rows, columns=["stage", "calls", "allocated", "retained"])
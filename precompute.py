@@ -0,0 +1,441 @@
+"""
+Pre-compute every aggregate the dashboard renders into data/analysis_results.json.
+
+The artifact carries a schema version and a content hash of its input files;
+load_or_build_analysis_results rebuilds it whenever either no longer matches.
+
+Usage:
+    python precompute.py
+"""
+import argparse
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from caching import cached, enable_copy_on_write, hash_files
+from cube import ALL_FUELS, build_cube, cube_slice, national_value
+from geography import UNKNOWN, state_ids
+from market_value import market_values
+from memory import memory_report, start_memory_accounting, track_memory
+from station_map import grid_clusters
+from utils import (
+    load_data,
+    prepare_station_data,
+    prepare_price_data
+)
+from volume_series import VolumeSeries, volume_series
+from volumes import VOLUME_COLUMN
+
+# Configuration
+DATA_DIR = Path("data")
+ANALYSIS_RESULTS_FILE = DATA_DIR / "analysis_results.json"
+SCHEMA_VERSION = 5
+FUEL_COLUMNS = ["regular_price", "premium_price", "diesel_price"]
+MARKET_YEAR = 2024
+HISTOGRAM_BINS = 50
+PRICE_RESOLUTION = 0.01
+ALL_STATES = "All States"
+BOX_COLUMNS = ["min", "q1", "median", "q3", "max", "lower_fence", "upper_fence"]
+HISTORY_EXCLUDED_YEARS = [2025]
+
+# Keys of the artifact that hold tables (stored column-oriented)
+TABLE_KEYS = [
+    "stations_by_state",
+    "stations_by_municipality",
+    "state_prices",
+    "municipality_prices",
+    "volume_by_fuel",
+    "volume_by_state_fuel",
+    "volume_by_state",
+    "station_clusters"
+]
+# Keys of the artifact that hold VolumeSeries (stored as their level matrix)
+SERIES_KEYS = ["historical_volume"]
+
+# -------------------------------------------------------------------------
+# Station Aggregates
+# -------------------------------------------------------------------------
+
+def station_aggregates(cube, df_pop):
+    """
+    Station counts per state (all states in df_pop, 0 when a state has no stations)
+    and per municipality, plus product availability counts, read from the cube.
+    """
+    by_state = cube_slice(cube, "state")[["state_name", "stations", "municipalities"]]
+    by_state = pd.DataFrame({
+        "state_id": state_ids(by_state["state_name"]),
+        "num_stations": by_state["stations"],
+        "num_municipalities": by_state["municipalities"]
+    })
+
+    df_states = pd.DataFrame({
+        "state_id": state_ids(df_pop["Entidad Federativa"]),
+        "state_name": df_pop["Entidad Federativa"].astype(str),
+        "2024 population": df_pop["2024 population"]
+    })
+    df_states = df_states.merge(by_state, on="state_id", how="left").drop(columns="state_id")
+    df_states[["num_stations", "num_municipalities"]] = (
+        df_states[["num_stations", "num_municipalities"]].fillna(0).astype(int)
+    )
+
+    by_mun = cube_slice(cube, "municipality")[["municipality_name", "state_name", "stations"]]
+    by_mun.columns = ["municipality_name", "state_name", "num_stations"]
+
+    availability = {"total_stations": int(national_value(cube, ALL_FUELS, "stations"))}
+    for fuel in FUEL_COLUMNS:
+        # Stations listing the fuel, including prices later screened out as outliers
+        availability[fuel] = int(national_value(cube, fuel, "listed"))
+
+    return df_states, by_mun, availability
+
+# -------------------------------------------------------------------------
+# Price Aggregates
+# -------------------------------------------------------------------------
+
+def _with_deviation(df, national_avg):
+    df["price_deviation"] = df["average_price"] - df["fuel"].map(national_avg)
+    df["deviation_pct"] = (df["price_deviation"] / df["fuel"].map(national_avg)) * 100
+    return df
+
+def price_aggregates(cube, df_price, df_pop):
+    """
+    National averages, per-state and per-municipality mean prices with their deviation
+    from the national average (long format, one row per fuel), and price histograms
+    per state. State rows also carry the box-plot statistics (quartiles and whiskers).
+    Statistics come from the cube; df_price is only read to count prices per bin.
+    """
+    national_avg = {fuel: float(national_value(cube, fuel, "mean")) for fuel in FUEL_COLUMNS}
+    all_states = df_pop["Entidad Federativa"].astype(str).unique()
+    all_state_ids = state_ids(all_states)
+
+    state_tables, mun_tables = [], []
+    for fuel in FUEL_COLUMNS:
+        df_state = cube_slice(cube, "state", fuel)
+        df_state = df_state.set_index(state_ids(df_state["state_name"])).reindex(all_state_ids)
+        df_state_table = pd.DataFrame({
+            "state_name": all_states,
+            "fuel": fuel,
+            "average_price": df_state["mean"].to_numpy(),
+            "num_prices": df_state["count"].fillna(0).astype(int).to_numpy()
+        })
+        for column in BOX_COLUMNS:
+            df_state_table[column] = df_state[column].to_numpy()
+        state_tables.append(df_state_table)
+
+        df_mun = cube_slice(cube, "municipality", fuel)
+        df_mun = df_mun[df_mun["count"] > 0]
+        mun_tables.append(pd.DataFrame({
+            "municipality_name": df_mun["municipality_name"],
+            "state_name": df_mun["state_name"],
+            "fuel": fuel,
+            "average_price": df_mun["mean"]
+        }))
+    df_state = _with_deviation(pd.concat(state_tables, ignore_index=True), national_avg)
+    df_mun = _with_deviation(pd.concat(mun_tables, ignore_index=True), national_avg)
+
+    return national_avg, df_state, df_mun, price_histograms(cube, df_price)
+
+def _nice_bin_size(span, bins):
+    """Smallest 1/2/2.5/5 x 10^k width covering span in at most `bins` bins (at least PRICE_RESOLUTION)."""
+    raw = max(span / bins, PRICE_RESOLUTION)
+    magnitude = 10 ** np.floor(np.log10(raw))
+    for step in [1, 2, 2.5, 5, 10]:
+        if step * magnitude >= raw - 1e-12:
+            return float(step * magnitude)
+
+def _binned_counts(values, codes, stats, bins):
+    """
+    Histogram of values per group (codes index the rows of the cube slice stats).
+    Returns one {"start", "size", "counts", "mean"} dict per group, None when it has no prices.
+    """
+    has_prices = (stats["count"] > 0).to_numpy()
+    lows = np.nan_to_num(stats["min"].to_numpy())
+    highs = np.nan_to_num(stats["max"].to_numpy())
+    sizes = np.array([_nice_bin_size(hi - lo, bins) for lo, hi in zip(lows, highs)])
+    starts = np.floor(lows / sizes + 1e-9) * sizes
+    n_bins = np.where(has_prices, np.floor((highs - starts) / sizes + 1e-9) + 1, 0).astype(np.int64)
+    offsets = np.concatenate(([0], np.cumsum(n_bins)))
+
+    # One bincount over (group offset + bin index) counts every group at once
+    valid = codes >= 0
+    values, codes = values[valid], codes[valid]
+    bin_index = np.floor((values - starts[codes]) / sizes[codes] + 1e-9).astype(np.int64)
+    bin_index = np.clip(bin_index, 0, n_bins[codes] - 1)
+    counts = np.bincount(offsets[codes] + bin_index, minlength=offsets[-1])
+
+    means = stats["mean"].to_numpy()
+    return [
+        {
+            "start": round(float(starts[i]), 6),
+            "size": float(sizes[i]),
+            "counts": counts[offsets[i]:offsets[i + 1]].tolist(),
+            "mean": float(means[i])
+        } if has_prices[i] else None
+        for i in range(len(stats))
+    ]
+
+def price_histograms(cube, df_price, bins=HISTOGRAM_BINS):
+    """
+    Price counts per bin for every fuel and state, plus ALL_STATES:
+    {fuel: {state: {"start", "size", "counts", "mean"}}}.
+    Bins have a "nice" width over the state's own price range, so switching
+    states is a dictionary lookup and a chart ships O(bins) values.
+    """
+    histograms = {}
+    for fuel in FUEL_COLUMNS:
+        valid = df_price[df_price[fuel].notna()]
+        values = valid[fuel].to_numpy(dtype=float)
+
+        national = cube_slice(cube, "national", fuel)
+        by_state = cube_slice(cube, "state", fuel)
+        state_codes = pd.Categorical(valid["state_name"].astype(str), categories=by_state["state_name"]).codes
+
+        entries = zip(
+            [ALL_STATES, *by_state["state_name"].astype(str)],
+            _binned_counts(values, np.zeros(len(values), dtype=np.int64), national, bins)
+            + _binned_counts(values, state_codes.astype(np.int64), by_state, bins)
+        )
+        histograms[fuel] = {state: entry for state, entry in entries if entry is not None}
+    return histograms
+
+# -------------------------------------------------------------------------
+# Volume Aggregates
+# -------------------------------------------------------------------------
+
+def _by_state_id(state_names, values):
+    """values as a Series indexed by state_id (rows with an unrecognized state name left out)."""
+    ids = state_ids(state_names)
+    known = ids != UNKNOWN
+    return pd.Series(np.asarray(values)[known], index=ids[known])
+
+def volume_aggregates(df_volume, cube, df_pop, year=MARKET_YEAR):
+    """
+    Volume and estimated market value tables for one year:
+    - by state & fuel: the market_values table (volume, price used, market value) plus
+      share of state volume, share of state value and per capita
+    - by fuel: volume, share, volume-weighted average price, market value and market share
+    - by state: volume, stations, volume per station, market value, population, per capita
+    - national totals
+    Market values use each state's mean price of the fuel, the national mean where the
+    state has none (see market_value.py); the other tables are rollups of by state & fuel.
+    df_volume holds the yearly totals of volumes.load_volumes (fuels folded, states in
+    their canonical spelling); states are joined to the station counts and population
+    on their state_id.
+    """
+    df_year = df_volume[df_volume["Año"] == year]
+    df_year = pd.DataFrame({
+        "EntidadFederativa": df_year["EntidadFederativa"].astype(str),
+        "SubProducto": df_year["SubProducto"].astype(str),
+        VOLUME_COLUMN: df_year[VOLUME_COLUMN]
+    })
+    by_state_fuel = market_values(
+        df_year.groupby(["EntidadFederativa", "SubProducto"])[VOLUME_COLUMN].sum().reset_index(), cube
+    )
+
+    by_fuel = by_state_fuel.groupby("SubProducto")[[VOLUME_COLUMN, "Market_Value"]].sum().reset_index()
+    by_fuel = by_fuel.sort_values(VOLUME_COLUMN, ascending=False)
+    total_volume = by_fuel[VOLUME_COLUMN].sum()
+    total_market_value = by_fuel["Market_Value"].sum()
+    by_fuel["Percentage"] = (by_fuel[VOLUME_COLUMN] / total_volume) * 100
+    by_fuel["Avg_Price"] = by_fuel["Market_Value"] / by_fuel[VOLUME_COLUMN]
+    by_fuel["Market_Share"] = (by_fuel["Market_Value"] / total_market_value) * 100
+    by_fuel = by_fuel[["SubProducto", VOLUME_COLUMN, "Percentage", "Avg_Price", "Market_Value", "Market_Share"]]
+
+    by_state = by_state_fuel.groupby("EntidadFederativa")[[VOLUME_COLUMN, "Market_Value"]].sum().reset_index()
+    state_stations = cube_slice(cube, "state")
+    stations_per_state = _by_state_id(state_stations["state_name"], state_stations["stations"])
+    by_state_ids = pd.Series(state_ids(by_state["EntidadFederativa"]))
+    by_state["count_stations"] = by_state_ids.map(stations_per_state).fillna(0).to_numpy()
+    by_state["avg_volume_per_station"] = np.where(
+        by_state["count_stations"] > 0,
+        by_state[VOLUME_COLUMN] / by_state["count_stations"].where(by_state["count_stations"] > 0),
+        0
+    )
+    population = _by_state_id(df_pop["Entidad Federativa"], df_pop["2024 population"])
+    by_state["2024 population"] = by_state_ids.map(population).to_numpy()
+    by_state["volume_per_capita"] = by_state[VOLUME_COLUMN] / by_state["2024 population"]
+
+    # State totals line up with by_state_fuel through its state codes
+    state_codes = pd.Categorical(by_state_fuel["EntidadFederativa"], categories=by_state["EntidadFederativa"]).codes
+    by_state_fuel["state_percentage"] = (
+        by_state_fuel[VOLUME_COLUMN] / by_state[VOLUME_COLUMN].to_numpy()[state_codes] * 100
+    )
+    by_state_fuel["market_state_percentage"] = (
+        by_state_fuel["Market_Value"] / by_state["Market_Value"].to_numpy()[state_codes] * 100
+    )
+    by_state_fuel["2024 population"] = by_state["2024 population"].to_numpy()[state_codes]
+    by_state_fuel["volume_per_capita"] = by_state_fuel[VOLUME_COLUMN] / by_state_fuel["2024 population"]
+    by_state_fuel = by_state_fuel.drop(columns="state_id")
+
+    total_stations = int(national_value(cube, ALL_FUELS, "stations"))
+    national = {
+        "year": int(year),
+        "total_volume": float(total_volume),
+        "total_market_value": float(total_market_value),
+        "state_priced_share": float(
+            by_state_fuel.loc[by_state_fuel["Price_Source"] == "state", VOLUME_COLUMN].sum() / total_volume * 100
+        ) if total_volume else None,
+        "total_stations": int(total_stations),
+        "avg_volume_per_station": float(total_volume / total_stations) if total_stations else None
+    }
+    return by_fuel, by_state_fuel, by_state, national
+
+def historical_aggregates(df_volume):
+    """Yearly national and per-state volume series with YoY change, CAGR and rolling averages."""
+    return volume_series(df_volume, HISTORY_EXCLUDED_YEARS)
+
+# -------------------------------------------------------------------------
+# Artifact
+# -------------------------------------------------------------------------
+
+def _plain(df):
+    """Cast categorical columns to plain strings so tables behave the same before and after JSON."""
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str)
+    return df
+
+def compute_analysis_results(df_station, df_price, df_volume, df_pop):
+    """
+    Compute every aggregate rendered by the dashboard. Tables are returned as DataFrames.
+    Station and price statistics are all read from one aggregation cube;
+    the station map clusters are built from the station coordinates.
+    """
+    with track_memory("build_cube"):
+        cube = build_cube(df_price, df_station)
+    stations_by_state, stations_by_municipality, availability = station_aggregates(cube, df_pop)
+    national_avg, state_prices, municipality_prices, price_histograms = price_aggregates(cube, df_price, df_pop)
+    volume_by_fuel, volume_by_state_fuel, volume_by_state, volume_national = volume_aggregates(
+        df_volume, cube, df_pop
+    )
+    results = {
+        "schema_version": SCHEMA_VERSION,
+        "stations_by_state": stations_by_state,
+        "stations_by_municipality": stations_by_municipality,
+        "availability": availability,
+        "national_avg_prices": national_avg,
+        "state_prices": state_prices,
+        "municipality_prices": municipality_prices,
+        "price_histograms": price_histograms,
+        "volume_by_fuel": volume_by_fuel,
+        "volume_by_state_fuel": volume_by_state_fuel,
+        "volume_by_state": volume_by_state,
+        "volume_national": volume_national,
+        "historical_volume": historical_aggregates(df_volume),
+        "station_clusters": grid_clusters(df_price)
+    }
+    for key in TABLE_KEYS:
+        results[key] = _plain(results[key])
+    return results
+
+def _table_to_json(df):
+    """Column-oriented dict with NaN as null."""
+    df = df.reset_index(drop=True)
+    return {
+        col: [None if pd.isna(v) else v for v in df[col].tolist()]
+        for col in df.columns
+    }
+
+def _table_from_json(columns):
+    return pd.DataFrame(columns)
+
+def save_analysis_results(results, path):
+    """Write results to JSON, storing each table column-oriented."""
+    serializable = {
+        key: _table_to_json(value) if key in TABLE_KEYS else value.to_json() if key in SERIES_KEYS else value
+        for key, value in results.items()
+    }
+    path = Path(path)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(serializable, f, ensure_ascii=False)
+    tmp_path.replace(path)
+
+@cached(lambda path: hash_files([path]))
+def read_analysis_results(path):
+    """
+    Read the JSON artifact back, turning tables into DataFrames. Returns None if missing.
+    Parsed results are shared across sessions until the file changes.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            results = json.load(f)
+    except FileNotFoundError:
+        return None
+    for key in TABLE_KEYS:
+        if key in results:
+            results[key] = _table_from_json(results[key])
+    for key in SERIES_KEYS:
+        if key in results:
+            results[key] = VolumeSeries.from_json(results[key])
+    return results
+
+def is_current(results, input_hash):
+    """True if results were built with this schema version from inputs with this hash."""
+    return (
+        results is not None
+        and results.get("schema_version") == SCHEMA_VERSION
+        and results.get("input_hash") == input_hash
+    )
+
+@cached(lambda gas_prices_path, population_path, volumes_path, results_path=ANALYSIS_RESULTS_FILE: (
+    hash_files([gas_prices_path, population_path, volumes_path]), str(results_path)
+))
+def build_analysis_results(gas_prices_path, population_path, volumes_path, results_path=ANALYSIS_RESULTS_FILE):
+    """
+    Load and prepare the raw data, compute all aggregates and write the artifact.
+    If results_path is None (or not writable) the results are only returned.
+    The build is cached on the input hashes, so a deployment that cannot write the
+    artifact rebuilds it once per input change, not on every rerun.
+    """
+    input_paths = [gas_prices_path, population_path, volumes_path]
+    df_gas, df_pop, df_volume = load_data(*input_paths)
+    df_station = prepare_station_data(df_gas, df_pop)
+    df_price = prepare_price_data(df_station)
+
+    with track_memory("compute_analysis_results"):
+        results = compute_analysis_results(df_station, df_price, df_volume, df_pop)
+    results["input_hash"] = hash_files(input_paths)
+    results["generated_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+    if results_path is not None:
+        try:
+            save_analysis_results(results, results_path)
+        except OSError:
+            # Read-only deployments still get the in-memory results
+            pass
+    return results
+
+def load_or_build_analysis_results(gas_prices_path, population_path, volumes_path, results_path=ANALYSIS_RESULTS_FILE):
+    """Return the artifact if it is current for these inputs, otherwise rebuild it."""
+    input_hash = hash_files([gas_prices_path, population_path, volumes_path])
+    results = read_analysis_results(results_path)
+    if is_current(results, input_hash):
+        return results
+    return build_analysis_results(gas_prices_path, population_path, volumes_path, results_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-compute the dashboard aggregates.")
+    parser.add_argument("--gas-prices", default=DATA_DIR / "gas_prices_clean.csv", type=Path)
+    parser.add_argument("--population", default=DATA_DIR / "population.csv", type=Path)
+    parser.add_argument("--volumes", default=DATA_DIR / "volumes.csv", type=Path)
+    parser.add_argument("--output", default=ANALYSIS_RESULTS_FILE, type=Path)
+    parser.add_argument("--memory", action="store_true", help="Report the bytes allocated by each stage")
+    args = parser.parse_args()
+
+    enable_copy_on_write()
+
+    if args.memory:
+        start_memory_accounting()
+    results = build_analysis_results(args.gas_prices, args.population, args.volumes, args.output)
+    print(f"Wrote {args.output} (input hash {results['input_hash'][:12]})")
+    if args.memory:
+        report = memory_report()
+        report[["allocated", "retained"]] = report[["allocated", "retained"]] / 1024 ** 2
+        print(report.to_string(index=False, float_format=lambda mb: f"{mb:,.1f} MB"))
+
+if __name__ == "__main__":
+    main()
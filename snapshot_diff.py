@@ -0,0 +1,177 @@
+"""
+Price-change detection between two station snapshots (gas_prices_clean.csv tables).
+
+Stations are matched on (place_id, cre_id): both ids are encoded into one int64
+key per row, and the two key arrays are merged with a sorted intersection, so a
+national diff is a handful of NumPy passes. Prices are compared in integer
+centavos. diff_snapshots returns three tables:
+- added:    stations only in the new snapshot
+- removed:  stations only in the old snapshot
+- repriced: stations in both whose price of at least one fuel changed,
+            with <fuel>_old, <fuel>_new and <fuel>_delta (NaN when the fuel was
+            listed or delisted)
+
+iter_diffs streams the diffs of consecutive snapshots, holding two in memory.
+
+Usage:
+    python snapshot_diff.py old.csv new.csv [--output-dir diffs/]
+    python snapshot_diff.py --feeds data/      # consecutive dated CRE feeds
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ingest import find_feeds, iter_clean_tables
+from validation import DUPLICATE_POLICIES, DUPLICATE_POLICY
+
+# Configuration
+DATA_DIR = Path("data")
+FUEL_COLUMNS = ["regular_price", "premium_price", "diesel_price"]
+ID_COLUMNS = ["place_id", "cre_id"]
+STATION_COLUMNS = [*ID_COLUMNS, "station_name", "state_name", "municipality_name"]
+SUMMARY_LEVELS = {
+    "state": ["state_name"],
+    "municipality": ["state_name", "municipality_name"]
+}
+
+# -------------------------------------------------------------------------
+# Diff
+# -------------------------------------------------------------------------
+
+def _station_keys(df_old, df_new):
+    """One int64 key per row of each snapshot, equal when place_id and cre_id both match."""
+    cre_codes, cre_uniques = pd.factorize(
+        pd.concat([df_old["cre_id"], df_new["cre_id"]], ignore_index=True).astype(object).fillna(""),
+        use_na_sentinel=False
+    )
+    place_ids = np.concatenate([df_old["place_id"].to_numpy(dtype=np.int64), df_new["place_id"].to_numpy(dtype=np.int64)])
+    keys = place_ids * len(cre_uniques) + cre_codes
+    return keys[:len(df_old)], keys[len(df_old):]
+
+def _centavos(df, fuel):
+    """Prices of a fuel in centavos as float (NaN when not listed)."""
+    return np.rint(df[fuel].to_numpy(dtype=float, na_value=np.nan) * 100)
+
+def _stations(df, positions, columns=STATION_COLUMNS + FUEL_COLUMNS):
+    return df[[col for col in columns if col in df.columns]].iloc[positions].reset_index(drop=True)
+
+def diff_snapshots(df_old, df_new):
+    """
+    Added, removed and repriced stations between two snapshots:
+    {"added": DataFrame, "removed": DataFrame, "repriced": DataFrame}.
+    Repriced rows carry the new snapshot's station name and geography.
+    """
+    df_old = df_old.drop_duplicates(subset=ID_COLUMNS)
+    df_new = df_new.drop_duplicates(subset=ID_COLUMNS)
+    old_keys, new_keys = _station_keys(df_old, df_new)
+
+    _, old_common, new_common = np.intersect1d(old_keys, new_keys, assume_unique=True, return_indices=True)
+    removed = np.ones(len(df_old), dtype=bool)
+    removed[old_common] = False
+    added = np.ones(len(df_new), dtype=bool)
+    added[new_common] = False
+
+    changed = np.zeros(len(old_common), dtype=bool)
+    prices = {}
+    for fuel in FUEL_COLUMNS:
+        old_price = _centavos(df_old, fuel)[old_common]
+        new_price = _centavos(df_new, fuel)[new_common]
+        same = (old_price == new_price) | (np.isnan(old_price) & np.isnan(new_price))
+        changed |= ~same
+        prices[fuel] = (old_price, new_price)
+
+    repriced = _stations(df_new, new_common[changed], STATION_COLUMNS)
+    for fuel, (old_price, new_price) in prices.items():
+        repriced[f"{fuel}_old"] = old_price[changed] / 100
+        repriced[f"{fuel}_new"] = new_price[changed] / 100
+        repriced[f"{fuel}_delta"] = (new_price[changed] - old_price[changed]) / 100
+
+    return {
+        "added": _stations(df_new, np.flatnonzero(added)),
+        "removed": _stations(df_old, np.flatnonzero(removed)),
+        "repriced": repriced
+    }
+
+def summarize_diff(diff, level="state"):
+    """
+    Rollup of a diff per state or municipality: stations added, removed and repriced,
+    and per fuel the number of increases and decreases and the mean change (MXN)
+    of the stations whose price of that fuel changed.
+    """
+    keys = SUMMARY_LEVELS[level]
+    counts = [
+        diff[name].groupby(keys, dropna=False, observed=True).size().rename(name)
+        for name in ["added", "removed", "repriced"]
+    ]
+    repriced = diff["repriced"]
+    for fuel in FUEL_COLUMNS:
+        delta = repriced[f"{fuel}_delta"]
+        grouped = pd.DataFrame({
+            f"{fuel}_increases": delta > 0,
+            f"{fuel}_decreases": delta < 0,
+            f"{fuel}_mean_delta": delta.where(delta != 0)
+        }).groupby([repriced[key] for key in keys], dropna=False, observed=True)
+        counts.append(grouped[[f"{fuel}_increases", f"{fuel}_decreases"]].sum())
+        counts.append(grouped[f"{fuel}_mean_delta"].mean())
+
+    summary = pd.concat(counts, axis=1)
+    count_columns = [col for col in summary.columns if not col.endswith("_mean_delta")]
+    summary[count_columns] = summary[count_columns].fillna(0).astype(int)
+    return summary.reset_index().sort_values(keys, kind="stable").reset_index(drop=True)
+
+# -------------------------------------------------------------------------
+# Streaming
+# -------------------------------------------------------------------------
+
+def iter_diffs(snapshots):
+    """
+    Diff each snapshot against the previous one. snapshots yields (label, DataFrame)
+    in order; yields (previous label, label, diff), keeping only two snapshots loaded.
+    """
+    previous_label, previous = None, None
+    for label, snapshot in snapshots:
+        if previous is not None:
+            yield previous_label, label, diff_snapshots(previous, snapshot)
+        previous_label, previous = label, snapshot
+
+def feed_snapshots(feed_dir, registry_path=DATA_DIR / "gasolineras_mx.csv", workers=1, policy=DUPLICATE_POLICY):
+    """
+    (date, validated clean station table) of every dated CRE feed pair in feed_dir,
+    oldest first; a feed failing validation raises ValueError (see ingest.clean_feed).
+    """
+    feeds = find_feeds(feed_dir)
+    tables = iter_clean_tables([(places, prices) for _, places, prices in feeds], registry_path, workers, policy)
+    for (day, _, _), df_clean in zip(feeds, tables):
+        yield day, df_clean
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect station and price changes between snapshots.")
+    parser.add_argument("snapshots", nargs="*", type=Path, help="Two clean station CSV files (old, new)")
+    parser.add_argument("--feeds", type=Path, help="Diff consecutive dated CRE feeds in this directory instead")
+    parser.add_argument("--registry", default=DATA_DIR / "gasolineras_mx.csv", type=Path)
+    parser.add_argument("--output-dir", type=Path, help="Write added/removed/repriced CSV files here")
+    parser.add_argument("--policy", default=DUPLICATE_POLICY, choices=DUPLICATE_POLICIES,
+                        help="How repeated prices and duplicate stations of a feed are merged")
+    args = parser.parse_args()
+
+    if args.feeds is not None:
+        snapshots = feed_snapshots(args.feeds, args.registry, policy=args.policy)
+    elif len(args.snapshots) == 2:
+        snapshots = ((path.stem, pd.read_csv(path, dtype={"cre_id": str})) for path in args.snapshots)
+    else:
+        parser.error("pass two snapshot CSV files or --feeds")
+
+    for old_label, new_label, diff in iter_diffs(snapshots):
+        print(
+            f"{old_label} -> {new_label}: {len(diff['added']):,} added, "
+            f"{len(diff['removed']):,} removed, {len(diff['repriced']):,} repriced"
+        )
+        if args.output_dir is not None:
+            args.output_dir.mkdir(parents=True, exist_ok=True)
+            for name, table in diff.items():
+                table.to_csv(args.output_dir / f"{old_label}_{new_label}_{name}.csv", index=False)
+
+if __name__ == "__main__":
+    main()
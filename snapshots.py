@@ -0,0 +1,174 @@
+"""
+Typed columnar snapshots of the dashboard datasets.
+
+The CSV files are parsed once, cast to explicit dtypes (categoricals for geography,
+float32 prices, integer population) and written as Arrow IPC files under
+data/snapshots/. load_data reads those snapshots, optionally memory-mapped,
+and only parses the CSV when no up-to-date snapshot exists.
+
+Usage:
+    python snapshots.py
+"""
+import argparse
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from caching import file_digest
+
+# Configuration
+DATA_DIR = Path("data")
+SNAPSHOT_DIR_NAME = "snapshots"
+SNAPSHOT_SUFFIX = ".arrow"
+# Schema metadata key holding the SHA-256 of the CSV a snapshot was built from
+SOURCE_DIGEST_KEY = b"source_digest"
+
+# Column dtypes per dataset, keyed by CSV file stem
+SCHEMAS = {
+    "gas_prices_clean": {
+        "place_id": "int64",
+        "longitude": "float64",
+        "latitude": "float64",
+        "regular_price": "float32",
+        "premium_price": "float32",
+        "diesel_price": "float32",
+        "EntidadFederativaId": "Int16",
+        "MunicipioId": "Int16",
+        "state_name": "category",
+        "municipality_name": "category",
+    },
+    "population": {
+        "Entidad Federativa": "category",
+        "Count Municipios": "int16",
+        "2024 population": "int64",
+        "2020 population": "int64",
+        "2010 population": "int64",
+    },
+    "volumes": {
+        "Año": "int16",
+        "Mes": "int8",
+        "EntidadFederativa": "category",
+        "Producto": "category",
+        "SubProducto": "category",
+        "Volumen Vendido (litros)": "float64",
+    },
+}
+
+# -------------------------------------------------------------------------
+# Typing
+# -------------------------------------------------------------------------
+
+def apply_schema(df, dataset):
+    """
+    Cast the columns of a freshly parsed CSV to the dtypes declared in SCHEMAS.
+    Numeric columns stored as comma-formatted text (e.g. "1,500,412") are parsed here,
+    once, so chart code never has to re-parse them.
+    """
+    df = df.copy()
+    for col, dtype in SCHEMAS.get(dataset, {}).items():
+        if col not in df.columns:
+            continue
+        if dtype == "category":
+            df[col] = df[col].astype("category")
+            continue
+        if df[col].dtype == object or pd.api.types.is_string_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col].str.replace(",", "", regex=False), errors="coerce")
+        else:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+        if dtype.startswith("int") and df[col].isna().any():
+            # Keep missing values instead of failing the cast
+            dtype = dtype.capitalize()
+        df[col] = df[col].astype(dtype)
+    return df
+
+def read_csv_typed(csv_path):
+    """Parse a dataset CSV and apply its schema."""
+    csv_path = Path(csv_path)
+    return apply_schema(pd.read_csv(csv_path), csv_path.stem)
+
+# -------------------------------------------------------------------------
+# Snapshot Files
+# -------------------------------------------------------------------------
+
+def snapshot_path(csv_path):
+    """Location of the snapshot for a dataset CSV: <dir>/snapshots/<stem>.arrow"""
+    csv_path = Path(csv_path)
+    return csv_path.parent / SNAPSHOT_DIR_NAME / f"{csv_path.stem}{SNAPSHOT_SUFFIX}"
+
+def snapshot_digest(path):
+    """Digest of the CSV a snapshot was built from (None for snapshots without one)."""
+    with pa.memory_map(str(path)) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    digest = metadata.get(SOURCE_DIGEST_KEY)
+    return digest.decode("ascii") if digest is not None else None
+
+def is_snapshot_current(csv_path):
+    """True if a snapshot exists and was built from the CSV's current contents (or the CSV is gone)."""
+    csv_path = Path(csv_path)
+    path = snapshot_path(csv_path)
+    if not path.exists():
+        return False
+    if not csv_path.exists():
+        return True
+    return snapshot_digest(path) == file_digest(csv_path)
+
+def build_snapshot(csv_path):
+    """Write the typed Arrow snapshot of one dataset CSV and return its path."""
+    df = read_csv_typed(csv_path)
+    path = snapshot_path(csv_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        SOURCE_DIGEST_KEY: file_digest(csv_path).encode("ascii")
+    })
+    # Uncompressed so the file can be memory-mapped without decoding
+    feather.write_feather(table, path, compression="uncompressed")
+    return path
+
+def read_snapshot(path, memory_map=False):
+    """
+    Read a snapshot back into a DataFrame, optionally memory-mapping the file.
+    Columns are converted one block each and the Arrow buffers released as they go,
+    so with memory_map numeric columns without missing values stay views of the
+    mapped file (paged in on demand); categoricals, strings and nullable columns
+    are still copied into the heap.
+    """
+    table = feather.read_table(path, memory_map=memory_map)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+def load_dataset(csv_path, memory_map=False):
+    """
+    Load a dataset from its snapshot when one is current,
+    falling back to parsing the CSV otherwise.
+    """
+    if is_snapshot_current(csv_path):
+        return read_snapshot(snapshot_path(csv_path), memory_map=memory_map)
+    return read_csv_typed(csv_path)
+
+def build_snapshots(csv_paths):
+    """Build snapshots for every existing CSV in csv_paths. Returns the written paths."""
+    written = []
+    for csv_path in csv_paths:
+        if Path(csv_path).exists():
+            written.append(build_snapshot(csv_path))
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Build typed Arrow snapshots of the dashboard datasets.")
+    parser.add_argument(
+        "csv_paths",
+        nargs="*",
+        type=Path,
+        default=[DATA_DIR / f"{name}.csv" for name in SCHEMAS],
+        help="Dataset CSV files (defaults to gas_prices_clean, population and volumes)"
+    )
+    args = parser.parse_args()
+
+    for path in build_snapshots(args.csv_paths):
+        print(f"Wrote {path}")
+
+if __name__ == "__main__":
+    main()
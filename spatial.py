@@ -0,0 +1,271 @@
+"""
+Spatial index over station coordinates.
+
+Stations are bucketed in a uniform longitude/latitude grid stored CSR-style:
+rows sorted by cell plus an offsets array, so the stations of a run of
+neighbouring cells are one contiguous slice. Queries gather the cells around
+each point, then filter candidates by exact great-circle distance:
+
+    index = build_station_index(df_station)
+    index.nearest(-99.13, 19.43, k=5)                        # 5 closest stations
+    index.within_radius(-99.13, 19.43, 10, fuel="diesel_price")
+    index.cheapest(-99.13, 19.43, "diesel_price", radius_km=10)
+    index.in_bbox(-99.3, 19.2, -98.9, 19.6)
+
+Longitudes/latitudes may be scalars or arrays: batches are processed with
+array operations, and every result has a "query" column (position of the
+query point) plus "distance_km".
+"""
+import numpy as np
+import pandas as pd
+
+from caching import cached, frame_key
+
+# Configuration
+EARTH_RADIUS_KM = 6371.0088
+DEFAULT_CELL_DEGREES = 0.1  # ~11 km
+# (min_lon, min_lat, max_lon, max_lat) covering Mexico; stations outside are not indexed
+COORDINATE_BOUNDS = (-119.0, 14.0, -86.0, 33.5)
+FUEL_COLUMNS = ["regular_price", "premium_price", "diesel_price"]
+INDEX_COLUMNS = [
+    "place_id", "cre_id", "station_name", "state_name", "municipality_name",
+    "longitude", "latitude", *FUEL_COLUMNS
+]
+
+# -------------------------------------------------------------------------
+# Distances
+# -------------------------------------------------------------------------
+
+def haversine_km(lon1, lat1, lon2, lat2):
+    """Great-circle distance in km (arrays broadcast)."""
+    lon1, lat1, lon2, lat2 = (np.radians(np.asarray(v, dtype=float)) for v in (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def _points(lon, lat):
+    lon = np.atleast_1d(np.asarray(lon, dtype=float))
+    lat = np.atleast_1d(np.asarray(lat, dtype=float))
+    return np.broadcast_arrays(lon, lat)
+
+def _expand_ranges(starts, stops):
+    """Concatenate the integer ranges [starts[i], stops[i]); also returns each value's range number."""
+    lengths = np.maximum(stops - starts, 0)
+    owner = np.repeat(np.arange(len(starts)), lengths)
+    first = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    values = np.arange(lengths.sum()) - np.repeat(first, lengths) + np.repeat(starts, lengths)
+    return values, owner
+
+# -------------------------------------------------------------------------
+# Index
+# -------------------------------------------------------------------------
+
+class StationIndex:
+    """Grid index over the stations of a frame with longitude/latitude columns."""
+
+    def __init__(self, df_station, cell_degrees=DEFAULT_CELL_DEGREES, fuels=None):
+        columns = [col for col in INDEX_COLUMNS if col in df_station.columns]
+        stations = df_station[columns]
+        lon = stations["longitude"].to_numpy(dtype=float, na_value=np.nan)
+        lat = stations["latitude"].to_numpy(dtype=float, na_value=np.nan)
+        # Missing coordinates are stored as 0, 0 in the CRE feed and some longitudes lack
+        # their sign; only stations inside COORDINATE_BOUNDS are indexed
+        min_lon, min_lat, max_lon, max_lat = COORDINATE_BOUNDS
+        located = (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+
+        self.cell_degrees = cell_degrees
+        self.min_lon = float(lon[located].min()) if located.any() else 0.0
+        self.min_lat = float(lat[located].min()) if located.any() else 0.0
+        self.nx = int((lon[located].max() - self.min_lon) // cell_degrees) + 1 if located.any() else 1
+        self.ny = int((lat[located].max() - self.min_lat) // cell_degrees) + 1 if located.any() else 1
+
+        cells = self._cell_y(lat[located]) * self.nx + self._cell_x(lon[located])
+        order = np.argsort(cells, kind="stable")
+        self.stations = stations[located].iloc[order].reset_index(drop=True)
+        self.lon = lon[located][order]
+        self.lat = lat[located][order]
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=self.nx * self.ny))))
+        # Read-only views: freezing the frame's own arrays would break pandas on them
+        self._columns = {col: self.stations[col].to_numpy().view() for col in self.stations.columns}
+        for values in (self.lon, self.lat, self.offsets, *self._columns.values()):
+            values.flags.writeable = False
+        # Built up front: the index is shared by every session and never modified after this
+        fuels = [col for col in FUEL_COLUMNS if col in self.stations.columns] if fuels is None else fuels
+        self._fuel_indexes = {
+            fuel: StationIndex(self.stations[self.stations[fuel].notna()], cell_degrees, fuels=())
+            for fuel in fuels
+        }
+
+    def __len__(self):
+        return len(self.stations)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the index, its station table and its per-fuel indexes."""
+        arrays = sum(values.nbytes for values in (self.lon, self.lat, self.offsets))
+        stations = int(self.stations.memory_usage(index=True, deep=True).sum())
+        return arrays + stations + sum(index.nbytes for index in self._fuel_indexes.values())
+
+    def _cell_x(self, lon):
+        return np.clip(((lon - self.min_lon) // self.cell_degrees).astype(np.int64), 0, self.nx - 1)
+
+    def _cell_y(self, lat):
+        return np.clip(((lat - self.min_lat) // self.cell_degrees).astype(np.int64), 0, self.ny - 1)
+
+    def for_fuel(self, fuel):
+        """Index over the stations listing a price for fuel (built per call for columns outside FUEL_COLUMNS)."""
+        if fuel is None:
+            return self
+        if fuel in self._fuel_indexes:
+            return self._fuel_indexes[fuel]
+        return StationIndex(self.stations[self.stations[fuel].notna()], self.cell_degrees, fuels=())
+
+    def _blocks(self, cx0, cx1, cy0, cy1):
+        """
+        Station positions in the cell blocks [cx0, cx1] x [cy0, cy1] (one block per query,
+        clipped to the grid) as flat (station, query) arrays.
+        """
+        cx0, cx1 = np.clip(cx0, 0, self.nx - 1), np.clip(cx1, 0, self.nx - 1)
+        cy0, cy1 = np.clip(cy0, 0, self.ny - 1), np.clip(cy1, 0, self.ny - 1)
+        # Each block row is one contiguous slice of the sorted stations
+        rows, query = _expand_ranges(cy0, cy1 + 1)
+        starts = self.offsets[rows * self.nx + cx0[query]]
+        stops = self.offsets[rows * self.nx + cx1[query] + 1]
+        positions, row_owner = _expand_ranges(starts, stops)
+        return positions, query[row_owner]
+
+    def _pairs(self, lon, lat, radius_km):
+        """(query, station position, distance) of every station within radius_km of each point."""
+        radius_deg = np.degrees(radius_km / EARTH_RADIUS_KM)
+        lat_far = np.minimum(np.abs(lat) + radius_deg, 89.9)
+        lon_deg = radius_deg / np.cos(np.radians(lat_far))
+        positions, query = self._blocks(
+            self._cell_x(lon - lon_deg), self._cell_x(lon + lon_deg),
+            self._cell_y(lat - radius_deg), self._cell_y(lat + radius_deg)
+        )
+        distance = haversine_km(lon[query], lat[query], self.lon[positions], self.lat[positions])
+        keep = distance <= radius_km
+        return query[keep], positions[keep], distance[keep]
+
+    def _covered_km(self, lon, lat, cx0, cx1, cy0, cy1):
+        """Distance from each point within which every station falls inside its block."""
+        inf = np.full(len(lon), np.inf)
+        south = np.where(cy0 > 0, lat - (self.min_lat + cy0 * self.cell_degrees), inf)
+        north = np.where(cy1 < self.ny - 1, self.min_lat + (cy1 + 1) * self.cell_degrees - lat, inf)
+        west = np.where(cx0 > 0, lon - (self.min_lon + cx0 * self.cell_degrees), inf)
+        east = np.where(cx1 < self.nx - 1, self.min_lon + (cx1 + 1) * self.cell_degrees - lon, inf)
+        lat_km = np.radians(np.minimum(south, north)) * EARTH_RADIUS_KM
+        # Distance to the great circle of a meridian dlon away: asin(sin(dlon) * cos(lat))
+        dlon = np.minimum(west, east)
+        lon_km = np.where(
+            np.isinf(dlon),
+            np.inf,
+            np.arcsin(np.sin(np.radians(np.minimum(dlon, 180))) * np.cos(np.radians(lat))) * EARTH_RADIUS_KM
+        )
+        return np.maximum(np.minimum(lat_km, lon_km), 0)
+
+    def _knn(self, lon, lat, k):
+        """Positions and distances (n x k, -1 / inf padded) of the k nearest stations to each point."""
+        n = len(lon)
+        k = min(k, len(self))
+        positions = np.full((n, k), -1, dtype=np.int64)
+        distances = np.full((n, k), np.inf)
+        if k == 0:
+            return positions, distances
+
+        cx, cy = self._cell_x(lon), self._cell_y(lat)
+        # Narrowest cell side in km at each point, used to size the search rings
+        cell_km = np.radians(self.cell_degrees) * EARTH_RADIUS_KM * np.cos(np.radians(np.minimum(np.abs(lat), 89.9)))
+        pending = np.arange(n)
+        ring = np.ones(n, dtype=np.int64)
+        # Upper bound on each point's k-th distance (from the previous, smaller block)
+        bound = np.full(n, np.inf)
+        while len(pending):
+            cx0, cx1 = cx[pending] - ring, cx[pending] + ring
+            cy0, cy1 = cy[pending] - ring, cy[pending] + ring
+            candidates, local = self._blocks(cx0, cx1, cy0, cy1)
+            distance = haversine_km(lon[pending][local], lat[pending][local], self.lon[candidates], self.lat[candidates])
+            close = distance <= bound[pending][local]
+            candidates, local, distance = candidates[close], local[close], distance[close]
+
+            # k best per query: sort pairs by (query, distance), keep the first k of each query
+            order = np.lexsort((distance, local))
+            local, candidates, distance = local[order], candidates[order], distance[order]
+            first = np.searchsorted(local, np.arange(len(pending)))
+            rank = np.arange(len(local)) - first[local]
+            best = rank < k
+            block_positions = np.full((len(pending), k), -1, dtype=np.int64)
+            block_distances = np.full((len(pending), k), np.inf)
+            block_positions[local[best], rank[best]] = candidates[best]
+            block_distances[local[best], rank[best]] = distance[best]
+
+            # Done when the k-th distance is inside the area the block is guaranteed to cover
+            covered = self._covered_km(lon[pending], lat[pending], np.clip(cx0, 0, None),
+                                       np.minimum(cx1, self.nx - 1), np.clip(cy0, 0, None),
+                                       np.minimum(cy1, self.ny - 1))
+            kth = block_distances[:, -1]
+            bound[pending] = np.minimum(bound[pending], kth)
+            done = kth <= covered
+            positions[pending[done]] = block_positions[done]
+            distances[pending[done]] = block_distances[done]
+
+            # Next ring: wide enough for the k-th distance found so far, else twice as wide
+            needed = np.where(np.isfinite(kth), np.ceil(kth / cell_km[pending]) + 1, 2 * ring)
+            ring = np.maximum(needed.astype(np.int64), ring + 1)[~done]
+            pending = pending[~done]
+        return positions, distances
+
+    def _result(self, query, positions, distance=None):
+        result = {"query": query} if query is not None else {}
+        result.update({col: values[positions] for col, values in self._columns.items()})
+        if distance is not None:
+            result["distance_km"] = distance
+        return pd.DataFrame(result, copy=False)
+
+    # ---------------------------------------------------------------------
+    # Queries
+    # ---------------------------------------------------------------------
+
+    def nearest(self, lon, lat, k=1, fuel=None):
+        """The k nearest stations to each point (optionally only those selling fuel), closest first."""
+        index = self.for_fuel(fuel)
+        lon, lat = _points(lon, lat)
+        positions, distances = index._knn(lon, lat, k)
+        query = np.repeat(np.arange(len(lon)), positions.shape[1])
+        found = positions.ravel() >= 0
+        return index._result(query[found], positions.ravel()[found], distances.ravel()[found])
+
+    def within_radius(self, lon, lat, radius_km, fuel=None):
+        """Every station within radius_km of each point (optionally only those selling fuel), by distance."""
+        index = self.for_fuel(fuel)
+        lon, lat = _points(lon, lat)
+        query, positions, distance = index._pairs(lon, lat, radius_km)
+        order = np.lexsort((distance, query))
+        return index._result(query[order], positions[order], distance[order])
+
+    def cheapest(self, lon, lat, fuel, radius_km=10, n=1):
+        """The n cheapest stations selling fuel within radius_km of each point (ties by distance)."""
+        index = self.for_fuel(fuel)
+        lon, lat = _points(lon, lat)
+        query, positions, distance = index._pairs(lon, lat, radius_km)
+        prices = index.stations[fuel].to_numpy(dtype=float)[positions]
+        order = np.lexsort((distance, prices, query))
+        query, positions, distance = query[order], positions[order], distance[order]
+        rank = np.arange(len(query)) - np.searchsorted(query, query)
+        keep = rank < n
+        return index._result(query[keep], positions[keep], distance[keep])
+
+    def in_bbox(self, min_lon, min_lat, max_lon, max_lat, fuel=None):
+        """Stations inside a longitude/latitude bounding box (optionally only those selling fuel)."""
+        index = self.for_fuel(fuel)
+        positions, _ = index._blocks(
+            index._cell_x(np.array([min_lon])), index._cell_x(np.array([max_lon])),
+            index._cell_y(np.array([min_lat])), index._cell_y(np.array([max_lat]))
+        )
+        inside = ((index.lon[positions] >= min_lon) & (index.lon[positions] <= max_lon) &
+                  (index.lat[positions] >= min_lat) & (index.lat[positions] <= max_lat))
+        return index._result(None, positions[inside])
+
+@cached(lambda df_station, cell_degrees=DEFAULT_CELL_DEGREES: (frame_key(df_station), cell_degrees))
+def build_station_index(df_station, cell_degrees=DEFAULT_CELL_DEGREES):
+    """StationIndex over the station table, built once per table and shared through the cache."""
+    return StationIndex(df_station, cell_degrees)
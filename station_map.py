@@ -0,0 +1,107 @@
+"""
+Station map: grid clusters per zoom level and the payload of one map view.
+
+Stations are projected to Web Mercator world pixels (256 px wide at zoom 0)
+and bucketed in square cells of CLUSTER_CELL_PIXELS screen pixels at every
+zoom in CLUSTER_ZOOMS, keeping the station count and mean price per fuel of
+each cell. precompute.py stores the clusters in the analysis artifact; a map
+view then only ships the clusters inside its bounds, or the individual
+stations once zoomed in to POINTS_MIN_ZOOM, so its size depends on the
+viewport and not on the number of stations:
+- at most (viewport pixels / CLUSTER_CELL_PIXELS^2) clusters
+- at most MAX_VIEWPORT_POINTS stations (denser views stay clustered)
+"""
+import numpy as np
+import pandas as pd
+
+from spatial import COORDINATE_BOUNDS
+
+# Configuration
+CLUSTER_ZOOMS = range(4, 13)
+CLUSTER_CELL_PIXELS = 64
+POINTS_MIN_ZOOM = 13
+MAX_VIEWPORT_POINTS = 500
+FUEL_COLUMNS = ["regular_price", "premium_price", "diesel_price"]
+
+# -------------------------------------------------------------------------
+# Clusters
+# -------------------------------------------------------------------------
+
+def world_pixels(lon, lat):
+    """Web Mercator pixel coordinates at zoom 0 (the world is 256 x 256 px)."""
+    lat = np.radians(np.clip(lat, -85.05, 85.05))
+    x = (np.asarray(lon, dtype=float) + 180) / 360 * 256
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * 256
+    return x, y
+
+def grid_clusters(df_price, zooms=CLUSTER_ZOOMS):
+    """
+    One row per occupied grid cell and zoom: centroid, number of stations and,
+    per fuel, the mean price and number of prices (NaN / 0 when no station lists it).
+    Only stations inside spatial.COORDINATE_BOUNDS are clustered.
+    """
+    lon = df_price["longitude"].to_numpy(dtype=float, na_value=np.nan)
+    lat = df_price["latitude"].to_numpy(dtype=float, na_value=np.nan)
+    min_lon, min_lat, max_lon, max_lat = COORDINATE_BOUNDS
+    located = (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+    lon, lat = lon[located], lat[located]
+    prices = {fuel: df_price[fuel].to_numpy(dtype=float, na_value=np.nan)[located] for fuel in FUEL_COLUMNS}
+    x, y = world_pixels(lon, lat)
+
+    tables = []
+    for zoom in zooms:
+        cell = CLUSTER_CELL_PIXELS / 2 ** zoom
+        cell_ids = (y // cell).astype(np.int64) * int(np.ceil(256 / cell)) + (x // cell).astype(np.int64)
+        _, codes = np.unique(cell_ids, return_inverse=True)
+        n_cells = int(codes.max()) + 1 if len(codes) else 0
+
+        stations = np.bincount(codes, minlength=n_cells)
+        table = {
+            "zoom": np.full(n_cells, zoom),
+            "longitude": np.bincount(codes, weights=lon, minlength=n_cells) / np.maximum(stations, 1),
+            "latitude": np.bincount(codes, weights=lat, minlength=n_cells) / np.maximum(stations, 1),
+            "num_stations": stations
+        }
+        for fuel, values in prices.items():
+            listed = ~np.isnan(values)
+            count = np.bincount(codes[listed], minlength=n_cells)
+            total = np.bincount(codes[listed], weights=values[listed], minlength=n_cells)
+            table[fuel] = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+            table[f"{fuel}_count"] = count
+        tables.append(pd.DataFrame(table))
+
+    clusters = pd.concat(tables, ignore_index=True)
+    # Keep the artifact compact: ~1 m for centroids, 0.001 MXN for prices
+    clusters[["longitude", "latitude"]] = clusters[["longitude", "latitude"]].round(5)
+    clusters[FUEL_COLUMNS] = clusters[FUEL_COLUMNS].round(3)
+    return clusters
+
+# -------------------------------------------------------------------------
+# Map Views
+# -------------------------------------------------------------------------
+
+def cluster_zoom(zoom):
+    """Closest zoom level the clusters were computed for."""
+    return int(np.clip(zoom, CLUSTER_ZOOMS[0], CLUSTER_ZOOMS[-1]))
+
+def _in_bounds(df, bounds):
+    min_lon, min_lat, max_lon, max_lat = bounds
+    return df[
+        df["longitude"].between(min_lon, max_lon) & df["latitude"].between(min_lat, max_lat)
+    ]
+
+def clusters_in_view(clusters, zoom, bounds):
+    """Clusters of the zoom level closest to zoom whose centroid lies in bounds (min_lon, min_lat, max_lon, max_lat)."""
+    return _in_bounds(clusters[clusters["zoom"] == cluster_zoom(zoom)], bounds)
+
+def view_payload(clusters, station_index, zoom, bounds):
+    """
+    What to draw for a map view: ("points", stations) when zoomed in to POINTS_MIN_ZOOM
+    and the view holds at most MAX_VIEWPORT_POINTS stations, else ("clusters", clusters).
+    station_index is a spatial.StationIndex over the same stations.
+    """
+    if zoom >= POINTS_MIN_ZOOM:
+        stations = station_index.in_bbox(*bounds)
+        if len(stations) <= MAX_VIEWPORT_POINTS:
+            return "points", stations
+    return "clusters", clusters_in_view(clusters, zoom, bounds)
@@ -0,0 +1,407 @@
+"""
+Seeded synthetic datasets for load and scale testing.
+
+A StationModel is learned from the shipped data:
+
+- municipalities weighted by their number of stations, each with the mean and
+  spread of its station coordinates
+- per state: mean and spread of the regular price and the share of stations
+  listing each fuel; premium and diesel are drawn as the regular price plus the
+  national premium/diesel spread, so the fuels of a station stay consistent
+- station names, addresses and permit years
+- the share of stations without geography (stations missing from the permit
+  registry), and their own, much lower, fuel listing rates
+- volumes per station by state and sub-product from volumes.csv when it exists
+
+generate writes, with the exact schemas of the shipped files:
+
+    gas_prices_clean.csv         one row per station (prices of the first day)
+    population.csv, volumes.csv  per state; volumes per month over --years
+    YYMMDD_places.xml            CRE places feed, one per day (same stations every day)
+    YYMMDD_prices.xml            CRE prices feed, one per day; prices move as a random walk
+
+with configurable shares of duplicated stations (repeated rows in the table,
+repeated <place> entries in the prices feed), outlier prices and blank geography.
+Stations are generated and written CHUNK_STATIONS at a time, each chunk from its
+own seed, so memory holds one chunk plus three prices per station whatever the
+size of the output.
+
+Usage:
+    python synthetic.py --stations 200000 --days 30 --output synthetic/ [--seed 0]
+        [--duplicates 0.02] [--outliers 0.001] [--blank-geography 0.12]
+"""
+import argparse
+import shutil
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+import pandas as pd
+
+from geography import STATES, UNKNOWN, state_ids
+from spatial import COORDINATE_BOUNDS
+
+# Configuration
+DATA_DIR = Path("data")
+CHUNK_STATIONS = 50_000
+FUEL_TYPES = ["regular", "premium", "diesel"]
+FUEL_COLUMNS = [f"{fuel}_price" for fuel in FUEL_TYPES]
+CLEAN_COLUMNS = [
+    "place_id", "name", "cre_id", "longitude", "latitude", *FUEL_COLUMNS,
+    "EntidadFederativaId", "MunicipioId", "state_name", "municipality_name", "station_name", "address"
+]
+GEOGRAPHY_COLUMNS = ["EntidadFederativaId", "MunicipioId", "state_name", "municipality_name", "station_name", "address"]
+VOLUME_COLUMN = "Volumen Vendido (litros)"
+# Prices outside this range (MXN per litre) are not used to learn the price model
+PRICE_RANGE = (12, 35)
+# States with fewer prices than this use the national price model
+MIN_STATE_PRICES = 5
+# Spread (degrees) of municipalities with a single station
+DEFAULT_SPREAD = 0.02
+MAX_SPREAD = 0.5
+# Share of duplicated entries whose prices differ from the original
+CONFLICT_RATE = 0.01
+# Daily price moves: chance that a station changes a fuel's price, and the move's spread (MXN)
+PRICE_CHANGE_RATE = 0.05
+PRICE_STEP = 0.15
+DEFAULT_YEARS = (2017, 2024)
+YEARLY_GROWTH = 0.01
+MONTHLY_NOISE = 0.05
+# Used when no volumes.csv is available to learn from
+LITRES_PER_STATION_MONTH = 400_000
+SUBPRODUCTS = {
+    "Regular": ("Gasolinas", 0.62),
+    "Premium": ("Gasolinas", 0.12),
+    "Diésel Automotriz": ("Diésel", 0.24),
+    "DUBA": ("Diésel", 0.01),
+    "Diésel Agricola-Marino": ("Diésel", 0.01)
+}
+XML_HEADER = '<?xml version="1.0" encoding="utf-8"?>\n<places>\n'
+XML_FOOTER = "</places>\n"
+
+# -------------------------------------------------------------------------
+# Model
+# -------------------------------------------------------------------------
+
+def _inside_mexico(lon, lat):
+    min_lon, min_lat, max_lon, max_lat = COORDINATE_BOUNDS
+    return (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+
+class StationModel:
+    """Distributions of the station table, learned once and sampled chunk by chunk."""
+
+    def __init__(self, df_gas, df_pop, df_volume=None):
+        lon = df_gas["longitude"].to_numpy(dtype=float, na_value=np.nan)
+        lat = df_gas["latitude"].to_numpy(dtype=float, na_value=np.nan)
+        has_geography = df_gas[["EntidadFederativaId", "MunicipioId", "state_name", "municipality_name"]].notna().all(axis=1)
+        self.blank_geography = float(1 - has_geography.mean())
+
+        # Municipalities, weighted by stations, with the spread of their coordinates
+        located = df_gas[has_geography.to_numpy() & _inside_mexico(lon, lat)]
+        municipalities = located.groupby(["EntidadFederativaId", "MunicipioId"]).agg(
+            state_name=("state_name", "first"),
+            municipality_name=("municipality_name", "first"),
+            stations=("place_id", "size"),
+            lon=("longitude", "mean"),
+            lat=("latitude", "mean"),
+            lon_spread=("longitude", "std"),
+            lat_spread=("latitude", "std")
+        ).reset_index()
+        self.municipalities = municipalities
+        self.weights = municipalities["stations"].to_numpy(dtype=float) / municipalities["stations"].sum()
+        self.municipality_state = state_ids(municipalities["state_name"]).astype(np.int64)
+        self.spread = np.column_stack([
+            municipalities["lon_spread"].fillna(DEFAULT_SPREAD).clip(upper=MAX_SPREAD),
+            municipalities["lat_spread"].fillna(DEFAULT_SPREAD).clip(upper=MAX_SPREAD)
+        ])
+
+        # Prices by state: regular price, fuel spreads and listing rates
+        states = state_ids(df_gas["state_name"]).astype(np.int64)
+        prices = df_gas[FUEL_COLUMNS].to_numpy(dtype=float, na_value=np.nan)
+        valid = (prices >= PRICE_RANGE[0]) & (prices <= PRICE_RANGE[1])
+        regular = np.where(valid[:, 0], prices[:, 0], np.nan)
+        n_states = len(STATES) + 1
+        self.regular_mean = np.full(n_states, np.nanmean(regular))
+        self.regular_std = np.full(n_states, np.nanstd(regular))
+        self.listed_rate = np.tile(np.mean(~np.isnan(prices[has_geography.to_numpy()]), axis=0), (n_states, 1))
+        blank = ~has_geography.to_numpy()
+        self.blank_listed_rate = np.mean(~np.isnan(prices[blank]), axis=0) if blank.any() else self.listed_rate[0]
+        for state in np.unique(states[states != UNKNOWN]):
+            rows = states == state
+            state_regular = regular[rows][~np.isnan(regular[rows])]
+            if len(state_regular) >= MIN_STATE_PRICES:
+                self.regular_mean[state] = state_regular.mean()
+                self.regular_std[state] = state_regular.std()
+            self.listed_rate[state] = np.mean(~np.isnan(prices[rows]), axis=0)
+        # Premium and diesel relative to regular, nationally
+        self.fuel_offset = np.zeros((len(FUEL_TYPES), 2))
+        for j in range(1, len(FUEL_TYPES)):
+            both = valid[:, 0] & valid[:, j]
+            offset = prices[both, j] - prices[both, 0]
+            self.fuel_offset[j] = (offset.mean(), offset.std()) if len(offset) else (0.0, 0.0)
+
+        self.names = df_gas["name"].dropna().to_numpy(dtype=object)
+        self.addresses = df_gas["address"].dropna().to_numpy(dtype=object)
+        years = pd.to_numeric(df_gas["cre_id"].astype(str).str.extract(r"/(\d{4})$")[0], errors="coerce").dropna()
+        self.permit_years = years.value_counts(normalize=True)
+
+        self.population = df_pop
+        # Litres per station and month by (state, sub-product)
+        stations_per_state = np.bincount(states[states != UNKNOWN], minlength=n_states).astype(float)
+        self.subproducts = list(SUBPRODUCTS)
+        self.litres_per_station = np.tile(
+            [LITRES_PER_STATION_MONTH * share for _, share in SUBPRODUCTS.values()], (n_states, 1)
+        )
+        if df_volume is not None:
+            months = df_volume.groupby(["Año", "Mes"]).ngroups
+            volume_states = state_ids(df_volume["EntidadFederativa"]).astype(np.int64)
+            for (state, subproduct), volume in df_volume.groupby([volume_states, "SubProducto"])[VOLUME_COLUMN].sum().items():
+                if state != UNKNOWN and subproduct in SUBPRODUCTS and stations_per_state[state]:
+                    column = self.subproducts.index(subproduct)
+                    self.litres_per_station[state, column] = volume / months / stations_per_state[state]
+
+    def sample(self, n, rng, first_place_id=0, blank_geography=None):
+        """
+        n stations in the clean table layout with their true prices; a blank_geography
+        share (default: learned) has no geography and lists prices at the blank rates.
+        """
+        blank_geography = self.blank_geography if blank_geography is None else blank_geography
+        municipality = rng.choice(len(self.municipalities), n, p=self.weights)
+        rows = self.municipalities.iloc[municipality]
+        state = self.municipality_state[municipality]
+        lon = rows["lon"].to_numpy() + rng.normal(0, 1, n) * self.spread[municipality, 0]
+        lat = rows["lat"].to_numpy() + rng.normal(0, 1, n) * self.spread[municipality, 1]
+
+        regular = rng.normal(self.regular_mean[state], self.regular_std[state])
+        prices = np.column_stack([
+            regular + (rng.normal(*self.fuel_offset[j], n) if j else 0) for j in range(len(FUEL_TYPES))
+        ])
+        blank = rng.random(n) < blank_geography
+        listed_rate = np.where(blank[:, None], self.blank_listed_rate, self.listed_rate[state])
+        listed = rng.random((n, len(FUEL_TYPES))) < listed_rate
+        prices = np.where(listed, np.round(prices, 2), np.nan)
+
+        place_ids = first_place_id + np.arange(n, dtype=np.int64)
+        years = rng.choice(self.permit_years.index.to_numpy(dtype=np.int64), n, p=self.permit_years.to_numpy())
+        names = self.names[rng.integers(0, len(self.names), n)]
+        df = pd.DataFrame({
+            "place_id": place_ids,
+            "name": names,
+            "cre_id": [f"PL/{place_id}/EXP/ES/{year}" for place_id, year in zip(place_ids, years)],
+            "longitude": np.round(lon, 5),
+            "latitude": np.round(lat, 5),
+            **{col: prices[:, j] for j, col in enumerate(FUEL_COLUMNS)},
+            "EntidadFederativaId": rows["EntidadFederativaId"].to_numpy(dtype=float),
+            "MunicipioId": rows["MunicipioId"].to_numpy(dtype=float),
+            "state_name": rows["state_name"].to_numpy(),
+            "municipality_name": rows["municipality_name"].to_numpy(),
+            "station_name": names,
+            "address": self.addresses[rng.integers(0, len(self.addresses), n)]
+        })
+        if blank.any():
+            df = df.assign(**{col: df[col].where(~blank) for col in GEOGRAPHY_COLUMNS})
+        return df
+
+def learn_model(data_dir=DATA_DIR):
+    """StationModel of the shipped gas_prices_clean.csv, population.csv and (if present) volumes.csv."""
+    data_dir = Path(data_dir)
+    df_gas = pd.read_csv(data_dir / "gas_prices_clean.csv", dtype={"cre_id": str})
+    df_pop = pd.read_csv(data_dir / "population.csv", thousands=",")
+    volumes_path = data_dir / "volumes.csv"
+    df_volume = pd.read_csv(volumes_path, thousands=",") if volumes_path.exists() else None
+    return StationModel(df_gas, df_pop, df_volume)
+
+# -------------------------------------------------------------------------
+# Noise
+# -------------------------------------------------------------------------
+
+def inject_outliers(prices, rate, rng):
+    """Replace a share of the listed prices with typos: cents (0.01x) or ten times the price."""
+    prices = prices.copy()
+    hit = ~np.isnan(prices) & (rng.random(prices.shape) < rate)
+    tenfold = rng.random(prices.shape) < 0.5
+    prices[hit & tenfold] = np.round(prices[hit & tenfold] * 10, 2)
+    prices[hit & ~tenfold] = np.round(prices[hit & ~tenfold] / 100, 2)
+    return prices
+
+def _conflicting(prices, rng):
+    """Copy of prices where a CONFLICT_RATE share of the rows differ by a few centavos."""
+    prices = prices.copy()
+    conflict = rng.random(len(prices)) < CONFLICT_RATE
+    prices[conflict] = np.round(prices[conflict] + rng.choice([-0.1, 0.1], (conflict.sum(), prices.shape[1])), 2)
+    return prices
+
+def clean_rows(df, duplicates, outliers, rng):
+    """The clean table rows of a chunk with outliers and duplicated stations."""
+    prices = inject_outliers(df[FUEL_COLUMNS].to_numpy(dtype=float), outliers, rng)
+    df = df.assign(**{col: prices[:, j] for j, col in enumerate(FUEL_COLUMNS)})
+
+    repeated = np.flatnonzero(rng.random(len(df)) < duplicates)
+    if len(repeated):
+        copies = df.iloc[repeated]
+        copy_prices = _conflicting(copies[FUEL_COLUMNS].to_numpy(dtype=float), rng)
+        copies = copies.assign(**{col: copy_prices[:, j] for j, col in enumerate(FUEL_COLUMNS)})
+        df = pd.concat([df, copies]).sort_index(kind="stable").reset_index(drop=True)
+    return df
+
+# -------------------------------------------------------------------------
+# Writers
+# -------------------------------------------------------------------------
+
+def places_xml(df):
+    """<place> elements of the places feed for a chunk of stations."""
+    return "".join(
+        f"  <place place_id=\"{place_id}\">\n"
+        f"    <name>{escape(name)}</name>\n"
+        f"    <cre_id>{escape(cre_id)}</cre_id>\n"
+        f"    <location>\n      <x>{lon}</x>\n      <y>{lat}</y>\n    </location>\n"
+        f"  </place>\n"
+        for place_id, name, cre_id, lon, lat in zip(
+            df["place_id"], df["name"], df["cre_id"], df["longitude"], df["latitude"]
+        )
+    )
+
+def _price_entries(place_ids, prices):
+    lines = []
+    for place_id, row in zip(place_ids.tolist(), prices.tolist()):
+        entries = "".join(
+            f"    <gas_price type={quoteattr(fuel)}>{price}</gas_price>\n"
+            for fuel, price in zip(FUEL_TYPES, row) if price == price
+        )
+        if entries:
+            lines.append(f"  <place place_id=\"{place_id}\">\n{entries}  </place>\n")
+    return lines
+
+def prices_xml(place_ids, prices, duplicates, outliers, rng):
+    """
+    <place> elements of the prices feed: stations listing at least one price, plus a
+    repeated entry for a duplicates share of them (placed after the original).
+    """
+    prices = inject_outliers(prices, outliers, rng)
+    entries = _price_entries(place_ids, prices)
+    repeated = np.flatnonzero(rng.random(len(place_ids)) < duplicates)
+    if len(repeated):
+        entries += _price_entries(place_ids[repeated], _conflicting(prices[repeated], rng))
+    return "".join(entries)
+
+def population_rows(model, rng):
+    """population.csv rows with each population moved by about 1%."""
+    df = model.population.copy()
+    for col in ["2024 population", "2020 population", "2010 population"]:
+        values = np.round(df[col].to_numpy(dtype=float) * rng.normal(1, 0.01, len(df))).astype(np.int64)
+        df[col] = [f"{value:,}" for value in values]
+    return df
+
+def volume_rows(model, stations_per_state, years, rng):
+    """Monthly volumes.csv rows: litres per station x generated stations, with growth and noise."""
+    frames = []
+    states = [state for state in range(1, len(STATES) + 1) if stations_per_state[state]]
+    for year in range(years[0], years[1] + 1):
+        growth = (1 + YEARLY_GROWTH) ** (year - years[0])
+        for month in range(1, 13):
+            litres = model.litres_per_station[states] * stations_per_state[states, None] * growth
+            litres = np.round(litres * rng.lognormal(0, MONTHLY_NOISE, litres.shape))
+            frames.append(pd.DataFrame({
+                "Año": year,
+                "Mes": month,
+                "EntidadFederativa": np.repeat([STATES[state] for state in states], len(model.subproducts)),
+                "Producto": np.tile([SUBPRODUCTS[sub][0] for sub in model.subproducts], len(states)),
+                "SubProducto": np.tile(model.subproducts, len(states)),
+                VOLUME_COLUMN: litres.ravel()
+            }))
+    return pd.concat(frames, ignore_index=True)
+
+def _feed_names(output_dir, day):
+    stem = day.strftime("%y%m%d")
+    return output_dir / f"{stem}_places.xml", output_dir / f"{stem}_prices.xml"
+
+def generate(output_dir, n_stations, days=1, start=date(2025, 2, 13), seed=0, duplicates=0.02,
+             outliers=0.001, blank_geography=None, years=DEFAULT_YEARS, model=None, chunk_stations=CHUNK_STATIONS):
+    """
+    Write a synthetic dataset to output_dir. blank_geography defaults to the share
+    learned from the shipped data. Returns the paths written.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    model = model or learn_model()
+    noise = np.random.default_rng([seed, 1])
+    written = []
+
+    # Day one: clean table and feeds, chunk by chunk; current prices are kept for the next days
+    prices = np.full((n_stations, len(FUEL_TYPES)), np.nan, dtype=np.float32)
+    stations_per_state = np.zeros(len(STATES) + 1, dtype=np.int64)
+    clean_path = output_dir / "gas_prices_clean.csv"
+    places_path, prices_path = _feed_names(output_dir, start)
+    with open(clean_path, "w", encoding="utf-8", newline="") as clean, \
+            open(places_path, "w", encoding="utf-8-sig") as places, \
+            open(prices_path, "w", encoding="utf-8-sig") as feed:
+        places.write(XML_HEADER)
+        feed.write(XML_HEADER)
+        for first in range(0, n_stations, chunk_stations):
+            n = min(chunk_stations, n_stations - first)
+            df = model.sample(n, np.random.default_rng([seed, 0, first]), first + 1, blank_geography)
+            chunk_prices = df[FUEL_COLUMNS].to_numpy(dtype=float)
+            prices[first:first + n] = chunk_prices
+            located = df["EntidadFederativaId"].dropna().to_numpy(dtype=np.int64)
+            stations_per_state += np.bincount(located, minlength=len(stations_per_state))
+            clean_rows(df, duplicates, outliers, noise).to_csv(
+                clean, header=first == 0, index=False, columns=CLEAN_COLUMNS
+            )
+            places.write(places_xml(df))
+            feed.write(prices_xml(df["place_id"].to_numpy(), chunk_prices, duplicates, outliers, noise))
+        places.write(XML_FOOTER)
+        feed.write(XML_FOOTER)
+    written += [clean_path, places_path, prices_path]
+
+    # Following days: same places, prices moved as a random walk
+    place_ids = np.arange(1, n_stations + 1, dtype=np.int64)
+    for offset in range(1, days):
+        day_places, day_prices = _feed_names(output_dir, start + timedelta(days=offset))
+        shutil.copyfile(places_path, day_places)
+        moves = noise.random(prices.shape) < PRICE_CHANGE_RATE
+        prices[moves] = np.round(prices[moves] + noise.normal(0, PRICE_STEP, moves.sum()), 2)
+        with open(day_prices, "w", encoding="utf-8-sig") as feed:
+            feed.write(XML_HEADER)
+            for first in range(0, n_stations, chunk_stations):
+                block = slice(first, first + chunk_stations)
+                feed.write(prices_xml(
+                    place_ids[block], np.round(prices[block].astype(float), 2), duplicates, outliers, noise
+                ))
+            feed.write(XML_FOOTER)
+        written += [day_places, day_prices]
+
+    population_path = output_dir / "population.csv"
+    population_rows(model, noise).to_csv(population_path, index=False)
+    volumes_path = output_dir / "volumes.csv"
+    volume_rows(model, stations_per_state, years, noise).to_csv(volumes_path, index=False)
+    written += [population_path, volumes_path]
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset shaped like the shipped data.")
+    parser.add_argument("--output", default=Path("synthetic"), type=Path)
+    parser.add_argument("--stations", type=int, default=15_000)
+    parser.add_argument("--days", type=int, default=1, help="Dated feed pairs to write")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2025, 2, 13), help="Date of the first feed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duplicates", type=float, default=0.02, help="Share of stations repeated")
+    parser.add_argument("--outliers", type=float, default=0.001, help="Share of prices replaced by typos")
+    parser.add_argument("--blank-geography", type=float, help="Share of stations without geography (default: learned)")
+    parser.add_argument("--years", default=f"{DEFAULT_YEARS[0]}-{DEFAULT_YEARS[1]}", help="Volume history, e.g. 2017-2024")
+    parser.add_argument("--data-dir", default=DATA_DIR, type=Path, help="Shipped data to learn from")
+    args = parser.parse_args()
+
+    first_year, last_year = (int(year) for year in args.years.split("-"))
+    start = time.perf_counter()
+    written = generate(
+        args.output, args.stations, args.days, args.start, args.seed, args.duplicates, args.outliers,
+        args.blank_geography, (first_year, last_year), learn_model(args.data_dir)
+    )
+    elapsed = time.perf_counter() - start
+    size = sum(path.stat().st_size for path in written)
+    print(f"Wrote {len(written)} files ({size / 1024 ** 2:,.1f} MB) to {args.output} in {elapsed:.1f}s")
+
+if __name__ == "__main__":
+    main()
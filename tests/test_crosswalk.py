@@ -0,0 +1,74 @@
+import pandas as pd
+
+from crosswalk import ENRICH_MIN_CONFIDENCE, add_estserv_products, build_crosswalk, estserv_records
+
+# -------------------------------------------------------------------------
+# Registries
+# -------------------------------------------------------------------------
+
+def make_stations(addresses):
+    n = len(addresses)
+    return pd.DataFrame({
+        "place_id": range(1, n + 1),
+        "cre_id": [None] * n,
+        "state_name": ["Puebla"] * n,
+        "name": [f"Gasolinera {chr(65 + i % 26)}{i}" for i in range(n)],
+        "address": addresses
+    })
+
+def make_estserv(addresses):
+    n = len(addresses)
+    return pd.DataFrame({
+        "NO. ES": [f"E{i}" for i in range(n)],
+        "UBICACION": addresses,
+        "CP": ["72000"] * n,
+        "MAGNA": [True] * n, "PREMIUM": [False] * n, "DIESEL": [True] * n, "DME": [False] * n
+    })
+
+def crosswalk_of(station_addresses, estserv_addresses):
+    df_station, df_estserv = make_stations(station_addresses), make_estserv(estserv_addresses)
+    crosswalk = build_crosswalk(df_station, {"estserv": (estserv_records(df_estserv), ("address",))})
+    return df_station, df_estserv, crosswalk
+
+def linked(df_station, crosswalk, station_address):
+    place_id = df_station.loc[df_station["address"] == station_address, "place_id"].iloc[0]
+    return crosswalk[crosswalk["place_id"] == place_id]
+
+# Common streets on each side, so only the house numbers are rare
+STATION_STREETS = [f"Boulevard Forjadores de Puebla No {1000 + i}" for i in range(40)]
+ESTSERV_STREETS = [f"CALLE 4 NORTE NO. {5000 + i}" for i in range(40)]
+
+# -------------------------------------------------------------------------
+# Fuzzy Links
+# -------------------------------------------------------------------------
+
+def test_house_number_alone_is_not_a_link():
+    station = "Boulevard Forjadores de Puebla No 2612"
+    df_station, df_estserv, crosswalk = crosswalk_of(
+        STATION_STREETS + [station], ESTSERV_STREETS + ["CALLE 4 NORTE NO. 2612"]
+    )
+    assert linked(df_station, crosswalk, station).empty
+    df = add_estserv_products(df_station, crosswalk, df_estserv)
+    assert df.loc[df["address"] == station, "sells_regular"].isna().all()
+
+def test_shared_street_name_is_a_link():
+    station = "Boulevard Forjadores de Puebla No 2612"
+    df_station, df_estserv, crosswalk = crosswalk_of(
+        STATION_STREETS + [station], ESTSERV_STREETS + ["BLVD. FORJADORES 2612"]
+    )
+    links = linked(df_station, crosswalk, station)
+    assert links["source_id"].tolist() == ["E40"]
+    assert links["confidence"].iloc[0] >= ENRICH_MIN_CONFIDENCE
+    df = add_estserv_products(df_station, crosswalk, df_estserv)
+    assert df.loc[df["address"] == station, "sells_regular"].tolist() == [True]
+
+def test_numbered_streets_are_a_link():
+    # Yucatán addresses name streets by number: "Calle 21 between 36 and 38, No. 130"
+    station = "21 X 36 Y 38 No. 130"
+    df_station, _, crosswalk = crosswalk_of(STATION_STREETS + [station], ESTSERV_STREETS + ["21 X 36 Y 38 NO. 130"])
+    assert linked(df_station, crosswalk, station)["source_id"].tolist() == ["E40"]
+
+def test_same_tokens_are_a_link():
+    station = "Calle 6 No. 1450"
+    df_station, _, crosswalk = crosswalk_of(STATION_STREETS + [station], ESTSERV_STREETS + ["CALLE 6 N 1450"])
+    assert linked(df_station, crosswalk, station)["source_id"].tolist() == ["E40"]
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from formatting import (
+    format_currency, format_number, format_percent, format_population, format_price, format_volume
+)
+
+# -------------------------------------------------------------------------
+# Per-row formatters the charts used before formatting.py
+# -------------------------------------------------------------------------
+
+def old_format_volume(x, include_label=True):
+    if x >= 1e9:
+        val = f"{x/1e9:.2f}B".rstrip('0').rstrip('.')
+        return f"{val} liters" if include_label else val
+    val = f"{x/1e6:.2f}M".rstrip('0').rstrip('.')
+    return f"{val} liters" if include_label else val
+
+def old_format_currency(x, include_currency=False, include_usd=False):
+    usd_value = x/20
+    if x >= 1e12:
+        mxn = f"${x/1e12:.2f}T".rstrip('0').rstrip('.')
+        if include_usd:
+            if usd_value < 1e12:
+                usd = f"(USD {usd_value/1e9:.2f}B)".rstrip('0').rstrip('.')
+            else:
+                usd = f"(USD {usd_value/1e12:.2f}T)".rstrip('0').rstrip('.')
+            return f"{mxn} MXN {usd}" if include_currency else f"{mxn} {usd}"
+        return f"{mxn} MXN" if include_currency else mxn
+    if x >= 1e9:
+        mxn = f"${x/1e9:.2f}B".rstrip('0').rstrip('.')
+        if include_usd:
+            usd = f"(USD {usd_value/1e9:.2f}B)".rstrip('0').rstrip('.')
+            return f"{mxn} MXN {usd}" if include_currency else f"{mxn} {usd}"
+        return f"{mxn} MXN" if include_currency else mxn
+    mxn = f"${x/1e6:.2f}M".rstrip('0').rstrip('.')
+    if include_usd:
+        usd = f"(USD {usd_value/1e6:.2f}M)".rstrip('0').rstrip('.')
+        return f"{mxn} MXN {usd}" if include_currency else f"{mxn} {usd}"
+    return f"{mxn} MXN" if include_currency else mxn
+
+def old_format_deviation(x):
+    return f"{'+' if x > 0 else ''}{x:.2f}"
+
+def old_format_population(value):
+    if value >= 1_000_000:
+        return f"{value/1_000_000:.1f}M"
+    return f"{int(value/1000)}K"
+
+@pytest.fixture
+def sample():
+    """Volumes and pesos spread over every unit, plus the exact thresholds."""
+    rng = np.random.default_rng(0)
+    values = 10 ** rng.uniform(5, 14, 2000)
+    return np.concatenate([values, [1e6, 1e9, 1e12, 2e13, 999_994_999, 999_995_001]])
+
+# -------------------------------------------------------------------------
+# Numbers & Signs
+# -------------------------------------------------------------------------
+
+def test_format_number_thousands_and_rounding():
+    assert format_number(1234.5, 1, thousands=True) == "1,234.5"
+    assert format_number(999.995, 2) == "1000.00"
+    assert format_number(1_000_000, 0, thousands=True) == "1,000,000"
+    assert format_number(0.004, 2) == "0.00"
+
+def test_deviation_signs():
+    assert format_number(0.25, 2, sign=True) == "+0.25"
+    assert format_number(-0.25, 2, sign=True) == "-0.25"
+    assert format_number(0.0, 2, sign=True) == "0.00"
+    # Negative zero prints unsigned (the f-string printed "-0.00")
+    assert format_number(-0.0, 2, sign=True) == "0.00"
+    # A negative value rounding to zero keeps its sign, like the f-string
+    assert format_number(-0.001, 2, sign=True) == "-0.00"
+
+def test_deviation_matches_per_row_formatter():
+    values = np.random.default_rng(1).normal(0, 2, 1000)
+    assert list(format_number(values, 2, sign=True)) == [old_format_deviation(x) for x in values]
+
+def test_percent_signs():
+    assert format_percent(-1.25, 1, sign=True) == "-1.2%"
+    assert format_percent(1.26, 1, sign=True) == "+1.3%"
+    assert format_percent(0.0, 1, sign=True) == "0.0%"
+    assert format_percent(12.34) == "12.3%"
+
+def test_missing_values():
+    assert format_number(None, 2) == "nan"
+    assert format_number(np.nan, 2, sign=True) == "nan"
+    assert format_price(np.nan) == "$nan"
+    assert format_population(np.nan) == "nan"
+    assert format_volume(np.nan) == old_format_volume(np.nan)
+    assert format_currency(np.nan) == old_format_currency(np.nan)
+    assert list(format_number(pd.Series([1.0, None]), 1)) == ["1.0", "nan"]
+
+def test_scalar_and_array_input():
+    assert isinstance(format_price(24.259), str)
+    assert format_price(24.259) == "$24.26"
+    assert list(format_price([24.259, 21.5])) == ["$24.26", "$21.50"]
+
+# -------------------------------------------------------------------------
+# Units
+# -------------------------------------------------------------------------
+
+@pytest.mark.parametrize("value, expected", [
+    (800_000, "800K"),
+    (999_999, "999K"),
+    (1_000_000, "1.0M"),
+    (1_549_999, "1.5M"),
+    (1_550_001, "1.6M"),
+])
+def test_population_thresholds(value, expected):
+    assert format_population(value) == expected == old_format_population(value)
+
+@pytest.mark.parametrize("value, expected", [
+    (350_250_000, "350.25M liters"),
+    (999_994_999, "999.99M liters"),
+    # Below the billion threshold, so it stays in millions after rounding
+    (999_995_001, "1000.00M liters"),
+    (1e9, "1.00B liters"),
+    (1.5e9, "1.50B liters"),
+])
+def test_volume_thresholds(value, expected):
+    assert format_volume(value) == expected
+
+@pytest.mark.parametrize("value, expected", [
+    (5e8, "$500.00M"),
+    (1e9, "$1.00B"),
+    (999_999_999_999, "$1000.00B"),
+    (1e12, "$1.00T"),
+    (1.25e12, "$1.25T"),
+])
+def test_currency_thresholds(value, expected):
+    assert format_currency(value) == expected
+
+def test_currency_mxn_and_usd():
+    assert format_currency(1.2e13, True, True) == "$12.00T MXN (USD 600.00B)"
+    assert format_currency(3e13, True, True) == "$30.00T MXN (USD 1.50T)"
+    assert format_currency(5e9, False, True) == "$5.00B (USD 0.25B)"
+    assert format_currency(5e8, True, True) == "$500.00M MXN (USD 25.00M)"
+    assert format_currency(1e6, True, False) == "$1.00M MXN"
+
+# -------------------------------------------------------------------------
+# Parity with the per-row formatters
+# -------------------------------------------------------------------------
+
+@pytest.mark.parametrize("include_label", [True, False])
+def test_volume_matches_per_row_formatter(sample, include_label):
+    expected = [old_format_volume(x, include_label) for x in sample]
+    assert list(format_volume(sample, include_label)) == expected
+
+@pytest.mark.parametrize("include_currency, include_usd", [(False, False), (True, False), (False, True), (True, True)])
+def test_currency_matches_per_row_formatter(sample, include_currency, include_usd):
+    expected = [old_format_currency(x, include_currency, include_usd) for x in sample]
+    assert list(format_currency(sample, include_currency, include_usd)) == expected
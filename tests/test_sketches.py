@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sketches import (
+    MAX_VALUE, MIN_VALUE, RELATIVE_ACCURACY, QuantileSketch, fuel_sketches, snapshot_sketches
+)
+from utils import remove_price_outliers
+
+QUANTILES = [0.0, 0.001, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 0.999, 1.0]
+# Bucket edges are computed with logarithms, so a value on an edge may land one ulp off
+TOLERANCE = RELATIVE_ACCURACY * (1 + 1e-9)
+
+def sketch_of(values):
+    return QuantileSketch().add(values)
+
+def assert_within_error(values, sketch):
+    """Every quantile of the sketch is within RELATIVE_ACCURACY of np.quantile."""
+    exact = np.nanquantile(values, QUANTILES)
+    approximate = np.array([sketch.quantile(q)[0] for q in QUANTILES])
+    np.testing.assert_array_less(np.abs(approximate - exact), TOLERANCE * np.abs(exact) + 1e-12)
+
+# -------------------------------------------------------------------------
+# Accuracy
+# -------------------------------------------------------------------------
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_prices_within_relative_error(seed):
+    rng = np.random.default_rng(seed)
+    values = np.round(rng.normal(23, 2.5, 20000), 2)
+    values[rng.random(len(values)) < 0.1] = np.nan
+    assert_within_error(values, sketch_of(values))
+
+@pytest.mark.parametrize("seed", range(3))
+def test_whole_range_within_relative_error(seed):
+    rng = np.random.default_rng(seed)
+    values = np.exp(rng.uniform(np.log(MIN_VALUE), np.log(MAX_VALUE), 5000))
+    assert_within_error(values, sketch_of(values))
+
+def test_small_samples_within_relative_error():
+    rng = np.random.default_rng(7)
+    for n in [1, 2, 3, 5, 10]:
+        values = rng.uniform(12, 35, n)
+        assert_within_error(values, sketch_of(values))
+
+def test_bucket_edges_within_relative_error():
+    gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    edges = MIN_VALUE * gamma ** np.arange(0, 7000, 97)
+    edges = edges[edges < MAX_VALUE]
+    for value in [MIN_VALUE, *edges, np.nextafter(MAX_VALUE, 0)]:
+        assert_within_error(np.array([value]), sketch_of([value]))
+
+# -------------------------------------------------------------------------
+# Edge Inputs
+# -------------------------------------------------------------------------
+
+def test_all_nan_is_empty():
+    sketch = sketch_of([np.nan, np.nan, np.inf])
+    assert sketch.count()[0] == 0
+    assert np.isnan(sketch.quantile(0.5)[0])
+    assert np.isnan(QuantileSketch().quantile(0.5)[0])
+
+def test_single_value():
+    sketch = sketch_of([21.37])
+    for q in QUANTILES:
+        assert sketch.quantile(q)[0] == pytest.approx(21.37, rel=RELATIVE_ACCURACY)
+    # The only value is both the minimum and the maximum, so every quantile is exact
+    assert sketch.quantile(0.5)[0] == 21.37
+
+@pytest.mark.parametrize("value", [0.0, 0.01, MIN_VALUE / 2, MAX_VALUE, 5000.0, 1e9])
+def test_single_value_outside_range_is_exact(value):
+    sketch = sketch_of([value])
+    for q in QUANTILES:
+        assert sketch.quantile(q)[0] == value
+
+def test_min_and_max_outside_range_are_exact():
+    rng = np.random.default_rng(11)
+    values = np.concatenate([rng.uniform(12, 35, 1000), [0.03, 2500.0]])
+    sketch = sketch_of(values)
+    assert sketch.quantile(0.0)[0] == 0.03
+    assert sketch.quantile(1.0)[0] == 2500.0
+    # Inner quantiles are unaffected by the out-of-range values
+    for q in [0.01, 0.5, 0.99]:
+        assert sketch.quantile(q)[0] == pytest.approx(np.quantile(values, q), rel=TOLERANCE)
+
+def test_only_out_of_range_values():
+    sketch = sketch_of([0.1, 0.2, 2000.0, 3000.0])
+    assert sketch.quantile(0.0)[0] == 0.1
+    assert sketch.quantile(1.0)[0] == 3000.0
+    # Between the two order statistics, values are interpolated between the exact min and max
+    assert 0.1 <= sketch.quantile(0.5)[0] <= 3000.0
+
+def test_quantiles_are_monotonic():
+    rng = np.random.default_rng(5)
+    values = np.concatenate([rng.lognormal(3, 1, 3000), [0.2, 4000.0]])
+    quantiles = [sketch_of(values).quantile(q)[0] for q in np.linspace(0, 1, 101)]
+    assert np.all(np.diff(quantiles) >= 0)
+
+# -------------------------------------------------------------------------
+# Merging
+# -------------------------------------------------------------------------
+
+def test_merge_equals_sketch_of_concatenation():
+    rng = np.random.default_rng(13)
+    first = np.concatenate([rng.uniform(12, 35, 4000), [0.2, np.nan]])
+    second = np.concatenate([rng.normal(24, 3, 2500), [1500.0]])
+    merged = sketch_of(first).merge(sketch_of(second))
+    whole = sketch_of(np.concatenate([first, second]))
+    np.testing.assert_array_equal(merged.counts, whole.counts)
+    np.testing.assert_array_equal(merged.min, whole.min)
+    np.testing.assert_array_equal(merged.max, whole.max)
+    for q in QUANTILES:
+        assert merged.quantile(q)[0] == whole.quantile(q)[0]
+
+def test_merge_with_empty_sketch():
+    values = np.random.default_rng(17).uniform(12, 35, 100)
+    merged = QuantileSketch().merge(sketch_of(values))
+    assert merged.quantile(0.5)[0] == sketch_of(values).quantile(0.5)[0]
+
+def test_merge_rejects_other_groups():
+    with pytest.raises(ValueError):
+        QuantileSketch(2).merge(QuantileSketch(3))
+
+def test_grouped_sketch_matches_each_group():
+    rng = np.random.default_rng(19)
+    values = rng.uniform(12, 35, 6000)
+    groups = rng.integers(0, 4, len(values))
+    sketch = QuantileSketch(4).add(values, groups)
+    for q in [0.001, 0.5, 0.999]:
+        exact = [np.quantile(values[groups == group], q) for group in range(4)]
+        np.testing.assert_allclose(sketch.quantile(q), exact, rtol=TOLERANCE)
+
+def test_snapshot_sketches_equal_sketch_of_concatenated_snapshots():
+    rng = np.random.default_rng(23)
+    frames = [
+        pd.DataFrame({
+            "state_name": rng.choice(["Jalisco", "Sonora", "Ciudad de Mexico", "Atlantis"], 500),
+            "regular_price": rng.uniform(20, 25, 500),
+            "premium_price": rng.uniform(22, 27, 500),
+            "diesel_price": np.where(rng.random(500) < 0.2, np.nan, rng.uniform(23, 28, 500))
+        })
+        for _ in range(3)
+    ]
+    for by_state in [False, True]:
+        merged = snapshot_sketches(iter(frames), by_state=by_state)
+        whole = fuel_sketches(pd.concat(frames, ignore_index=True), by_state=by_state)
+        for fuel, sketch in whole.items():
+            np.testing.assert_array_equal(merged[fuel].counts, sketch.counts)
+            np.testing.assert_array_equal(merged[fuel].quantile(0.999), sketch.quantile(0.999))
+
+# -------------------------------------------------------------------------
+# Outlier Bounds
+# -------------------------------------------------------------------------
+
+def test_remove_price_outliers_combines_state_groups():
+    rng = np.random.default_rng(29)
+    df = pd.DataFrame({
+        # Few stations in an unrecognized state: group 0's own bounds are not the national ones
+        "state_name": np.where(rng.random(5000) < 0.01, "Atlantis", rng.choice(["Jalisco", "Sonora"], 5000)),
+        "regular_price": rng.uniform(5, 60, 5000)
+    })
+    by_state = fuel_sketches(df, ["regular_price"], by_state=True)["regular_price"]
+    national = fuel_sketches(df, ["regular_price"])["regular_price"]
+    expected = remove_price_outliers(df, "regular_price", sketch=national)
+    pd.testing.assert_frame_equal(remove_price_outliers(df, "regular_price", sketch=by_state), expected)
+    pd.testing.assert_frame_equal(remove_price_outliers(df, "regular_price"), expected)
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from snapshot_diff import FUEL_COLUMNS, diff_snapshots, iter_diffs, summarize_diff
+
+# -------------------------------------------------------------------------
+# Seeded Snapshots
+# -------------------------------------------------------------------------
+
+def make_snapshot(rng, n, first_place_id=0):
+    cre_ids = np.array([f"PL/{i}/EXP/ES/2015" for i in rng.integers(0, 10 ** 6, n)], dtype=object)
+    cre_ids[rng.random(n) < 0.05] = None
+    df = pd.DataFrame({
+        "place_id": np.arange(first_place_id, first_place_id + n),
+        "cre_id": cre_ids,
+        "station_name": [f"Station {i}" for i in range(n)],
+        "state_name": rng.choice(["Jalisco", "Sonora", "Yucatán"], n),
+        "municipality_name": rng.choice(["Centro", "Norte"], n)
+    })
+    for fuel in FUEL_COLUMNS:
+        prices = np.round(rng.uniform(20, 27, n), 2)
+        prices[rng.random(n) < 0.2] = np.nan
+        df[fuel] = prices
+    return df
+
+@pytest.fixture(scope="module")
+def snapshots():
+    rng = np.random.default_rng(3)
+    old = make_snapshot(rng, 3000)
+    new = old.sample(frac=0.9, random_state=1).reset_index(drop=True)
+    for fuel in FUEL_COLUMNS:
+        moved = rng.random(len(new)) < 0.1
+        new.loc[moved, fuel] = np.round(new.loc[moved, fuel] + rng.choice([-0.5, 0.25, 1.0], moved.sum()), 2)
+        # Float noise below a centavo is not a price change
+        noisy = rng.random(len(new)) < 0.1
+        new.loc[noisy, fuel] = new.loc[noisy, fuel] + 1e-9
+        delisted = rng.random(len(new)) < 0.02
+        new.loc[delisted, fuel] = np.nan
+    # A station whose permit changed is a different station
+    new.loc[:9, "cre_id"] = "PL/NEW/EXP/ES/2024"
+    new = pd.concat([new, make_snapshot(rng, 200, first_place_id=10 ** 6)], ignore_index=True)
+    return old, new.sample(frac=1, random_state=2).reset_index(drop=True)
+
+def oracle(old, new):
+    """Row-by-row diff through an outer merge on (place_id, cre_id)."""
+    keys = ["place_id", "cre_id"]
+    old_ids, new_ids = old.assign(cre_id=old["cre_id"].fillna("")), new.assign(cre_id=new["cre_id"].fillna(""))
+    merged = old_ids.merge(new_ids, on=keys, how="outer", suffixes=("_old", "_new"), indicator=True)
+    both = merged[merged["_merge"] == "both"]
+    changed = np.zeros(len(both), dtype=bool)
+    for fuel in FUEL_COLUMNS:
+        before = np.rint(both[f"{fuel}_old"].to_numpy() * 100)
+        after = np.rint(both[f"{fuel}_new"].to_numpy() * 100)
+        changed |= ~((before == after) | (np.isnan(before) & np.isnan(after)))
+    return {
+        "added": set(merged.loc[merged["_merge"] == "right_only", "place_id"]),
+        "removed": set(merged.loc[merged["_merge"] == "left_only", "place_id"]),
+        "repriced": both[changed].set_index("place_id")
+    }
+
+# -------------------------------------------------------------------------
+# Diff
+# -------------------------------------------------------------------------
+
+def test_diff_matches_oracle(snapshots):
+    old, new = snapshots
+    diff = diff_snapshots(old, new)
+    expected = oracle(old, new)
+
+    assert set(diff["added"]["place_id"]) == expected["added"]
+    assert set(diff["removed"]["place_id"]) == expected["removed"]
+    assert len(diff["added"]) == len(expected["added"]) == 210
+    assert len(diff["removed"]) == len(expected["removed"]) == 310
+
+    repriced = diff["repriced"].set_index("place_id").sort_index()
+    assert list(repriced.index) == sorted(expected["repriced"].index)
+    for fuel in FUEL_COLUMNS:
+        want = expected["repriced"].loc[repriced.index]
+        np.testing.assert_allclose(repriced[f"{fuel}_old"], np.rint(want[f"{fuel}_old"] * 100) / 100)
+        np.testing.assert_allclose(repriced[f"{fuel}_new"], np.rint(want[f"{fuel}_new"] * 100) / 100)
+        np.testing.assert_allclose(repriced[f"{fuel}_delta"], repriced[f"{fuel}_new"] - repriced[f"{fuel}_old"],
+                                   atol=1e-9)
+
+def test_identical_snapshots_have_no_changes(snapshots):
+    old, _ = snapshots
+    diff = diff_snapshots(old, old.sample(frac=1, random_state=5))
+    assert all(len(table) == 0 for table in diff.values())
+
+def test_summary_counts_match_diff(snapshots):
+    old, new = snapshots
+    diff = diff_snapshots(old, new)
+    summary = summarize_diff(diff, "state").set_index("state_name")
+    for name in ["added", "removed", "repriced"]:
+        counts = diff[name]["state_name"].value_counts()
+        assert summary[name].sum() == len(diff[name])
+        assert (summary.loc[counts.index, name] == counts).all()
+    for fuel in FUEL_COLUMNS:
+        delta = diff["repriced"][f"{fuel}_delta"]
+        assert summary[f"{fuel}_increases"].sum() == (delta > 0).sum()
+        assert summary[f"{fuel}_decreases"].sum() == (delta < 0).sum()
+
+def test_iter_diffs_pairs_consecutive_snapshots(snapshots):
+    old, new = snapshots
+    labels = [(a, b) for a, b, _ in iter_diffs([("d1", old), ("d2", new), ("d3", new)])]
+    assert labels == [("d1", "d2"), ("d2", "d3")]
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from spatial import StationIndex, haversine_km
+
+# -------------------------------------------------------------------------
+# Brute-Force Oracle
+# -------------------------------------------------------------------------
+
+@pytest.fixture(scope="module")
+def stations():
+    """Seeded stations: dense clusters around a few cities plus scattered rural ones."""
+    rng = np.random.default_rng(42)
+    centers = np.array([[-99.13, 19.43], [-103.35, 20.67], [-100.31, 25.69]])
+    clustered = centers[rng.integers(0, len(centers), 1500)] + rng.normal(0, 0.15, (1500, 2))
+    scattered = np.column_stack([rng.uniform(-117, -87, 500), rng.uniform(15, 32, 500)])
+    coords = np.vstack([clustered, scattered])
+    n = len(coords)
+    diesel = rng.uniform(22, 27, n)
+    diesel[rng.random(n) < 0.3] = np.nan
+    return pd.DataFrame({
+        "place_id": np.arange(n),
+        "longitude": coords[:, 0],
+        "latitude": coords[:, 1],
+        "regular_price": rng.uniform(21, 25, n),
+        "diesel_price": diesel
+    })
+
+@pytest.fixture(scope="module")
+def queries():
+    rng = np.random.default_rng(7)
+    near_city = np.array([-99.13, 19.43]) + rng.normal(0, 0.3, (40, 2))
+    anywhere = np.column_stack([rng.uniform(-118, -86, 40), rng.uniform(14, 33, 40)])
+    return np.vstack([near_city, anywhere])
+
+def brute_distances(stations, lon, lat):
+    return haversine_km(lon, lat, stations["longitude"].to_numpy(), stations["latitude"].to_numpy())
+
+# -------------------------------------------------------------------------
+# Queries
+# -------------------------------------------------------------------------
+
+@pytest.mark.parametrize("cell_degrees", [0.05, 0.1, 1.0])
+@pytest.mark.parametrize("k", [1, 5, 25])
+def test_nearest_matches_brute_force(stations, queries, cell_degrees, k):
+    index = StationIndex(stations, cell_degrees)
+    result = index.nearest(queries[:, 0], queries[:, 1], k=k)
+    for i, (lon, lat) in enumerate(queries):
+        expected = np.sort(brute_distances(stations, lon, lat))[:k]
+        found = result.loc[result["query"] == i, "distance_km"].to_numpy()
+        np.testing.assert_allclose(found, expected)
+
+def test_nearest_with_fuel(stations, queries):
+    index = StationIndex(stations)
+    selling = stations[stations["diesel_price"].notna()]
+    result = index.nearest(queries[:, 0], queries[:, 1], k=3, fuel="diesel_price")
+    assert result["diesel_price"].notna().all()
+    for i, (lon, lat) in enumerate(queries):
+        expected = np.sort(brute_distances(selling, lon, lat))[:3]
+        np.testing.assert_allclose(result.loc[result["query"] == i, "distance_km"].to_numpy(), expected)
+
+@pytest.mark.parametrize("radius_km", [1, 10, 150])
+def test_within_radius_matches_brute_force(stations, queries, radius_km):
+    index = StationIndex(stations)
+    result = index.within_radius(queries[:, 0], queries[:, 1], radius_km)
+    for i, (lon, lat) in enumerate(queries):
+        distance = brute_distances(stations, lon, lat)
+        expected = set(stations["place_id"][distance <= radius_km])
+        found = result.loc[result["query"] == i]
+        assert set(found["place_id"]) == expected
+        assert found["distance_km"].is_monotonic_increasing
+
+def test_in_bbox_matches_brute_force(stations):
+    index = StationIndex(stations)
+    for box in [(-99.5, 19.0, -98.8, 19.8), (-118, 14, -86, 33.5), (-95.0, 16.0, -94.9, 16.1)]:
+        min_lon, min_lat, max_lon, max_lat = box
+        inside = stations["longitude"].between(min_lon, max_lon) & stations["latitude"].between(min_lat, max_lat)
+        assert set(index.in_bbox(*box)["place_id"]) == set(stations.loc[inside, "place_id"])
+
+def test_cheapest_matches_brute_force(stations, queries):
+    index = StationIndex(stations)
+    result = index.cheapest(queries[:, 0], queries[:, 1], "diesel_price", radius_km=20, n=2)
+    for i, (lon, lat) in enumerate(queries):
+        distance = brute_distances(stations, lon, lat)
+        candidates = stations[(distance <= 20) & stations["diesel_price"].notna()]
+        expected = candidates["diesel_price"].nsmallest(2).to_numpy(dtype=float)
+        np.testing.assert_allclose(result.loc[result["query"] == i, "diesel_price"].to_numpy(dtype=float), expected)
+
+def test_stations_outside_mexico_are_not_indexed(stations):
+    unlocated = pd.DataFrame({"place_id": [-1, -2], "longitude": [0.0, 99.1], "latitude": [0.0, 19.4]})
+    index = StationIndex(pd.concat([stations, unlocated], ignore_index=True))
+    assert len(index) == len(stations)
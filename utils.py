@@ -1,34 +1,77 @@
+import html
 import pandas as pd
 import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
 import streamlit as st
+import folium
+from branca.colormap import LinearColormap
+from streamlit_folium import st_folium
 from pathlib import Path
 
+from caching import args_key, cached, frame_key, hash_files
+from formatting import (
+    concat, format_currency, format_number, format_percent, format_population, format_price, format_volume
+)
+from geography import UNKNOWN, municipality_ids, state_ids
+from instrumentation import instrumented
+from sketches import QuantileSketch, outlier_bounds
+from snapshots import load_dataset
+from spatial import COORDINATE_BOUNDS
+from station_map import CLUSTER_ZOOMS, POINTS_MIN_ZOOM, view_payload
+from validation import DUPLICATE_POLICY, resolve_duplicates
+from volume_series import NATIONAL, ROLLING_YEARS
+from volumes import load_volumes
+
 # Configuration
 DATA_DIR = Path("data")
 
 # -------------------------------------------------------------------------
 # Data Loading & Preparation
 # -------------------------------------------------------------------------
-
-def load_data(gas_prices_path, population_path, volumes_path):
-    """Load data from CSV files."""
-    df_gas = pd.read_csv(gas_prices_path)
-    df_pop = pd.read_csv(population_path)
-    df_vol = pd.read_csv(volumes_path)
+# Preparation steps never modify their input frames: the cache shares them with
+# every session. Each step returns a new frame that shares the unchanged columns
+# with its input (copy-on-write) and only allocates the columns it changes.
+# Every step is an instrumentation span (see instrumentation.py): bytes allocated
+# per step are recorded by memory.py when accounting is on.
+
+@instrumented()
+@cached(lambda gas_prices_path, population_path, volumes_path, memory_map=False: hash_files(
+    [gas_prices_path, population_path, volumes_path]
+))
+def load_data(gas_prices_path, population_path, volumes_path, memory_map=False):
+    """
+    Load typed data for each CSV path.
+    Reads the Arrow snapshot built by snapshots.py when it is current (optionally
+    memory-mapped) and only falls back to parsing the CSV when there is none.
+    The volume history is read in chunks and only its yearly (Año, EntidadFederativa,
+    SubProducto) totals are kept (see volumes.py).
+    """
+    df_gas = load_dataset(gas_prices_path, memory_map=memory_map)
+    df_pop = load_dataset(population_path, memory_map=memory_map)
+    df_vol = load_volumes(volumes_path, memory_map=memory_map)
     return df_gas, df_pop, df_vol
 
+@instrumented()
+@cached(lambda df_gas, df_pop: (frame_key(df_gas), frame_key(df_pop)))
 def prepare_station_data(df_gas, df_pop):
     """
-    1) Drop duplicates on place_id.
-    2) Merge with df_pop states to ensure all states appear.
+    1) Merge repeated place_ids, each fuel's price with DUPLICATE_POLICY (see validation.py).
+    2) Merge with df_pop states on the canonical state_id to ensure all states appear,
+       whatever the spelling of the state names in each file.
     3) Fill with 0 or NaN for missing station info if any.
+    Adds state_id and municipality_id (see geography.py); state_name takes df_pop's spelling.
     """
-    df_gas = df_gas.drop_duplicates(subset=["place_id"])
+    df_gas, _ = resolve_duplicates(df_gas, DUPLICATE_POLICY)
+    df_gas = df_gas.drop(columns="state_name").assign(
+        state_id=state_ids(df_gas["state_name"]),
+        municipality_id=municipality_ids(df_gas)
+    )
+    df_gas = df_gas[df_gas["state_id"] != UNKNOWN]
 
     all_states = df_pop["Entidad Federativa"].unique()
-    df_states_only = pd.DataFrame({"state_name": all_states})
-    df_states_only = df_states_only.merge(df_gas, on="state_name", how="left")
+    df_states_only = pd.DataFrame({"state_id": state_ids(all_states), "state_name": all_states})
+    df_states_only = df_states_only.merge(df_gas, on="state_id", how="left")
 
     for col in ["place_id", "municipality_name", "regular_price", "premium_price", "diesel_price"]:
         if col not in df_states_only.columns:
@@ -36,63 +79,69 @@ def prepare_station_data(df_gas, df_pop):
 
     return df_states_only
 
-def remove_price_outliers(df, column, lower_percentile=0.1, upper_percentile=99.9, min_price=12, max_price=35):
+@instrumented()
+def remove_price_outliers(df, column, lower_percentile=0.1, upper_percentile=99.9, min_price=12, max_price=35,
+                          sketch=None):
     """
     Remove price outliers using both statistical methods and business logic:
     1. Remove prices outside 0.1-99.9th percentile range (more lenient)
     2. Remove prices outside realistic range (12-35 pesos)
+    Percentiles come from a quantile sketch of the column (within 0.1%, see sketches.py)
+    instead of a full sort; pass a sketch, e.g. merged over many snapshots, to use its bounds.
+    The bounds are national: the groups of a by-state sketch are combined first.
+    Only the cleaned column is new in the returned frame.
     """
-    df = df.copy()
-    
-    # Get percentile bounds
-    lower_bound = df[column].quantile(lower_percentile/100)
-    upper_bound = df[column].quantile(upper_percentile/100)
-    
-    # Apply both statistical and business logic bounds
-    # Take the more lenient bound in each case
-    effective_lower = min(lower_bound, min_price)
-    effective_upper = max(upper_bound, max_price)
-    
-    # Create a mask for valid prices
-    mask = (df[column] >= effective_lower) & (df[column] <= effective_upper)
-    
-    # Apply mask and return cleaned data
-    df.loc[~mask, column] = np.nan
-    return df
+    if sketch is None:
+        sketch = QuantileSketch().add(df[column].to_numpy(dtype=float, na_value=np.nan))
+    elif sketch.n_groups > 1:
+        sketch = sketch.combined()
+    effective_lower, effective_upper = outlier_bounds(
+        sketch, lower_percentile, upper_percentile, min_price, max_price
+    )
 
+    # Mask prices outside the bounds (NaN prices stay NaN)
+    prices = df[column]
+    mask = (prices >= effective_lower[0]) & (prices <= effective_upper[0])
+    return df.assign(**{column: prices.where(mask)})
+
+@instrumented()
+@cached(lambda df_station: frame_key(df_station))
 def prepare_price_data(df_station):
     """
     Prepare price data:
     1. Convert to numeric
     2. Remove outliers for each fuel type using same bounds
+    Only the three price columns get new buffers; the rest are shared with df_station.
     """
-    df = df_station.copy()
-    
-    # Convert to numeric
-    for fuel_col in ["regular_price", "premium_price", "diesel_price"]:
-        df[fuel_col] = pd.to_numeric(df[fuel_col], errors="coerce")
-    
+    fuel_columns = ["regular_price", "premium_price", "diesel_price"]
+    df = df_station.assign(**{
+        fuel_col: pd.to_numeric(df_station[fuel_col], errors="coerce") for fuel_col in fuel_columns
+    })
+
     # Remove outliers for each fuel type using same bounds
-    for fuel_col in ["regular_price", "premium_price", "diesel_price"]:
+    for fuel_col in fuel_columns:
         df = remove_price_outliers(df, fuel_col)
-    
-    return df
 
-def prepare_volume_data(df_vol):
-    df_vol["Volumen Vendido (litros)"] = pd.to_numeric(df_vol["Volumen Vendido (litros)"], errors="coerce")
-    return df_vol
+    return df
 
 # -------------------------------------------------------------------------
 # Station Analysis
 # -------------------------------------------------------------------------
-
-def scatter_population_vs_stations(df_station, df_pop):
+# Chart functions below render the tables produced by precompute.py;
+# they only sort, filter and format, no aggregation happens here.
+# Figure builders are cached on their input tables and widget values,
+# so a rerun only rebuilds the figures whose inputs changed.
+
+@instrumented()
+@cached(args_key)
+def scatter_population_vs_stations(df_states):
     """
     Scatter chart with:
       - X-axis: population (formatted as 800K, 1.2M etc)
       - Y-axis: number of stations (no decimals)
       - Text labels for selected states
       - Tooltip: state name first, then population and stations
+    df_states: stations_by_state table (state_name, num_stations, 2024 population).
     """
     # Key states to always show text
     highlight_states = [
@@ -101,36 +150,16 @@ def scatter_population_vs_stations(df_station, df_pop):
         "Guanajuato"
     ]
 
-    stations_per_state = df_station.groupby("state_name")["place_id"].nunique().reset_index()
-    stations_per_state.columns = ["state_name", "num_stations"]
-
-    df_merged = pd.merge(
-        stations_per_state,
-        df_pop[["Entidad Federativa", "2024 population"]],
-        left_on="state_name",
-        right_on="Entidad Federativa",
-        how="left"
-    )
-
-    df_merged["2024 population"] = df_merged["2024 population"].replace(",", "", regex=True)
-    df_merged["2024 population"] = pd.to_numeric(df_merged["2024 population"], errors="coerce")
+    df_merged = df_states[["state_name", "num_stations", "2024 population"]].copy()
 
     # Create a text_label column that only shows for highlight_states
-    df_merged["text_label"] = df_merged.apply(
-        lambda row: row["state_name"] if row["state_name"] in highlight_states else "",
-        axis=1
-    )
+    df_merged["text_label"] = df_merged["state_name"].where(df_merged["state_name"].isin(highlight_states), "")
 
     # Custom hover template to format population numbers
-    def format_population(value):
-        if value >= 1_000_000:
-            return f"{value/1_000_000:.1f}M"
-        return f"{int(value/1000)}K"
-    
-    df_merged["formatted_population"] = df_merged["2024 population"].apply(format_population)
-    
+    df_merged["formatted_population"] = format_population(df_merged["2024 population"])
+
     # Format number of stations with thousands separator
-    df_merged["formatted_stations"] = df_merged["num_stations"].apply(lambda x: f"{int(x):,}")
+    df_merged["formatted_stations"] = format_number(df_merged["num_stations"], thousands=True)
 
     fig = px.scatter(
         df_merged,
@@ -162,24 +191,21 @@ def scatter_population_vs_stations(df_station, df_pop):
             "Number of stations: %{customdata[2]}<extra></extra>"  # formatted stations count
         )
     )
-    
+
     return fig
 
-def bar_chart_stations_by_state(df_station, df_pop):
+@instrumented()
+@cached(args_key)
+def bar_chart_stations_by_state(df_states):
     """
     Horizontal bar chart of number of stations per state, ensuring all states,
     with a taller layout so labels fit. Uses thousand separators and no decimals in hover.
+    df_states: stations_by_state table (every state, 0 stations where none).
     """
-    stations_per_state = df_station.groupby("state_name")["place_id"].nunique().reset_index()
-    stations_per_state.columns = ["state_name", "num_stations"]
-
-    all_states = df_pop["Entidad Federativa"].unique()
-    df_all_states = pd.DataFrame({"state_name": all_states})
-    df_merge = pd.merge(df_all_states, stations_per_state, on="state_name", how="left")
-    df_merge["num_stations"] = df_merge["num_stations"].fillna(0)
+    df_merge = df_states[["state_name", "num_stations"]].copy()
 
     # Format number of stations with thousands separator
-    df_merge["formatted_stations"] = df_merge["num_stations"].apply(lambda x: f"{int(x):,}")
+    df_merge["formatted_stations"] = format_number(df_merge["num_stations"], thousands=True)
 
     df_merge = df_merge.sort_values("num_stations", ascending=True)
 
@@ -202,15 +228,17 @@ def bar_chart_stations_by_state(df_station, df_pop):
     fig.update_layout(height=900)
     return fig
 
-def product_availability_stats(df_station):
+@instrumented()
+def product_availability_stats(availability):
     """
     Display total stations and availability statistics for each fuel type,
     with proper formatting and percentages.
+    availability: dict with total_stations and the station count per fuel column.
     """
-    total_stations = df_station["place_id"].nunique()
-    reg_stations = df_station.dropna(subset=["regular_price"])["place_id"].nunique()
-    prem_stations = df_station.dropna(subset=["premium_price"])["place_id"].nunique()
-    diesel_stations = df_station.dropna(subset=["diesel_price"])["place_id"].nunique()
+    total_stations = availability["total_stations"]
+    reg_stations = availability["regular_price"]
+    prem_stations = availability["premium_price"]
+    diesel_stations = availability["diesel_price"]
 
     # Calculate percentages
     reg_pct = (reg_stations / total_stations) * 100
@@ -222,23 +250,21 @@ def product_availability_stats(df_station):
     st.write(f"- Premium: {prem_stations:,} ({prem_pct:.1f}% coverage)")
     st.write(f"- Diesel: {diesel_stations:,} ({diesel_pct:.1f}% coverage)")
 
-def bar_chart_top_municipalities(df_station, top_n=15):
+@instrumented()
+@cached(args_key)
+def bar_chart_top_municipalities(df_municipalities, top_n=15):
     """
     Horizontal bar chart of top N municipalities by station count.
     Tooltip includes state name and number of stations formatted with thousand separators, no decimals.
+    df_municipalities: stations_by_municipality table (municipality_name, state_name, num_stations).
     """
-    # We group by BOTH municipality_name and state_name
-    group_cols = ["municipality_name", "state_name"]
-    stations_by_mun = df_station.groupby(group_cols)["place_id"].nunique().reset_index()
-    stations_by_mun.columns = ["municipality_name", "state_name", "num_stations"]
-
     # Sort descending, pick top N
-    stations_by_mun = stations_by_mun.sort_values("num_stations", ascending=False).head(top_n)
+    stations_by_mun = df_municipalities.sort_values("num_stations", ascending=False).head(top_n)
     # Then ascending for horizontal
     stations_by_mun = stations_by_mun.sort_values("num_stations", ascending=True)
 
     # Format number of stations with thousands separator
-    stations_by_mun["formatted_stations"] = stations_by_mun["num_stations"].apply(lambda x: f"{int(x):,}")
+    stations_by_mun["formatted_stations"] = format_number(stations_by_mun["num_stations"], thousands=True)
 
     fig = px.bar(
         stations_by_mun,
@@ -261,30 +287,28 @@ def bar_chart_top_municipalities(df_station, top_n=15):
     fig.update_layout(height=600)
     return fig
 
-def bar_chart_stations_per_municipality(df_station):
+@instrumented()
+@cached(args_key)
+def bar_chart_stations_per_municipality(df_states):
     """
     Horizontal bar chart showing the average number of stations per municipality in each state.
     Calculated as total stations in state / number of municipalities in that state.
+    df_states: stations_by_state table (state_name, num_stations, num_municipalities).
     """
-    # Count unique municipalities and stations per state
-    mun_per_state = df_station.groupby("state_name")["municipality_name"].nunique().reset_index()
-    stations_per_state = df_station.groupby("state_name")["place_id"].nunique().reset_index()
-    
-    # Merge the counts
-    df_merged = pd.merge(stations_per_state, mun_per_state, on="state_name")
+    df_merged = df_states[["state_name", "num_stations", "num_municipalities"]].copy()
     df_merged.columns = ["state_name", "total_stations", "total_municipalities"]
-    
+
     # Calculate average
     df_merged["avg_stations_per_municipality"] = df_merged["total_stations"] / df_merged["total_municipalities"]
-    
+
     # Format the numbers for tooltip
-    df_merged["formatted_avg"] = df_merged["avg_stations_per_municipality"].apply(lambda x: f"{x:.1f}")
-    df_merged["formatted_total"] = df_merged["total_stations"].apply(lambda x: f"{int(x):,}")
-    df_merged["formatted_mun"] = df_merged["total_municipalities"].apply(lambda x: f"{int(x):,}")
-    
+    df_merged["formatted_avg"] = format_number(df_merged["avg_stations_per_municipality"], 1)
+    df_merged["formatted_total"] = format_number(df_merged["total_stations"], thousands=True)
+    df_merged["formatted_mun"] = format_number(df_merged["total_municipalities"], thousands=True)
+
     # Sort by average
     df_merged = df_merged.sort_values("avg_stations_per_municipality", ascending=True)
-    
+
     fig = px.bar(
         df_merged,
         x="avg_stations_per_municipality",
@@ -293,7 +317,7 @@ def bar_chart_stations_per_municipality(df_station):
         custom_data=["formatted_avg", "formatted_total", "formatted_mun"],
         color_discrete_sequence=["#1f77b4"]
     )
-    
+
     # Update hover template to show all relevant information
     fig.update_traces(
         hovertemplate=(
@@ -303,169 +327,290 @@ def bar_chart_stations_per_municipality(df_station):
             "Number of municipalities: %{customdata[2]}<extra></extra>"
         )
     )
-    
+
     # Format x-axis to show one decimal place
     fig.update_layout(
         xaxis_title="Average Number of Stations per Municipality",
         xaxis=dict(tickformat=".1f"),
         height=900
     )
-    
+
     return fig
 
+# -------------------------------------------------------------------------
+# Station Map
+# -------------------------------------------------------------------------
+# The base map never changes, so st_folium keeps it mounted (and keeps the
+# user's pan/zoom); each rerun only swaps the layer drawn for the current view.
+
+MAP_KEY = "station_map"
+MAP_CENTER = [23.6, -102.5]
+MAP_START_ZOOM = 5
+MAP_HEIGHT = 600
+MAP_COLORS = ["green", "yellow", "red"]
+
+def _map_view(map_state):
+    """(zoom, (min_lon, min_lat, max_lon, max_lat)) of the last view reported by st_folium, else the initial view."""
+    bounds = (map_state or {}).get("bounds") or {}
+    south_west = bounds.get("_southWest") or {}
+    north_east = bounds.get("_northEast") or {}
+    view = (south_west.get("lng"), south_west.get("lat"), north_east.get("lng"), north_east.get("lat"))
+    if None in view:
+        return MAP_START_ZOOM, COORDINATE_BOUNDS
+    return map_state.get("zoom") or MAP_START_ZOOM, view
+
+def _price_text(prices):
+    return np.where(np.isnan(prices), "n/a", concat("$", format_price(prices), " MXN"))
+
+@instrumented()
+def station_map_layer(kind, payload, fuel, colormap):
+    """
+    Feature group drawing one map view: clusters sized by their number of stations,
+    or individual stations, colored by their (mean) price of fuel.
+    """
+    fuel_names = {"regular_price": "Regular", "premium_price": "Premium", "diesel_price": "Diesel"}
+    layer = folium.FeatureGroup(name="Stations")
+    if payload.empty:
+        return layer
+
+    if kind == "clusters":
+        stations = payload["num_stations"].to_numpy()
+        radius = np.minimum(5 + 2 * np.sqrt(stations), 30)
+        header = concat("<b>", format_number(stations, thousands=True), " stations</b>")
+        label = " (avg): "
+    else:
+        radius = np.full(len(payload), 6.0)
+        names = [html.escape(name) for name in payload["station_name"].fillna("").astype(str)]
+        header = concat("<b>", np.array(names, dtype=str), "</b>")
+        label = ": "
+    tooltips = header
+    for column, name in fuel_names.items():
+        tooltips = concat(tooltips, f"<br>{name}{label}", _price_text(payload[column].to_numpy(dtype=float)))
+
+    # One GeoJson layer renders much faster than a folium marker per point
+    prices = payload[fuel].to_numpy(dtype=float)
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [float(lon), float(lat)]},
+            "properties": {
+                "tooltip": tooltip,
+                "radius": float(size),
+                "color": "gray" if np.isnan(price) else colormap(price)
+            }
+        }
+        for lon, lat, size, price, tooltip in zip(
+            payload["longitude"].to_numpy(), payload["latitude"].to_numpy(), radius, prices, tooltips
+        )
+    ]
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        marker=folium.CircleMarker(weight=1, fill=True, fill_opacity=0.7),
+        style_function=lambda feature: {
+            "radius": feature["properties"]["radius"],
+            "color": feature["properties"]["color"],
+            "fillColor": feature["properties"]["color"]
+        },
+        tooltip=folium.GeoJsonTooltip(fields=["tooltip"], labels=False)
+    ).add_to(layer)
+    return layer
+
+@instrumented()
+def station_map(station_clusters, station_index):
+    """
+    Map of all stations: grid clusters (count and mean price per fuel) up to
+    POINTS_MIN_ZOOM, individual stations of the visible area beyond it.
+    station_clusters: clusters table from precompute.py; station_index: spatial.StationIndex.
+    """
+    fuel_names = {"regular_price": "Regular", "premium_price": "Premium", "diesel_price": "Diesel"}
+    fuel = st.selectbox("Color by", list(fuel_names), format_func=fuel_names.get, key="station_map_fuel")
+
+    # One color scale for every view: 5th-95th percentile of the finest clusters' mean prices
+    finest = station_clusters[station_clusters["zoom"] == CLUSTER_ZOOMS[-1]][fuel].dropna()
+    vmin, vmax = np.percentile(finest, [5, 95]) if len(finest) else (0, 1)
+    colormap = LinearColormap(MAP_COLORS, vmin=vmin, vmax=max(vmax, vmin + 0.01))
+
+    zoom, bounds = _map_view(st.session_state.get(MAP_KEY))
+    kind, payload = view_payload(station_clusters, station_index, zoom, bounds)
+
+    base_map = folium.Map(
+        location=MAP_CENTER,
+        zoom_start=MAP_START_ZOOM,
+        min_zoom=CLUSTER_ZOOMS[0],
+        tiles="cartodbpositron"
+    )
+    st_folium(
+        base_map,
+        key=MAP_KEY,
+        height=MAP_HEIGHT,
+        use_container_width=True,
+        returned_objects=["zoom", "bounds"],
+        feature_group_to_add=station_map_layer(kind, payload, fuel, colormap)
+    )
+
+    if kind == "clusters":
+        shown = int(payload["num_stations"].sum())
+        st.caption(
+            f"{len(payload):,} clusters covering {shown:,} stations in view. "
+            f"Zoom in to level {POINTS_MIN_ZOOM} to see individual stations."
+        )
+    else:
+        st.caption(f"{len(payload):,} stations in view.")
+
 # -------------------------------------------------------------------------
 # Price Analysis
 # -------------------------------------------------------------------------
 
-def display_national_avg_prices(df_price):
-    avg_regular = df_price["regular_price"].mean()
-    avg_premium = df_price["premium_price"].mean()
-    avg_diesel = df_price["diesel_price"].mean()
+@instrumented()
+def display_national_avg_prices(national_avg):
+    """national_avg: dict of national average price per fuel column."""
+    avg_regular = national_avg["regular_price"]
+    avg_premium = national_avg["premium_price"]
+    avg_diesel = national_avg["diesel_price"]
 
     col1, col2, col3 = st.columns(3)
     col1.metric("Regular (Avg)", f"${avg_regular:.2f} MXN")
     col2.metric("Premium (Avg)", f"${avg_premium:.2f} MXN")
     col3.metric("Diesel (Avg)", f"${avg_diesel:.2f} MXN")
 
-def display_state_price_triplet(df_price, df_pop):
+@instrumented()
+@cached(args_key)
+def state_price_figure(df_state_prices, fuel):
     """
-    3 side-by-side bar charts of avg price by state for Regular (green),
-    Premium (red), Diesel (darkgrey), sorted ascending, ensuring 2 decimals in hover.
+    Bar chart of avg price by state for one fuel, sorted ascending, 2 decimals in hover.
+    Regular (green), Premium (red), Diesel (darkgrey).
     """
     fuel_map = {
         "regular_price": ("Regular", "green"),
         "premium_price": ("Premium", "red"),
         "diesel_price": ("Diesel", "darkgrey")
     }
-    col1, col2, col3 = st.columns(3)
-    all_states = df_pop["Entidad Federativa"].unique()
-    df_all_states = pd.DataFrame({"state_name": all_states})
+    df_merged = df_state_prices.loc[df_state_prices["fuel"] == fuel, ["state_name", "average_price"]].copy()
+    df_merged["average_price"] = df_merged["average_price"].fillna(0)
 
-    fuels = list(fuel_map.keys())
-    for idx, fuel in enumerate(fuels):
-        df_state = df_price.groupby("state_name")[fuel].mean().reset_index()
-        df_state.columns = ["state_name", "average_price"]
-        df_merged = pd.merge(df_all_states, df_state, on="state_name", how="left")
-        df_merged["average_price"] = df_merged["average_price"].fillna(0)
+    df_merged = df_merged.sort_values("average_price", ascending=True)
+    color_to_use = [fuel_map[fuel][1]]
 
-        df_merged = df_merged.sort_values("average_price", ascending=True)
-        color_to_use = [fuel_map[fuel][1]]
-
-        fig = px.bar(
-            df_merged,
-            x="average_price",
-            y="state_name",
-            orientation="h",
-            title=f"Average {fuel_map[fuel][0]} Price by State",
-            hover_data={"average_price": ':.2f', "state_name": False},
-            color_discrete_sequence=color_to_use
-        )
-        fig.update_layout(height=700)
+    fig = px.bar(
+        df_merged,
+        x="average_price",
+        y="state_name",
+        orientation="h",
+        title=f"Average {fuel_map[fuel][0]} Price by State",
+        hover_data={"average_price": ':.2f', "state_name": False},
+        color_discrete_sequence=color_to_use
+    )
+    fig.update_layout(height=700)
+    return fig
 
-        if idx == 0:
-            col1.plotly_chart(fig, use_container_width=True)
-        elif idx == 1:
-            col2.plotly_chart(fig, use_container_width=True)
-        else:
-            col3.plotly_chart(fig, use_container_width=True)
+@instrumented()
+def display_state_price_triplet(df_state_prices):
+    """
+    3 side-by-side bar charts of avg price by state for Regular (green),
+    Premium (red), Diesel (darkgrey), sorted ascending, ensuring 2 decimals in hover.
+    df_state_prices: state_prices table (state_name, fuel, average_price), every state per fuel.
+    """
+    columns = st.columns(3)
+    for column, fuel in zip(columns, ["regular_price", "premium_price", "diesel_price"]):
+        column.plotly_chart(state_price_figure(df_state_prices, fuel), use_container_width=True)
 
-def display_municipality_price_triplet(df_price):
+@instrumented()
+@cached(args_key)
+def municipality_price_figure(df_mun_prices, fuel, national_avg_fuel):
     """
-    3 side-by-side bar charts for the top 15 municipalities by average price
-    for Regular (green), Premium (red), Diesel (darkgrey).
-    Hover includes municipality, state, average price, deviation and percentage (2 decimals).
+    Bar chart of the top 15 municipalities by average price for one fuel.
+    Hover includes municipality, state, average price, deviation and percentage.
     """
-    # We need municipality + state grouping to show the state in hover
     fuel_map = {
         "regular_price": ("Regular", "green"),
         "premium_price": ("Premium", "red"),
         "diesel_price": ("Diesel", "darkgrey")
     }
-    col1, col2, col3 = st.columns(3)
 
-    fuels = list(fuel_map.keys())
-    for idx, fuel in enumerate(fuels):
-        # Calculate national average
-        national_avg = df_price[fuel].mean()
-        
-        group_cols = ["municipality_name", "state_name"]
-        df_mun = df_price.groupby(group_cols)[fuel].mean().reset_index()
-        df_mun.columns = ["municipality_name", "state_name", "average_price"]
-
-        # Calculate deviation and percentage
-        df_mun["price_deviation"] = df_mun["average_price"] - national_avg
-        df_mun["deviation_pct"] = (df_mun["price_deviation"] / national_avg) * 100
-        
-        # Format numbers for tooltip
-        df_mun["formatted_price"] = df_mun["average_price"].apply(lambda x: f"${x:.2f}")
-        df_mun["formatted_deviation"] = df_mun["price_deviation"].apply(lambda x: f"{'+' if x > 0 else ''}{x:.2f}")
-        df_mun["formatted_pct"] = df_mun["deviation_pct"].apply(lambda x: f"{'+' if x > 0 else ''}{x:.1f}%")
-
-        # Sort descending by price, pick top 15
-        df_mun = df_mun.sort_values("average_price", ascending=False).head(15)
-        # Then ascending for bar orientation
-        df_mun = df_mun.sort_values("average_price", ascending=True)
-
-        fig = px.bar(
-            df_mun,
-            x="average_price",
-            y="municipality_name",
-            orientation="h",
-            title=f"{fuel_map[fuel][0]} Price (Avg: ${national_avg:.2f})",
-            custom_data=["state_name", "formatted_price", "formatted_deviation", "formatted_pct"],
-            color_discrete_sequence=[fuel_map[fuel][1]]
-        )
+    # Sort descending by price, pick top 15
+    df_mun = df_mun_prices[df_mun_prices["fuel"] == fuel].nlargest(15, "average_price")
+    # Then ascending for bar orientation
+    df_mun = df_mun.sort_values("average_price", ascending=True)
 
-        # Update hover template to show all information
-        fig.update_traces(
-            hovertemplate=(
-                "<b>%{y}</b><br>" +
-                "State: %{customdata[0]}<br>" +
-                "Price: %{customdata[1]}<br>" +
-                "Deviation: %{customdata[2]}<br>" +
-                "Percentage: %{customdata[3]}<extra></extra>"
-            )
+    # Format numbers for tooltip
+    df_mun["formatted_price"] = format_price(df_mun["average_price"])
+    df_mun["formatted_deviation"] = format_number(df_mun["price_deviation"], 2, sign=True)
+    df_mun["formatted_pct"] = format_percent(df_mun["deviation_pct"], 1, sign=True)
+
+    fig = px.bar(
+        df_mun,
+        x="average_price",
+        y="municipality_name",
+        orientation="h",
+        title=f"{fuel_map[fuel][0]} Price (Avg: ${national_avg_fuel:.2f})",
+        custom_data=["state_name", "formatted_price", "formatted_deviation", "formatted_pct"],
+        color_discrete_sequence=[fuel_map[fuel][1]]
+    )
+
+    # Update hover template to show all information
+    fig.update_traces(
+        hovertemplate=(
+            "<b>%{y}</b><br>" +
+            "State: %{customdata[0]}<br>" +
+            "Price: %{customdata[1]}<br>" +
+            "Deviation: %{customdata[2]}<br>" +
+            "Percentage: %{customdata[3]}<extra></extra>"
         )
-        
-        fig.update_layout(height=700)
+    )
 
-        if idx == 0:
-            col1.plotly_chart(fig, use_container_width=True)
-        elif idx == 1:
-            col2.plotly_chart(fig, use_container_width=True)
-        else:
-            col3.plotly_chart(fig, use_container_width=True)
+    fig.update_layout(height=700)
+    return fig
 
-def boxplot_price_distribution_by_state(df_price):
+@instrumented()
+def display_municipality_price_triplet(df_mun_prices, national_avg):
+    """
+    3 side-by-side bar charts for the top 15 municipalities by average price
+    for Regular (green), Premium (red), Diesel (darkgrey).
+    Hover includes municipality, state, average price, deviation and percentage (2 decimals).
+    df_mun_prices: municipality_prices table (municipality_name, state_name, fuel,
+    average_price, price_deviation, deviation_pct).
+    """
+    columns = st.columns(3)
+    for column, fuel in zip(columns, ["regular_price", "premium_price", "diesel_price"]):
+        fig = municipality_price_figure(df_mun_prices, fuel, national_avg[fuel])
+        column.plotly_chart(fig, use_container_width=True)
+
+@instrumented()
+@cached(args_key)
+def boxplot_price_distribution_by_state(df_state_prices):
     """
     Three box plots of price distribution by state, one for each fuel type.
     Returns a list of three figures, one for each fuel type.
-    No outliers displayed (points=None).
+    Boxes are drawn from the pre-computed quartiles and whiskers (1.5 IQR), no points.
     2-decimal numeric formatting done via y-axis tickformat.
     Consistent colors: Regular (green), Premium (red), Diesel (darkgrey).
+    df_state_prices: state_prices table with the q1, median, q3, lower_fence and upper_fence columns.
     """
     fuel_map = {
         "regular_price": ("Regular", "green"),
         "premium_price": ("Premium", "red"),
         "diesel_price": ("Diesel", "darkgrey")
     }
-    
+
     figures = []
     for fuel, (fuel_name, color) in fuel_map.items():
-        # Create box plot for each fuel type
-        valid_df = df_price.dropna(subset=[fuel])
-        
-        fig = px.box(
-            valid_df,
-            x="state_name",
-            y=fuel,
-            title=f"{fuel_name} Price Distribution by State",
-            points=None,  # Hide outliers
-            color_discrete_sequence=[color]
-        )
-        
+        # One box per state with prices for this fuel
+        stats = df_state_prices[(df_state_prices["fuel"] == fuel) & (df_state_prices["num_prices"] > 0)]
+
+        fig = go.Figure(go.Box(
+            x=stats["state_name"],
+            q1=stats["q1"],
+            median=stats["median"],
+            q3=stats["q3"],
+            lowerfence=stats["lower_fence"],
+            upperfence=stats["upper_fence"],
+            boxpoints=False,  # Hide outliers
+            marker_color=color
+        ))
+
         # Update layout
         fig.update_layout(
+            title=f"{fuel_name} Price Distribution by State",
             xaxis=dict(
                 type='category',
                 tickangle=45,
@@ -479,7 +624,7 @@ def boxplot_price_distribution_by_state(df_price):
             showlegend=False,
             margin=dict(b=100)  # Add more bottom margin for rotated labels
         )
-        
+
         # Update hover template
         fig.update_traces(
             hovertemplate=(
@@ -488,12 +633,83 @@ def boxplot_price_distribution_by_state(df_price):
                 "<extra></extra>"
             )
         )
-        
+
         figures.append(fig)
-    
+
     return figures
 
-def histogram_prices_by_type_and_state(df_price):
+@instrumented()
+@cached(args_key)
+def price_histogram_figure(histogram, fuel, selected_state):
+    """
+    Histogram of one fuel's prices in the selected state ("All States" for every state),
+    with a dashed line at the mean, drawn from the pre-binned counts.
+    histogram: {"start", "size", "counts", "mean"} entry of price_histograms; None when
+    the state has no prices for the fuel (the figure is then None too).
+    """
+    fuel_map = {
+        "regular_price": ("Regular", "green"),
+        "premium_price": ("Premium", "red"),
+        "diesel_price": ("Diesel", "darkgrey")
+    }
+    fuel_name, color = fuel_map[fuel]
+
+    if histogram is None or sum(histogram["counts"]) == 0:
+        return None
+
+    size = histogram["size"]
+    counts = np.asarray(histogram["counts"])
+    lower = histogram["start"] + size * np.arange(len(counts))
+    bins = pd.DataFrame({"bin_center": lower + size / 2, "count": counts})
+    bins["price_range"] = concat(format_price(lower), " - ", format_price(lower + size))
+
+    state_text = f"in {selected_state}" if selected_state != "All States" else "Across All States"
+    mean_price = histogram["mean"]
+
+    fig = px.bar(
+        bins,
+        x="bin_center",
+        y="count",
+        custom_data=["price_range"],
+        title=f"Distribution of {fuel_name} Prices {state_text} (Mean: ${mean_price:.2f} MXN)",
+        color_discrete_sequence=[color]
+    )
+    fig.update_traces(width=size)
+
+    # Update layout
+    fig.update_layout(
+        xaxis_title=f"{fuel_name} Price ($ MXN)",
+        yaxis_title="Number of Stations",
+        xaxis=dict(tickformat=".2f"),
+        bargap=0,
+        showlegend=False,
+        height=500
+    )
+
+    # Update hover template
+    fig.update_traces(
+        hovertemplate=(
+            "Price Range: %{customdata[0]} MXN<br>" +
+            "Number of Stations: %{y}<br>" +
+            "<extra></extra>"
+        )
+    )
+
+    # Add mean line with annotation
+    fig.add_vline(x=mean_price, line_dash="dash", line_color="gray")
+    fig.add_annotation(
+        x=mean_price,
+        y=int(counts.max()),
+        text=f"Mean: ${mean_price:.2f} MXN",
+        showarrow=True,
+        arrowhead=1,
+        yshift=10
+    )
+
+    return fig
+
+@instrumented()
+def histogram_prices_by_type_and_state(price_histograms, all_states):
     """
     Histograms for each fuel type showing the distribution of prices.
     - X-axis: price with 2 decimal places
@@ -501,87 +717,30 @@ def histogram_prices_by_type_and_state(df_price):
     - One color per fuel type
     - State filter dropdown affecting all three histograms
     - Hover shows price range and count of stations
+    price_histograms: {fuel column: {state: binned counts}} from precompute.py;
+    all_states: states offered in the dropdown.
     """
-    fuel_map = {
-        "regular_price": ("Regular", "green"),
-        "premium_price": ("Premium", "red"),
-        "diesel_price": ("Diesel", "darkgrey")
-    }
-    
+    fuel_names = {"regular_price": "Regular", "premium_price": "Premium", "diesel_price": "Diesel"}
+
     # Add state selector
-    all_states = sorted(df_price["state_name"].unique())
-    selected_state = st.selectbox("Select State (affects all histograms)", 
-                                ["All States"] + list(all_states))
-    
-    # Filter data based on state selection
-    if selected_state != "All States":
-        df_filtered = df_price[df_price["state_name"] == selected_state]
-    else:
-        df_filtered = df_price
-    
-    for fuel, (fuel_name, color) in fuel_map.items():
-        valid_df = df_filtered.dropna(subset=[fuel])
-        
+    selected_state = st.selectbox("Select State (affects all histograms)",
+                                ["All States"] + sorted(all_states), key="histogram_state")
+
+    for fuel, fuel_name in fuel_names.items():
+        fig = price_histogram_figure(price_histograms[fuel].get(selected_state), fuel, selected_state)
+
         # Skip if no data available
-        if len(valid_df) == 0:
+        if fig is None:
             st.warning(f"No {fuel_name} price data available for {selected_state}")
             continue
-        
-        state_text = f"in {selected_state}" if selected_state != "All States" else "Across All States"
-        mean_price = valid_df[fuel].mean()
-        
-        fig = px.histogram(
-            valid_df,
-            x=fuel,
-            nbins=50,  # More bins for finer granularity
-            title=f"Distribution of {fuel_name} Prices {state_text} (Mean: ${mean_price:.2f} MXN)",
-            color_discrete_sequence=[color]
-        )
-        
-        # Update layout
-        fig.update_layout(
-            xaxis_title=f"{fuel_name} Price ($ MXN)",
-            yaxis_title="Number of Stations",
-            xaxis=dict(tickformat=".2f"),
-            showlegend=False,
-            height=500
-        )
-        
-        # Update hover template
-        fig.update_traces(
-            hovertemplate=(
-                "Price Range: $%{x:.2f} MXN<br>" +
-                "Number of Stations: %{y}<br>" +
-                "<extra></extra>"
-            )
-        )
-        
-        # Add mean line with annotation only if we have valid histogram data
-        try:
-            if (fig.data and 
-                hasattr(fig.data[0], 'y') and 
-                fig.data[0].y is not None and 
-                any(y > 0 for y in fig.data[0].y)):
-                
-                y_max = max(fig.data[0].y)
-                fig.add_vline(x=mean_price, line_dash="dash", line_color="gray")
-                fig.add_annotation(
-                    x=mean_price,
-                    y=y_max,
-                    text=f"Mean: ${mean_price:.2f} MXN",
-                    showarrow=True,
-                    arrowhead=1,
-                    yshift=10
-                )
-        except (AttributeError, IndexError, TypeError):
-            # If any error occurs while trying to add the mean line, just skip it
-            pass
-        
+
         st.plotly_chart(fig, use_container_width=True)
 
-def display_state_price_deviation_triplet(df_price, df_pop):
+@instrumented()
+@cached(args_key)
+def state_price_deviation_figure(df_state_prices, fuel, national_avg_fuel):
     """
-    3 side-by-side bar charts showing price deviation from national average for each fuel type.
+    Bar chart of each state's price deviation from the national average for one fuel.
     Positive deviations in red, negative in green.
     """
     fuel_map = {
@@ -589,249 +748,178 @@ def display_state_price_deviation_triplet(df_price, df_pop):
         "premium_price": "Premium",
         "diesel_price": "Diesel"
     }
-    
-    col1, col2, col3 = st.columns(3)
-    all_states = df_pop["Entidad Federativa"].unique()
-    df_all_states = pd.DataFrame({"state_name": all_states})
-
-    fuels = list(fuel_map.keys())
-    for idx, fuel in enumerate(fuels):
-        # Calculate national average
-        national_avg = df_price[fuel].mean()
-        
-        # Calculate state averages
-        df_state = df_price.groupby("state_name")[fuel].mean().reset_index()
-        df_state.columns = ["state_name", "average_price"]
-        
-        # Merge with all states
-        df_merged = pd.merge(df_all_states, df_state, on="state_name", how="left")
-        df_merged["average_price"] = df_merged["average_price"].fillna(0)
-        
-        # Calculate deviation from national average
-        df_merged["price_deviation"] = df_merged["average_price"] - national_avg
-        df_merged["deviation_pct"] = (df_merged["price_deviation"] / national_avg) * 100
-        
-        # Format numbers for tooltip
-        df_merged["formatted_price"] = df_merged["average_price"].apply(lambda x: f"${x:.2f}")
-        df_merged["formatted_deviation"] = df_merged["price_deviation"].apply(lambda x: f"{'+' if x > 0 else ''}{x:.2f}")
-        df_merged["formatted_pct"] = df_merged["deviation_pct"].apply(lambda x: f"{'+' if x > 0 else ''}{x:.1f}%")
-        
-        # Sort by deviation
-        df_merged = df_merged.sort_values("price_deviation", ascending=True)
-        
-        # Create color array based on deviation
-        colors = ['#ff4b4b' if x > 0 else '#2ecc71' for x in df_merged["price_deviation"]]
-        
-        fig = px.bar(
-            df_merged,
-            x="price_deviation",
-            y="state_name",
-            orientation="h",
-            title=f"{fuel_map[fuel]} (Avg: ${national_avg:.2f})",
-            custom_data=["formatted_price", "formatted_deviation", "formatted_pct"]
-        )
-        
-        # Update bars color based on deviation
-        fig.update_traces(
-            marker_color=colors,
-            hovertemplate=(
-                "<b>%{y}</b><br>" +
-                "Current price: %{customdata[0]}<br>" +
-                "Deviation: %{customdata[1]}<br>" +
-                "Percentage: %{customdata[2]}<extra></extra>"
-            )
-        )
-        
-        # Update layout
-        fig.update_layout(
-            height=700,
-            xaxis_title="Price Deviation ($)",
-            yaxis_title="",
-            showlegend=False
+
+    df_merged = df_state_prices.loc[df_state_prices["fuel"] == fuel, ["state_name", "average_price"]].copy()
+    df_merged["average_price"] = df_merged["average_price"].fillna(0)
+
+    # Calculate deviation from national average
+    df_merged["price_deviation"] = df_merged["average_price"] - national_avg_fuel
+    df_merged["deviation_pct"] = (df_merged["price_deviation"] / national_avg_fuel) * 100
+
+    # Format numbers for tooltip
+    df_merged["formatted_price"] = format_price(df_merged["average_price"])
+    df_merged["formatted_deviation"] = format_number(df_merged["price_deviation"], 2, sign=True)
+    df_merged["formatted_pct"] = format_percent(df_merged["deviation_pct"], 1, sign=True)
+
+    # Sort by deviation
+    df_merged = df_merged.sort_values("price_deviation", ascending=True)
+
+    # Create color array based on deviation
+    colors = np.where(df_merged["price_deviation"] > 0, "#ff4b4b", "#2ecc71")
+
+    fig = px.bar(
+        df_merged,
+        x="price_deviation",
+        y="state_name",
+        orientation="h",
+        title=f"{fuel_map[fuel]} (Avg: ${national_avg_fuel:.2f})",
+        custom_data=["formatted_price", "formatted_deviation", "formatted_pct"]
+    )
+
+    # Update bars color based on deviation
+    fig.update_traces(
+        marker_color=colors,
+        hovertemplate=(
+            "<b>%{y}</b><br>" +
+            "Current price: %{customdata[0]}<br>" +
+            "Deviation: %{customdata[1]}<br>" +
+            "Percentage: %{customdata[2]}<extra></extra>"
         )
-        
-        # Add a vertical line at x=0
-        fig.add_vline(x=0, line_dash="dash", line_color="gray")
-        
-        if idx == 0:
-            col1.plotly_chart(fig, use_container_width=True)
-        elif idx == 1:
-            col2.plotly_chart(fig, use_container_width=True)
-        else:
-            col3.plotly_chart(fig, use_container_width=True)
-
-def display_municipality_price_deviation_triplet(df_price):
+    )
+
+    # Update layout
+    fig.update_layout(
+        height=700,
+        xaxis_title="Price Deviation ($)",
+        yaxis_title="",
+        showlegend=False
+    )
+
+    # Add a vertical line at x=0
+    fig.add_vline(x=0, line_dash="dash", line_color="gray")
+    return fig
+
+@instrumented()
+def display_state_price_deviation_triplet(df_state_prices, national_avg):
     """
-    3 side-by-side bar charts showing price deviation from national average for top 15 municipalities
-    by deviation magnitude for each fuel type. Positive deviations in red, negative in green.
+    3 side-by-side bar charts showing price deviation from national average for each fuel type.
+    Positive deviations in red, negative in green.
+    df_state_prices: state_prices table (state_name, fuel, average_price), every state per fuel.
+    """
+    columns = st.columns(3)
+    for column, fuel in zip(columns, ["regular_price", "premium_price", "diesel_price"]):
+        fig = state_price_deviation_figure(df_state_prices, fuel, national_avg[fuel])
+        column.plotly_chart(fig, use_container_width=True)
+
+@instrumented()
+@cached(args_key)
+def municipality_price_deviation_figure(df_mun_prices, fuel, national_avg_fuel):
+    """
+    Bar chart of the top 15 municipalities by absolute deviation from the national average
+    for one fuel. Positive deviations in red, negative in green.
     """
     fuel_map = {
         "regular_price": ("Regular", "green"),
         "premium_price": ("Premium", "red"),
         "diesel_price": ("Diesel", "darkgrey")
     }
-    col1, col2, col3 = st.columns(3)
 
-    fuels = list(fuel_map.keys())
-    for idx, fuel in enumerate(fuels):
-        # Calculate national average
-        national_avg = df_price[fuel].mean()
-        
-        # Calculate municipality averages
-        group_cols = ["municipality_name", "state_name"]
-        df_mun = df_price.groupby(group_cols)[fuel].mean().reset_index()
-        df_mun.columns = ["municipality_name", "state_name", "average_price"]
-        
-        # Calculate deviations
-        df_mun["price_deviation"] = df_mun["average_price"] - national_avg
-        df_mun["deviation_pct"] = (df_mun["price_deviation"] / national_avg) * 100
-        
-        # Format numbers for tooltip
-        df_mun["formatted_price"] = df_mun["average_price"].apply(lambda x: f"${x:.2f}")
-        df_mun["formatted_deviation"] = df_mun["price_deviation"].apply(lambda x: f"{'+' if x > 0 else ''}{x:.2f}")
-        df_mun["formatted_pct"] = df_mun["deviation_pct"].apply(lambda x: f"{'+' if x > 0 else ''}{x:.1f}%")
-        
-        # Get top 15 by absolute deviation
-        df_mun["abs_deviation"] = abs(df_mun["price_deviation"])
-        df_mun = df_mun.nlargest(15, "abs_deviation")
-        df_mun = df_mun.sort_values("price_deviation", ascending=True)
-        
-        # Create color array based on deviation
-        colors = ['#ff4b4b' if x > 0 else '#2ecc71' for x in df_mun["price_deviation"]]
-        
-        fig = px.bar(
-            df_mun,
-            x="price_deviation",
-            y="municipality_name",
-            orientation="h",
-            title=f"Price Deviations - {fuel_map[fuel][0]} (Avg: ${national_avg:.2f})",
-            custom_data=["state_name", "formatted_price", "formatted_deviation", "formatted_pct"]
-        )
-        
-        # Update bars color based on deviation
-        fig.update_traces(
-            marker_color=colors,
-            hovertemplate=(
-                "<b>%{y}</b><br>" +
-                "State: %{customdata[0]}<br>" +
-                "Current price: %{customdata[1]}<br>" +
-                "Deviation: %{customdata[2]}<br>" +
-                "Percentage: %{customdata[3]}<extra></extra>"
-            )
-        )
-        
-        # Update layout
-        fig.update_layout(
-            height=700,
-            xaxis_title="Price Deviation ($)",
-            yaxis_title="",
-            showlegend=False
+    # Get top 15 by absolute deviation
+    df_mun = df_mun_prices[df_mun_prices["fuel"] == fuel].copy()
+    df_mun["abs_deviation"] = abs(df_mun["price_deviation"])
+    df_mun = df_mun.nlargest(15, "abs_deviation")
+    df_mun = df_mun.sort_values("price_deviation", ascending=True)
+
+    # Format numbers for tooltip
+    df_mun["formatted_price"] = format_price(df_mun["average_price"])
+    df_mun["formatted_deviation"] = format_number(df_mun["price_deviation"], 2, sign=True)
+    df_mun["formatted_pct"] = format_percent(df_mun["deviation_pct"], 1, sign=True)
+
+    # Create color array based on deviation
+    colors = np.where(df_mun["price_deviation"] > 0, "#ff4b4b", "#2ecc71")
+
+    fig = px.bar(
+        df_mun,
+        x="price_deviation",
+        y="municipality_name",
+        orientation="h",
+        title=f"Price Deviations - {fuel_map[fuel][0]} (Avg: ${national_avg_fuel:.2f})",
+        custom_data=["state_name", "formatted_price", "formatted_deviation", "formatted_pct"]
+    )
+
+    # Update bars color based on deviation
+    fig.update_traces(
+        marker_color=colors,
+        hovertemplate=(
+            "<b>%{y}</b><br>" +
+            "State: %{customdata[0]}<br>" +
+            "Current price: %{customdata[1]}<br>" +
+            "Deviation: %{customdata[2]}<br>" +
+            "Percentage: %{customdata[3]}<extra></extra>"
         )
-        
-        # Add a vertical line at x=0
-        fig.add_vline(x=0, line_dash="dash", line_color="gray")
-        
-        if idx == 0:
-            col1.plotly_chart(fig, use_container_width=True)
-        elif idx == 1:
-            col2.plotly_chart(fig, use_container_width=True)
-        else:
-            col3.plotly_chart(fig, use_container_width=True)
+    )
+
+    # Update layout
+    fig.update_layout(
+        height=700,
+        xaxis_title="Price Deviation ($)",
+        yaxis_title="",
+        showlegend=False
+    )
+
+    # Add a vertical line at x=0
+    fig.add_vline(x=0, line_dash="dash", line_color="gray")
+    return fig
+
+@instrumented()
+def display_municipality_price_deviation_triplet(df_mun_prices, national_avg):
+    """
+    3 side-by-side bar charts showing price deviation from national average for top 15 municipalities
+    by deviation magnitude for each fuel type. Positive deviations in red, negative in green.
+    df_mun_prices: municipality_prices table (municipality_name, state_name, fuel,
+    average_price, price_deviation, deviation_pct).
+    """
+    columns = st.columns(3)
+    for column, fuel in zip(columns, ["regular_price", "premium_price", "diesel_price"]):
+        fig = municipality_price_deviation_figure(df_mun_prices, fuel, national_avg[fuel])
+        column.plotly_chart(fig, use_container_width=True)
 
 # -------------------------------------------------------------------------
 # Volume Analysis
 # -------------------------------------------------------------------------
 
-def volume_analysis_charts(df_volume, df_price, df_station, df_pop):
-    """
-    Replace tables with charts:
-    1) Total Volume by Fuel Type
-    2) Total Volume by State & Fuel Type
-    3) 2024 Market Value by State
-    4) Average Volume per Station by State
-    Also includes a national total market value metric.
-    """
-    # Define consistent colors with more diesel variants
-    color_map = {
-        "Regular": "#2ecc71",  # green
-        "Premium": "#ff4b4b",  # red
-        "Diesel": "#333333",  # darkest grey
-    }
+VOLUME_COL = "Volumen Vendido (litros)"
 
-    # Helper function for consistent number formatting
-    def format_volume(x, include_label=True):
-        """Format volume in B or M with max 2 decimals"""
-        if x >= 1e9:
-            val = f"{x/1e9:.2f}B".rstrip('0').rstrip('.')
-            return f"{val} liters" if include_label else val
-        val = f"{x/1e6:.2f}M".rstrip('0').rstrip('.')
-        return f"{val} liters" if include_label else val
-
-    def format_currency(x, include_currency=False, include_usd=False):
-        """Format currency in T, B or M with max 2 decimals"""
-        # Convert to USD (using 20 MXN to 1 USD rate)
-        usd_value = x/20
-        
-        if x >= 1e12:  # MXN in trillions
-            mxn = f"${x/1e12:.2f}T".rstrip('0').rstrip('.')
-            if include_usd:
-                # Always show USD in billions if less than 1T
-                if usd_value < 1e12:
-                    usd = f"(USD {usd_value/1e9:.2f}B)".rstrip('0').rstrip('.')
-                else:
-                    usd = f"(USD {usd_value/1e12:.2f}T)".rstrip('0').rstrip('.')
-                return f"{mxn} MXN {usd}" if include_currency else f"{mxn} {usd}"
-            return f"{mxn} MXN" if include_currency else mxn
-        if x >= 1e9:  # MXN in billions
-            mxn = f"${x/1e9:.2f}B".rstrip('0').rstrip('.')
-            if include_usd:
-                usd = f"(USD {usd_value/1e9:.2f}B)".rstrip('0').rstrip('.')
-                return f"{mxn} MXN {usd}" if include_currency else f"{mxn} {usd}"
-            return f"{mxn} MXN" if include_currency else mxn
-        # MXN in millions
-        mxn = f"${x/1e6:.2f}M".rstrip('0').rstrip('.')
-        if include_usd:
-            usd = f"(USD {usd_value/1e6:.2f}M)".rstrip('0').rstrip('.')
-            return f"{mxn} MXN {usd}" if include_currency else f"{mxn} {usd}"
-        return f"{mxn} MXN" if include_currency else mxn
+# Define consistent colors with more diesel variants
+VOLUME_COLORS = {
+    "Regular": "#2ecc71",  # green
+    "Premium": "#ff4b4b",  # red
+    "Diesel": "#333333",  # darkest grey
+}
+
+@instrumented()
+@cached(args_key)
+def volume_by_fuel_figure(volume_by_fuel):
+    """Bar chart of total 2024 volume per fuel type, labelled with volume and share."""
+    volume_col = VOLUME_COL
+    total_by_fuel = volume_by_fuel.sort_values(volume_col, ascending=False).copy()
 
-    st.subheader("Total Volume by Fuel Type (2024)")
-    
-    # Create a copy of the volume data and map diesel types to "Diesel"
-    df_volume_agg = df_volume[df_volume["Año"] == 2024].copy()
-    df_volume_agg["SubProducto"] = df_volume_agg["SubProducto"].replace({
-        "Diésel Automotriz": "Diesel",
-        "DUBA": "Diesel",
-        "Diésel Agricola-Marino": "Diesel"
-    })
-    
-    total_by_fuel = df_volume_agg.groupby("SubProducto")["Volumen Vendido (litros)"].sum().reset_index()
-    total_by_fuel = total_by_fuel.sort_values("Volumen Vendido (litros)", ascending=False)
-    
-    # Calculate total volume and percentages
-    total_volume = total_by_fuel["Volumen Vendido (litros)"].sum()
-    total_by_fuel["Percentage"] = (total_by_fuel["Volumen Vendido (litros)"] / total_volume) * 100
-    
     # Format values in billions/millions and percentages
-    total_by_fuel["Formatted Volume"] = total_by_fuel.apply(
-        lambda x: f"{format_volume(x['Volumen Vendido (litros)'])} ({x['Percentage']:.1f}%)",
-        axis=1
-    )
-    total_by_fuel["Tooltip"] = total_by_fuel.apply(
-        lambda x: f"Volume: {format_volume(x['Volumen Vendido (litros)'])}<br>Share: {x['Percentage']:.1f}%",
-        axis=1
-    )
+    formatted_volume = format_volume(total_by_fuel[volume_col])
+    formatted_share = format_percent(total_by_fuel["Percentage"])
+    total_by_fuel["Formatted Volume"] = concat(formatted_volume, " (", formatted_share, ")")
+    total_by_fuel["Tooltip"] = concat("Volume: ", formatted_volume, "<br>Share: ", formatted_share)
 
     fig_total_by_fuel = px.bar(
         total_by_fuel,
         x="SubProducto",
-        y="Volumen Vendido (litros)",
+        y=volume_col,
         color="SubProducto",
-        color_discrete_map=color_map,
+        color_discrete_map=VOLUME_COLORS,
         text="Formatted Volume",
         custom_data=["Tooltip"]
     )
-    
+
     # Total Volume by Fuel Type chart
     fig_total_by_fuel.update_layout(
         yaxis=dict(
@@ -842,56 +930,40 @@ def volume_analysis_charts(df_volume, df_price, df_station, df_pop):
         xaxis_title="Fuel Type",
         showlegend=True
     )
-    
+
     fig_total_by_fuel.update_traces(
         hovertemplate="%{customdata[0]}<extra></extra>"
     )
-    
-    st.plotly_chart(fig_total_by_fuel, use_container_width=True)
+    return fig_total_by_fuel
+
+@instrumented()
+@cached(args_key)
+def volume_by_state_fuel_figure(volume_by_state_fuel, volume_by_state, show_percentage):
+    """Stacked bars of 2024 volume per state and fuel, in liters or as share of the state total."""
+    volume_col = VOLUME_COL
+    total_by_state_fuel = volume_by_state_fuel.copy()
+
+    # States sorted by total volume
+    state_order = volume_by_state.sort_values(volume_col, ascending=False)["EntidadFederativa"].tolist()
 
-    st.subheader("Total Volume by State & Fuel Type (2024)")
-    
-    # Add toggle for stacked percentage
-    show_percentage = st.checkbox("Show as percentage of state total", value=False, key="volume_percentage")
-    
-    total_by_state_fuel = df_volume_agg.groupby(["EntidadFederativa", "SubProducto"])["Volumen Vendido (litros)"].sum().reset_index()
-    
-    # Calculate state totals for sorting
-    state_totals = total_by_state_fuel.groupby("EntidadFederativa")["Volumen Vendido (litros)"].sum().reset_index()
-    state_order = state_totals.sort_values("Volumen Vendido (litros)", ascending=False)["EntidadFederativa"].tolist()
-    
-    # Calculate percentage within each state
-    total_by_state_fuel = total_by_state_fuel.merge(
-        state_totals,
-        on="EntidadFederativa",
-        suffixes=('', '_state_total')
-    )
-    total_by_state_fuel['state_percentage'] = (
-        total_by_state_fuel["Volumen Vendido (litros)"] / 
-        total_by_state_fuel["Volumen Vendido (litros)_state_total"] * 100
-    )
-    
     # Format values for hover
-    total_by_state_fuel["Tooltip"] = total_by_state_fuel.apply(
-        lambda x: (
-            f"{x['SubProducto']}<br>"
-            f"Volume: {format_volume(x['Volumen Vendido (litros)'])}<br>"
-            f"Share: {x['state_percentage']:.1f}% of state total"
-        ),
-        axis=1
+    total_by_state_fuel["Tooltip"] = concat(
+        total_by_state_fuel["SubProducto"], "<br>",
+        "Volume: ", format_volume(total_by_state_fuel[volume_col]), "<br>",
+        "Share: ", format_percent(total_by_state_fuel["state_percentage"]), " of state total"
     )
 
     fig_state_fuel = px.bar(
         total_by_state_fuel,
         x="EntidadFederativa",
-        y="state_percentage" if show_percentage else "Volumen Vendido (litros)",
+        y="state_percentage" if show_percentage else volume_col,
         color="SubProducto",
-        color_discrete_map=color_map,
+        color_discrete_map=VOLUME_COLORS,
         barmode="stack",
         category_orders={"EntidadFederativa": state_order},
         custom_data=["Tooltip"]
     )
-    
+
     # Total Volume by State & Fuel Type chart
     fig_state_fuel.update_layout(
         xaxis=dict(
@@ -906,113 +978,38 @@ def volume_analysis_charts(df_volume, df_price, df_station, df_pop):
         ),
         height=700
     )
-    
+
     fig_state_fuel.update_traces(
         hovertemplate="%{customdata[0]}<extra></extra>"
     )
-    
-    st.plotly_chart(fig_state_fuel, use_container_width=True)
+    return fig_state_fuel
 
-    # Calculate approximate 2024 market values
-    avg_reg = df_price["regular_price"].mean()
-    avg_prem = df_price["premium_price"].mean()
-    avg_diesel = df_price["diesel_price"].mean()
+@instrumented()
+@cached(args_key)
+def market_value_by_state_figure(volume_by_state_fuel, volume_by_state, show_percentage):
+    """Stacked bars of 2024 market value per state and fuel, in pesos or as share of the state total."""
+    total_by_state_fuel = volume_by_state_fuel.copy()
 
-    price_map = {
-        "Regular": avg_reg,
-        "Premium": avg_prem,
-        "Diesel": avg_diesel
-    }
+    # States sorted by total market value
+    state_market_order = volume_by_state.sort_values("Market_Value", ascending=False)["EntidadFederativa"].tolist()
 
-    # National total
-    volume_2024 = total_by_fuel.copy()
-    volume_2024["Avg_Price"] = volume_2024["SubProducto"].map(price_map)
-    volume_2024["Market_Value_2024"] = volume_2024["Volumen Vendido (litros)"] * volume_2024["Avg_Price"]
-    total_market_value = volume_2024["Market_Value_2024"].sum()
-    
-    # Calculate percentages of total market value
-    volume_2024["Market_Share"] = (volume_2024["Market_Value_2024"] / total_market_value) * 100
-    
-    # Display total first
-    st.subheader("Market Value Analysis (2024)")
-    formatted_total = format_currency(total_market_value, include_currency=True, include_usd=True)
-    st.metric(label="Total Market Value (All Fuels)", value=formatted_total)
-    
-    # Format the breakdown data
-    volume_2024["Formatted_Volume"] = volume_2024["Volumen Vendido (litros)"].apply(
-        lambda x: format_volume(x, include_label=True)
-    )
-    volume_2024["Formatted_Price"] = volume_2024["Avg_Price"].apply(
-        lambda x: f"${x:,.2f} MXN/liter"
-    )
-    volume_2024["Formatted_Value"] = volume_2024["Market_Value_2024"].apply(
-        lambda x: format_currency(x, include_currency=True, include_usd=True)
-    )
-    
-    # Display breakdown for each fuel type
-    st.markdown("### Estimated Market Value Breakdown (2024)")
-    for _, row in volume_2024.iterrows():
-        st.markdown(f"""
-        **{row['SubProducto']}** ({row['Market_Share']:.1f}% of total market)
-        - Volume: {row['Formatted_Volume']}
-        - Average Price: {row['Formatted_Price']}
-        - Market Value: {row['Formatted_Value']}
-        """)
-
-    # Calculate market value for each state and fuel type
-    total_by_state_fuel["Avg_Price"] = total_by_state_fuel["SubProducto"].map(price_map)
-    total_by_state_fuel["Market_Value_2024"] = (
-        total_by_state_fuel["Volumen Vendido (litros)"] * total_by_state_fuel["Avg_Price"]
-    )
-    
-    # Calculate state totals for sorting
-    state_market_totals = total_by_state_fuel.groupby("EntidadFederativa")["Market_Value_2024"].sum().reset_index()
-    state_market_order = state_market_totals.sort_values("Market_Value_2024", ascending=False)["EntidadFederativa"].tolist()
-    
-    # Format market values for hover
-    total_by_state_fuel["Formatted Value"] = total_by_state_fuel["Market_Value_2024"].apply(format_currency)
-    total_by_state_fuel["Tooltip"] = total_by_state_fuel.apply(
-        lambda x: f"{x['SubProducto']}: {format_currency(x['Market_Value_2024'], include_usd=True)}",
-        axis=1
-    )
-
-    st.subheader("Market Value by State (2024)")
-    
-    # Add toggle for stacked percentage
-    show_percentage = st.checkbox("Show as percentage of state total", value=False)
-    
-    # Calculate percentages within each state
-    state_totals_for_pct = total_by_state_fuel.groupby("EntidadFederativa")["Market_Value_2024"].sum().reset_index()
-    total_by_state_fuel = total_by_state_fuel.merge(
-        state_totals_for_pct,
-        on="EntidadFederativa",
-        suffixes=('', '_state_total')
-    )
-    total_by_state_fuel['state_percentage'] = (
-        total_by_state_fuel["Market_Value_2024"] / 
-        total_by_state_fuel["Market_Value_2024_state_total"] * 100
-    )
-    
-    # Update tooltip to include percentage
-    total_by_state_fuel["Tooltip"] = total_by_state_fuel.apply(
-        lambda x: (
-            f"{x['SubProducto']}: {format_currency(x['Market_Value_2024'], include_usd=True)}<br>"
-            f"({x['state_percentage']:.1f}% of state total)"
-        ),
-        axis=1
+    # Tooltip includes the share of the state's market value
+    total_by_state_fuel["Tooltip"] = concat(
+        total_by_state_fuel["SubProducto"], ": ", format_currency(total_by_state_fuel["Market_Value"], include_usd=True), "<br>",
+        "(", format_percent(total_by_state_fuel["market_state_percentage"]), " of state total)"
     )
 
     fig_market_value_by_state = px.bar(
         total_by_state_fuel,
         x="EntidadFederativa",
-        y="state_percentage" if show_percentage else "Market_Value_2024",
+        y="market_state_percentage" if show_percentage else "Market_Value",
         color="SubProducto",
-        color_discrete_map=color_map,
+        color_discrete_map=VOLUME_COLORS,
         barmode="stack",
         category_orders={"EntidadFederativa": state_market_order},
         custom_data=["Tooltip"]
     )
-    
+
     # Market Value chart
     fig_market_value_by_state.update_layout(
         xaxis=dict(
@@ -1027,55 +1024,25 @@ def volume_analysis_charts(df_volume, df_price, df_station, df_pop):
         ),
         height=700
     )
-    
+
     fig_market_value_by_state.update_traces(
         hovertemplate="%{customdata[0]}<extra></extra>"
     )
-    
-    st.plotly_chart(fig_market_value_by_state, use_container_width=True)
+    return fig_market_value_by_state
 
-    # Average Volume per Station by State
-    st.subheader("Average Volume per Station by State (2024)")
-    st.markdown("""
-    **Methodology:**
-    1. Total volume is calculated as the sum of all fuel types sold in each state in 2024
-    2. Number of stations is counted as unique stations (by place_id) in each state
-    3. Average = Total Volume / Number of Stations
-    4. States with no stations are shown as 0
-    """)
-    
-    total_volume_all = df_volume_agg["Volumen Vendido (litros)"].sum()
-    total_stations = df_station["place_id"].nunique()
-    avg_vol_per_station = total_volume_all / total_stations if total_stations else np.nan
+@instrumented()
+@cached(args_key)
+def avg_volume_per_station_figure(volume_by_state):
+    """Horizontal bars of average 2024 volume per station in each state."""
+    volume_col = VOLUME_COL
+    merged_state_vol = volume_by_state.sort_values("avg_volume_per_station", ascending=True).copy()
 
-    formatted_avg = format_volume(avg_vol_per_station)
-    st.write(f"**Average Volume per Station (National):** {formatted_avg}")
-
-    stations_per_state = df_station.groupby("state_name")["place_id"].nunique().reset_index()
-    stations_per_state.columns = ["EntidadFederativa", "count_stations"]
-
-    vol_by_state = df_volume_agg.groupby("EntidadFederativa")["Volumen Vendido (litros)"].sum().reset_index()
-    merged_state_vol = vol_by_state.merge(stations_per_state, on="EntidadFederativa", how="left")
-    merged_state_vol["count_stations"] = merged_state_vol["count_stations"].fillna(0)
-
-    merged_state_vol["avg_volume_per_station"] = np.where(
-        merged_state_vol["count_stations"] > 0,
-        merged_state_vol["Volumen Vendido (litros)"] / merged_state_vol["count_stations"],
-        0
-    )
-    
-    # Sort by average volume
-    merged_state_vol = merged_state_vol.sort_values("avg_volume_per_station", ascending=True)
-    
     # Format for tooltip with additional info
-    merged_state_vol["Formatted Average"] = merged_state_vol["avg_volume_per_station"].apply(format_volume)
-    merged_state_vol["Tooltip"] = merged_state_vol.apply(
-        lambda x: (
-            f"Total Volume: {format_volume(x['Volumen Vendido (litros)'])}<br>"
-            f"Stations: {int(x['count_stations']):,}<br>"
-            f"Average: {format_volume(x['avg_volume_per_station'])}"
-        ),
-        axis=1
+    merged_state_vol["Formatted Average"] = format_volume(merged_state_vol["avg_volume_per_station"])
+    merged_state_vol["Tooltip"] = concat(
+        "Total Volume: ", format_volume(merged_state_vol[volume_col]), "<br>",
+        "Stations: ", format_number(merged_state_vol["count_stations"], thousands=True), "<br>",
+        "Average: ", merged_state_vol["Formatted Average"]
     )
 
     fig_avg_vol_station = px.bar(
@@ -1087,7 +1054,7 @@ def volume_analysis_charts(df_volume, df_price, df_station, df_pop):
         height=800,
         color_discrete_sequence=["#1e3799"]
     )
-    
+
     # Average Volume per Station chart
     fig_avg_vol_station.update_layout(
         xaxis=dict(
@@ -1097,43 +1064,35 @@ def volume_analysis_charts(df_volume, df_price, df_station, df_pop):
         ),
         yaxis_title="State"
     )
-    
+
     fig_avg_vol_station.update_traces(
         hovertemplate="%{customdata[0]}<extra></extra>"
     )
-    
-    st.plotly_chart(fig_avg_vol_station, use_container_width=True)
+    return fig_avg_vol_station
+
+@instrumented()
+@cached(args_key)
+def volume_vs_market_value_figure(volume_by_state):
+    """Scatter of 2024 volume vs market value per state, sized by average volume per station."""
+    volume_col = VOLUME_COL
 
-    # New scatter plot of volume vs market value
-    st.subheader("Volume vs Market Value by State (2024)")
-    
     # Prepare data for scatter plot
-    scatter_data = state_market_totals.copy()  # Already has EntidadFederativa and Market_Value_2024
-    scatter_data = scatter_data.merge(
-        state_totals[["EntidadFederativa", "Volumen Vendido (litros)"]], 
-        on="EntidadFederativa"
-    )
-    scatter_data = scatter_data.merge(
-        merged_state_vol[["EntidadFederativa", "avg_volume_per_station"]], 
-        on="EntidadFederativa"
-    )
-    
+    scatter_data = volume_by_state[["EntidadFederativa", "Market_Value", volume_col, "avg_volume_per_station"]].copy()
+
     # Format values for tooltip
-    scatter_data["Formatted Volume"] = scatter_data["Volumen Vendido (litros)"].apply(format_volume)
-    scatter_data["Formatted Value"] = scatter_data["Market_Value_2024"].apply(
-        lambda x: format_currency(x, include_currency=True, include_usd=True)
-    )
-    scatter_data["Formatted Avg"] = scatter_data["avg_volume_per_station"].apply(format_volume)
-    
+    scatter_data["Formatted Volume"] = format_volume(scatter_data[volume_col])
+    scatter_data["Formatted Value"] = format_currency(scatter_data["Market_Value"], include_currency=True, include_usd=True)
+    scatter_data["Formatted Avg"] = format_volume(scatter_data["avg_volume_per_station"])
+
     fig_scatter = px.scatter(
         scatter_data,
-        x="Volumen Vendido (litros)",
-        y="Market_Value_2024",
+        x=volume_col,
+        y="Market_Value",
         size="avg_volume_per_station",
         hover_name="EntidadFederativa",
         custom_data=["Formatted Volume", "Formatted Value", "Formatted Avg"]
     )
-    
+
     # Volume vs Market Value scatter plot
     fig_scatter.update_layout(
         xaxis=dict(
@@ -1148,7 +1107,7 @@ def volume_analysis_charts(df_volume, df_price, df_station, df_pop):
         ),
         height=700
     )
-    
+
     # Update hover template
     fig_scatter.update_traces(
         hovertemplate=(
@@ -1159,58 +1118,28 @@ def volume_analysis_charts(df_volume, df_price, df_station, df_pop):
             "<extra></extra>"
         )
     )
-    
-    st.plotly_chart(fig_scatter, use_container_width=True)
+    return fig_scatter
+
+@instrumented()
+@cached(args_key)
+def volume_per_capita_figure(volume_by_state_fuel, volume_by_state, show_by_fuel):
+    """Horizontal bars of 2024 liters per capita by state, optionally stacked by fuel type."""
+    volume_col = VOLUME_COL
 
-    # Volume per Capita Analysis
-    st.subheader("Volume per Capita by State")
-    st.markdown("""
-    **Methodology:**
-    1. Total volume is calculated as the sum of all fuel types sold in each state in 2024
-    2. Population data is from 2024 projections
-    3. Volume per capita = Total Volume / Population
-    """)
-    
-    # Add toggle for showing total vs fuel type breakdown
-    show_by_fuel = st.checkbox("Show breakdown by fuel type", value=False, key="per_capita_by_fuel")
-    
-    # Prepare population data
-    df_pop_clean = df_pop.copy()
-    df_pop_clean["2024 population"] = df_pop_clean["2024 population"].replace(",", "", regex=True)
-    df_pop_clean["2024 population"] = pd.to_numeric(df_pop_clean["2024 population"], errors="coerce")
-    
-    # Filter for 2024 data only
-    df_volume_2024 = df_volume_agg[df_volume_agg["Año"] == 2024].copy()
-    
     if show_by_fuel:
-        # Calculate volume per capita by fuel type
-        per_capita_data = df_volume_2024.groupby(["EntidadFederativa", "SubProducto"])["Volumen Vendido (litros)"].sum().reset_index()
-        per_capita_data = per_capita_data.rename(columns={"EntidadFederativa": "state_name"})
-        
-        per_capita_data = per_capita_data.merge(
-            df_pop_clean[["Entidad Federativa", "2024 population"]], 
-            left_on="state_name",
-            right_on="Entidad Federativa",
-            how="left"
-        )
-        
-        per_capita_data["volume_per_capita"] = (
-            per_capita_data["Volumen Vendido (litros)"] / per_capita_data["2024 population"]
-        )
-        
+        # Volume per capita by fuel type
+        per_capita_data = volume_by_state_fuel.rename(columns={"EntidadFederativa": "state_name"})
+
         # Sort by total volume per capita for consistent state ordering
-        state_totals = per_capita_data.groupby("state_name")["volume_per_capita"].sum().sort_values(ascending=False)
-        state_order = state_totals.index.tolist()
-        
+        state_order = volume_by_state.sort_values("volume_per_capita", ascending=False)["EntidadFederativa"].tolist()
+
         # Format values for hover
-        per_capita_data["Formatted Per Capita"] = per_capita_data["volume_per_capita"].apply(
-            lambda x: f"{x:,.1f} liters"
+        per_capita_data["Formatted Per Capita"] = concat(
+            format_number(per_capita_data["volume_per_capita"], 1, thousands=True), " liters"
         )
-        per_capita_data["Formatted Population"] = per_capita_data["2024 population"].apply(
-            lambda x: f"{x:,.0f}"
-        )
-        per_capita_data["Formatted Volume"] = per_capita_data["Volumen Vendido (litros)"].apply(format_volume)
-        
+        per_capita_data["Formatted Population"] = format_number(per_capita_data["2024 population"], thousands=True)
+        per_capita_data["Formatted Volume"] = format_volume(per_capita_data[volume_col])
+
         fig_per_capita = px.bar(
             per_capita_data,
             x="volume_per_capita",
@@ -1219,10 +1148,10 @@ def volume_analysis_charts(df_volume, df_price, df_station, df_pop):
             orientation="h",
             custom_data=["Formatted Per Capita", "Formatted Population", "Formatted Volume", "SubProducto"],
             category_orders={"state_name": state_order},
-            color_discrete_map=color_map,
+            color_discrete_map=VOLUME_COLORS,
             barmode="stack"
         )
-        
+
         # Update hover template for stacked bars
         fig_per_capita.update_traces(
             hovertemplate=(
@@ -1235,33 +1164,19 @@ def volume_analysis_charts(df_volume, df_price, df_station, df_pop):
             )
         )
     else:
-        # Calculate total volume per capita
-        per_capita_data = df_volume_2024.groupby("EntidadFederativa")["Volumen Vendido (litros)"].sum().reset_index()
-        per_capita_data = per_capita_data.rename(columns={"EntidadFederativa": "state_name"})
-        
-        per_capita_data = per_capita_data.merge(
-            df_pop_clean[["Entidad Federativa", "2024 population"]], 
-            left_on="state_name",
-            right_on="Entidad Federativa",
-            how="left"
-        )
-        
-        per_capita_data["volume_per_capita"] = (
-            per_capita_data["Volumen Vendido (litros)"] / per_capita_data["2024 population"]
-        )
-        
+        # Total volume per capita
+        per_capita_data = volume_by_state.rename(columns={"EntidadFederativa": "state_name"})
+
         # Sort by volume per capita
         per_capita_data = per_capita_data.sort_values("volume_per_capita", ascending=True)
-        
+
         # Format values for hover
-        per_capita_data["Formatted Per Capita"] = per_capita_data["volume_per_capita"].apply(
-            lambda x: f"{x:,.1f} liters"
-        )
-        per_capita_data["Formatted Population"] = per_capita_data["2024 population"].apply(
-            lambda x: f"{x:,.0f}"
+        per_capita_data["Formatted Per Capita"] = concat(
+            format_number(per_capita_data["volume_per_capita"], 1, thousands=True), " liters"
         )
-        per_capita_data["Formatted Volume"] = per_capita_data["Volumen Vendido (litros)"].apply(format_volume)
-        
+        per_capita_data["Formatted Population"] = format_number(per_capita_data["2024 population"], thousands=True)
+        per_capita_data["Formatted Volume"] = format_volume(per_capita_data[volume_col])
+
         fig_per_capita = px.bar(
             per_capita_data,
             x="volume_per_capita",
@@ -1270,7 +1185,7 @@ def volume_analysis_charts(df_volume, df_price, df_station, df_pop):
             custom_data=["Formatted Per Capita", "Formatted Population", "Formatted Volume"],
             color_discrete_sequence=["#1e3799"]  # Dark blue
         )
-        
+
         # Update hover template for single bars
         fig_per_capita.update_traces(
             hovertemplate=(
@@ -1281,7 +1196,7 @@ def volume_analysis_charts(df_volume, df_price, df_station, df_pop):
                 "<extra></extra>"
             )
         )
-    
+
     # Update layout
     fig_per_capita.update_layout(
         xaxis=dict(
@@ -1291,133 +1206,204 @@ def volume_analysis_charts(df_volume, df_price, df_station, df_pop):
         yaxis_title="State",
         height=800
     )
-    
+    return fig_per_capita
+
+@instrumented()
+def volume_analysis_charts(volume_by_fuel, volume_by_state_fuel, volume_by_state, volume_national):
+    """
+    Replace tables with charts:
+    1) Total Volume by Fuel Type
+    2) Total Volume by State & Fuel Type
+    3) 2024 Market Value by State
+    4) Average Volume per Station by State
+    Also includes a national total market value metric.
+    Inputs are the volume_by_fuel, volume_by_state_fuel, volume_by_state tables and
+    the volume_national totals from precompute.py.
+    """
+    volume_col = VOLUME_COL
+
+    st.subheader("Total Volume by Fuel Type (2024)")
+    st.plotly_chart(volume_by_fuel_figure(volume_by_fuel), use_container_width=True)
+
+    st.subheader("Total Volume by State & Fuel Type (2024)")
+
+    # Add toggle for stacked percentage
+    show_percentage = st.checkbox("Show as percentage of state total", value=False, key="volume_percentage")
+    fig_state_fuel = volume_by_state_fuel_figure(volume_by_state_fuel, volume_by_state, show_percentage)
+    st.plotly_chart(fig_state_fuel, use_container_width=True)
+
+    # Market values are pre-computed from state prices (national prices where a state has none)
+    volume_2024 = volume_by_fuel.sort_values(volume_col, ascending=False)
+    total_market_value = volume_national["total_market_value"]
+
+    # Display total first
+    st.subheader("Market Value Analysis (2024)")
+    formatted_total = format_currency(total_market_value, include_currency=True, include_usd=True)
+    st.metric(label="Total Market Value (All Fuels)", value=formatted_total)
+
+    # Breakdown for each fuel type, formatted column-wise
+    st.markdown("### Estimated Market Value Breakdown (2024)")
+    breakdown = concat(
+        "**", volume_2024["SubProducto"], "** (", format_percent(volume_2024["Market_Share"]), " of total market)\n",
+        "- Volume: ", format_volume(volume_2024[volume_col], include_label=True), "\n",
+        "- Average Price: ", format_price(volume_2024["Avg_Price"], thousands=True), " MXN/liter\n",
+        "- Market Value: ", format_currency(volume_2024["Market_Value"], include_currency=True, include_usd=True), "\n"
+    )
+    st.markdown("\n".join(breakdown))
+    state_priced_share = volume_national.get("state_priced_share")
+    if state_priced_share is not None:
+        st.caption(
+            "Each state's volume is valued at its own average station price; national averages are used "
+            f"where a state has no prices for a fuel. {format_percent(state_priced_share)} of the volume "
+            "is valued at state prices; average prices above are weighted by volume."
+        )
+
+    st.subheader("Market Value by State (2024)")
+
+    # Add toggle for stacked percentage
+    show_percentage = st.checkbox("Show as percentage of state total", value=False, key="market_value_percentage")
+    fig_market_value_by_state = market_value_by_state_figure(volume_by_state_fuel, volume_by_state, show_percentage)
+    st.plotly_chart(fig_market_value_by_state, use_container_width=True)
+
+    # Average Volume per Station by State
+    st.subheader("Average Volume per Station by State (2024)")
+    st.markdown("""
+    **Methodology:**
+    1. Total volume is calculated as the sum of all fuel types sold in each state in 2024
+    2. Number of stations is counted as unique stations (by place_id) in each state
+    3. Average = Total Volume / Number of Stations
+    4. States with no stations are shown as 0
+    """)
+
+    avg_vol_per_station = volume_national["avg_volume_per_station"]
+    if avg_vol_per_station is None:
+        avg_vol_per_station = np.nan
+
+    formatted_avg = format_volume(avg_vol_per_station)
+    st.write(f"**Average Volume per Station (National):** {formatted_avg}")
+
+    st.plotly_chart(avg_volume_per_station_figure(volume_by_state), use_container_width=True)
+
+    # New scatter plot of volume vs market value
+    st.subheader("Volume vs Market Value by State (2024)")
+    st.plotly_chart(volume_vs_market_value_figure(volume_by_state), use_container_width=True)
+
+    # Volume per Capita Analysis
+    st.subheader("Volume per Capita by State")
+    st.markdown("""
+    **Methodology:**
+    1. Total volume is calculated as the sum of all fuel types sold in each state in 2024
+    2. Population data is from 2024 projections
+    3. Volume per capita = Total Volume / Population
+    """)
+
+    # Add toggle for showing total vs fuel type breakdown
+    show_by_fuel = st.checkbox("Show breakdown by fuel type", value=False, key="per_capita_by_fuel")
+    fig_per_capita = volume_per_capita_figure(volume_by_state_fuel, volume_by_state, show_by_fuel)
     st.plotly_chart(fig_per_capita, use_container_width=True)
 
-def historical_volume_chart(df_volume):
+@instrumented()
+def historical_volume_chart(series):
     """
     Shows historical volume trends with national view and state selector.
-    Includes year-over-year comparison option.
-    Returns a tuple of (figure, show_yoy) where show_yoy indicates if YoY view is selected.
+    Includes year-over-year comparison and rolling average options.
+    series: historical_volume VolumeSeries (see volume_series.py), whose first
+    entity is the "National Total".
     """
-    # Filter out future data
-    df_filtered = df_volume[df_volume["Año"] != 2025].copy()
-    
-    # Calculate national totals
-    df_national = df_filtered.groupby("Año")["Volumen Vendido (litros)"].sum().reset_index()
-    df_national["EntidadFederativa"] = "National Total"
-    
-    # Prepare state data
-    df_states = df_filtered.groupby(["Año", "EntidadFederativa"])["Volumen Vendido (litros)"].sum().reset_index()
-    
-    # Combine national and state data
-    df_combined = pd.concat([df_national, df_states])
-    
-    # Calculate year-over-year change
-    df_yoy = df_combined.copy()
-    df_yoy["YoY Change"] = df_yoy.groupby("EntidadFederativa")["Volumen Vendido (litros)"].pct_change() * 100
-    
     # UI Controls
     col1, col2 = st.columns(2)
     with col1:
-        show_yoy = st.checkbox("Show Year-over-Year Change", value=False)
-    
+        show_yoy = st.checkbox("Show Year-over-Year Change", value=False, key="historical_yoy")
+        show_rolling = st.checkbox(
+            f"Show {ROLLING_YEARS}-year rolling average", value=False, disabled=show_yoy, key="historical_rolling"
+        )
+
     with col2:
-        default_states = ["National Total"]
-        all_states = sorted(df_states["EntidadFederativa"].unique())
+        default_states = [NATIONAL]
         selected_states = st.multiselect(
             "Select States to Compare",
-            options=["National Total"] + all_states,
-            default=default_states
+            options=[NATIONAL] + series.states(),
+            default=default_states,
+            key="historical_states"
         )
-    
-    # Filter data based on selection
-    df_plot = df_yoy if show_yoy else df_combined
-    df_plot = df_plot[df_plot["EntidadFederativa"].isin(selected_states)]
-    
+
+    return historical_volume_figure(series, selected_states, show_yoy, show_rolling and not show_yoy)
+
+@instrumented()
+@cached(args_key)
+def historical_volume_figure(series, selected_states, show_yoy, show_rolling=False):
+    """
+    Line chart of yearly volume (or YoY change in %) for the selected entities,
+    one trace per entity drawn from its rows of the series; show_rolling adds the
+    trailing average of each entity as a dotted line.
+    """
+    rows = series.rows(selected_states)
+    years = series.years
+    colors = px.colors.qualitative.Plotly
+
     # Format values for hover
-    def format_volume(x):
-        """Format volume in B or M with max 2 decimals"""
-        if x >= 1e9:
-            return f"{x/1e9:.2f}B liters"
-        return f"{x/1e6:.2f}M liters"
-    
-    df_plot["Formatted Volume"] = df_plot["Volumen Vendido (litros)"].apply(format_volume)
-    
-    # Create the figure
+    volumes = format_volume(series.level[rows].ravel()).reshape(len(rows), len(years))
+    cagr = np.where(np.isnan(series.cagr[rows]), "n/a", format_percent(series.cagr[rows], 1, sign=True))
+    period = f"{years[0]}–{years[-1]}" if len(years) else ""
+
     if show_yoy:
-        fig = px.line(
-            df_plot,
-            x="Año",
-            y="YoY Change",
-            color="EntidadFederativa",
-            title="Year-over-Year Volume Change by State",
-            custom_data=["Formatted Volume"]
-        )
-        
-        # Update layout for YoY view
-        fig.update_layout(
-            yaxis=dict(
-                title="Year-over-Year Change (%)",
-                tickformat=".1f",
-                hoverformat=".1f"
-            ),
-            xaxis_title="Year",
-            hovermode="x unified"
-        )
-        
-        # Add zero line for reference
-        fig.add_hline(y=0, line_dash="dash", line_color="gray")
-        
-        # Update hover template
-        fig.update_traces(
-            hovertemplate=(
-                "<b>%{x}</b><br>" +
-                "%{y:.1f}% change<br>" +
-                "Volume: %{customdata[0]}" +
-                "<extra>%{fullData.name}</extra>"
-            )
-        )
+        title = "Year-over-Year Volume Change by State"
+        values = series.yoy
+        yaxis = dict(title="Year-over-Year Change (%)", tickformat=".1f", hoverformat=".1f")
+        value_line = "%{y:.1f}% change<br>Volume: %{customdata[0]}<br>"
     else:
-        fig = px.line(
-            df_plot,
-            x="Año",
-            y="Volumen Vendido (litros)",
-            color="EntidadFederativa",
-            title="Historical Volume by State",
-            custom_data=["Formatted Volume"]
-        )
-        
-        # Update layout for volume view
-        fig.update_layout(
-            yaxis=dict(
-                title="Volume (liters)",
-                tickformat="~s",
-                hoverformat="~s"
-            ),
-            xaxis_title="Year",
-            hovermode="x unified"
-        )
-        
-        # Update hover template
-        fig.update_traces(
+        title = "Historical Volume by State"
+        values = series.level
+        yaxis = dict(title="Volume (liters)", tickformat="~s", hoverformat="~s")
+        value_line = "Volume: %{customdata[0]}<br>"
+
+    # Create the figure
+    fig = go.Figure()
+    for i, row in enumerate(rows):
+        entity = series.entities[row]
+        color = colors[i % len(colors)]
+        fig.add_trace(go.Scatter(
+            x=years,
+            y=values[row],
+            mode="lines",
+            name=entity,
+            legendgroup=entity,
+            line=dict(color=color),
+            customdata=np.column_stack([volumes[i], np.repeat(cagr[i], len(years))]),
             hovertemplate=(
                 "<b>%{x}</b><br>" +
-                "Volume: %{customdata[0]}" +
+                value_line +
+                f"CAGR {period}: %{{customdata[1]}} per year" +
                 "<extra>%{fullData.name}</extra>"
             )
-        )
-    
+        ))
+        if show_rolling:
+            fig.add_trace(go.Scatter(
+                x=years,
+                y=series.rolling[row],
+                mode="lines",
+                name=f"{entity} ({ROLLING_YEARS}-year average)",
+                legendgroup=entity,
+                line=dict(color=color, dash="dot"),
+                hovertemplate=f"{ROLLING_YEARS}-year average: %{{y:~s}}<extra>%{{fullData.name}}</extra>"
+            ))
+
+    fig.update_layout(title=title, yaxis=yaxis, xaxis_title="Year", hovermode="x unified")
+    if show_yoy:
+        # Add zero line for reference
+        fig.add_hline(y=0, line_dash="dash", line_color="gray")
+
     # Common layout updates
     fig.update_layout(
         height=600,
         showlegend=True,
         legend=dict(
+            title_text="State",
             yanchor="top",
             y=0.99,
             xanchor="left",
             x=0.01
         )
     )
-    
-    return fig
\ No newline at end of file
+
+    return fig
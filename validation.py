@@ -0,0 +1,212 @@
+"""
+Data-quality validation of the clean station table (gas_prices_clean.csv layout).
+
+validate_stations runs every check as a column-wide array operation and returns
+the table with duplicate stations merged, plus a JSON-serializable report:
+
+    rows          number of rows checked
+    schema        missing columns and values that are not numeric in numeric columns
+    nulls         share of missing values per column
+    prices        per fuel: prices listed, outside PRICE_RANGE, min and max
+    coordinates   rows with missing, 0/0 or outside-Mexico coordinates
+    duplicates    repeated place_ids, how many had conflicting prices, the policy used
+    errors        checks over their limits (empty when the table passed)
+    passed        True when there are no errors
+
+Repeated stations are merged per fuel with a policy: "first" / "last" (first or
+last price listed, in row order), "min" or "mean" of the listed prices.
+
+Usage:
+    python validation.py data/gas_prices_clean.csv [--policy mean] [--report quality.json]
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from spatial import COORDINATE_BOUNDS
+
+# Configuration
+DATA_DIR = Path("data")
+FUEL_COLUMNS = ["regular_price", "premium_price", "diesel_price"]
+NUMERIC_COLUMNS = ["place_id", "longitude", "latitude", *FUEL_COLUMNS, "EntidadFederativaId", "MunicipioId"]
+REQUIRED_COLUMNS = ["place_id", "name", "cre_id", "longitude", "latitude", *FUEL_COLUMNS, "state_name", "municipality_name"]
+DUPLICATE_POLICIES = ["first", "last", "min", "mean"]
+DUPLICATE_POLICY = "mean"
+# Realistic price range (MXN per litre), as in remove_price_outliers
+PRICE_RANGE = (12, 35)
+# Limits above which a check fails the table
+MAX_NULL_RATIOS = {
+    "place_id": 0.0, "longitude": 0.0, "latitude": 0.0,
+    "regular_price": 0.5, "premium_price": 0.5, "diesel_price": 0.75,
+    "state_name": 0.25, "municipality_name": 0.25
+}
+MAX_OUT_OF_RANGE_RATIO = 0.01
+MAX_BAD_COORDINATE_RATIO = 0.05
+
+# -------------------------------------------------------------------------
+# Duplicates
+# -------------------------------------------------------------------------
+
+def reduce_duplicates(keys, values, policy=DUPLICATE_POLICY):
+    """
+    One value per distinct key, merging the values of repeated keys (given in row order)
+    with policy. Returns (sorted unique keys, values).
+    """
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError(f"Unknown duplicate policy {policy!r}; expected one of {DUPLICATE_POLICIES}")
+    order = np.argsort(keys, kind="stable")
+    keys, values = keys[order], values[order]
+    if not len(keys):
+        return keys, values
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    stops = np.append(starts[1:], len(keys))
+    if policy == "first":
+        merged = values[starts]
+    elif policy == "last":
+        merged = values[stops - 1]
+    elif policy == "min":
+        merged = np.minimum.reduceat(values, starts)
+    else:
+        merged = np.add.reduceat(values, starts) / (stops - starts)
+    return keys[starts], merged
+
+def resolve_duplicates(df, policy=DUPLICATE_POLICY):
+    """
+    One row per place_id: station columns from the first row, each fuel's price merged
+    over the rows listing it with policy. Returns (DataFrame, duplicate counts).
+    The frame is returned as it is when place_ids are already unique.
+    """
+    # Codes follow the order of first appearance, so station i's first row is the i-th first row
+    codes, _ = pd.factorize(df["place_id"])
+    known = codes >= 0
+    codes_known = codes[known]
+    _, first_rows = np.unique(codes_known, return_index=True)
+    n_stations = len(first_rows)
+    counts = {
+        "policy": policy,
+        "rows": int(len(codes_known) - n_stations),
+        "place_ids": int((np.bincount(codes_known, minlength=n_stations) > 1).sum()),
+        "conflicting_prices": 0
+    }
+    if counts["rows"] == 0:
+        return df, counts
+
+    merged = df.iloc[np.flatnonzero(known)[first_rows]].reset_index(drop=True)
+    conflicting = np.zeros(n_stations, dtype=bool)
+    for fuel in [col for col in FUEL_COLUMNS if col in df.columns]:
+        prices = pd.to_numeric(df[fuel], errors="coerce").to_numpy(dtype=float, na_value=np.nan)[known]
+        listed = ~np.isnan(prices)
+        stations, values = reduce_duplicates(codes_known[listed], prices[listed], policy)
+        _, lowest = reduce_duplicates(codes_known[listed], prices[listed], "min")
+        _, negated_highest = reduce_duplicates(codes_known[listed], -prices[listed], "min")
+        conflicting[stations[lowest != -negated_highest]] = True
+        column = np.full(n_stations, np.nan)
+        column[stations] = values
+        merged[fuel] = column
+    counts["conflicting_prices"] = int(conflicting.sum())
+    return merged, counts
+
+# -------------------------------------------------------------------------
+# Checks
+# -------------------------------------------------------------------------
+
+def _ratio(count, total):
+    return round(count / total, 6) if total else 0.0
+
+def validate_stations(df, policy=DUPLICATE_POLICY):
+    """Check a station table and merge its duplicate stations. Returns (DataFrame, report)."""
+    n_rows = len(df)
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    errors = [f"missing columns: {', '.join(missing_columns)}"] if missing_columns else []
+
+    numeric = {}
+    non_numeric = {}
+    for col in [col for col in NUMERIC_COLUMNS if col in df.columns]:
+        values = df[col]
+        numeric[col] = pd.to_numeric(values, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        # Values present but not parseable as numbers
+        non_numeric[col] = int((np.isnan(numeric[col]) & values.notna().to_numpy()).sum())
+    for col, count in non_numeric.items():
+        if count:
+            errors.append(f"{col}: {count:,} non-numeric values")
+
+    nulls = {col: _ratio(int(df[col].isna().sum()), n_rows) for col in df.columns}
+    for col, limit in MAX_NULL_RATIOS.items():
+        if col in nulls and nulls[col] > limit:
+            errors.append(f"{col}: {nulls[col]:.1%} missing (limit {limit:.0%})")
+
+    prices = {}
+    for fuel in [col for col in FUEL_COLUMNS if col in numeric]:
+        values = numeric[fuel][~np.isnan(numeric[fuel])]
+        out_of_range = int(((values < PRICE_RANGE[0]) | (values > PRICE_RANGE[1])).sum())
+        prices[fuel] = {
+            "listed": int(len(values)),
+            "out_of_range": out_of_range,
+            "min": float(values.min()) if len(values) else None,
+            "max": float(values.max()) if len(values) else None
+        }
+        if _ratio(out_of_range, len(values)) > MAX_OUT_OF_RANGE_RATIO:
+            errors.append(f"{fuel}: {out_of_range:,} prices outside {PRICE_RANGE[0]}-{PRICE_RANGE[1]} MXN")
+
+    coordinates = {}
+    if "longitude" in numeric and "latitude" in numeric:
+        lon, lat = numeric["longitude"], numeric["latitude"]
+        min_lon, min_lat, max_lon, max_lat = COORDINATE_BOUNDS
+        missing = np.isnan(lon) | np.isnan(lat)
+        zero = (lon == 0) & (lat == 0)
+        inside = (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+        coordinates = {
+            "missing": int(missing.sum()),
+            "zero": int(zero.sum()),
+            "outside_mexico": int((~missing & ~zero & ~inside).sum())
+        }
+        bad = n_rows - int(inside.sum())
+        if _ratio(bad, n_rows) > MAX_BAD_COORDINATE_RATIO:
+            errors.append(f"{bad:,} stations without coordinates in Mexico")
+
+    duplicates = {"policy": policy, "rows": 0, "place_ids": 0, "conflicting_prices": 0}
+    if "place_id" in df.columns:
+        df, duplicates = resolve_duplicates(df, policy)
+
+    report = {
+        "rows": n_rows,
+        "schema": {"missing_columns": missing_columns, "non_numeric": non_numeric},
+        "nulls": nulls,
+        "prices": prices,
+        "coordinates": coordinates,
+        "duplicates": duplicates,
+        "errors": errors,
+        "passed": not errors
+    }
+    return df, report
+
+def write_report(report, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate a clean station table.")
+    parser.add_argument("gas_prices", nargs="?", default=DATA_DIR / "gas_prices_clean.csv", type=Path)
+    parser.add_argument("--policy", default=DUPLICATE_POLICY, choices=DUPLICATE_POLICIES)
+    parser.add_argument("--report", type=Path, help="Write the JSON report here instead of printing it")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.gas_prices, dtype={"cre_id": str})
+    start = time.perf_counter()
+    _, report = validate_stations(df, args.policy)
+    elapsed = time.perf_counter() - start
+    if args.report is not None:
+        write_report(report, args.report)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    status = "passed" if report["passed"] else "FAILED: " + "; ".join(report["errors"])
+    print(f"{args.gas_prices}: {report['rows']:,} rows validated in {elapsed * 1000:.1f} ms, {status}", file=sys.stderr)
+    sys.exit(0 if report["passed"] else 1)
+
+if __name__ == "__main__":
+    main()
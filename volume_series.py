@@ -0,0 +1,106 @@
+"""
+Yearly volume series of every entity (the nation and each state) as entities x years
+matrices, computed once when the artifact is built:
+
+    level     volume sold in the year (litres)
+    yoy       change from the previous year (%)
+    rolling   trailing ROLLING_YEARS-year average of the volume (litres)
+    cagr      compound annual growth between each entity's first and last year (%)
+
+A chart of some entities only picks their rows, whatever the number of years.
+
+    series = volume_series(df_volume)
+    rows = series.rows(["National Total", "Jalisco"])
+    series.level[rows], series.yoy[rows]
+"""
+import hashlib
+
+import numpy as np
+
+from volumes import VOLUME_COLUMN
+
+# Configuration
+NATIONAL = "National Total"
+ROLLING_YEARS = 3
+
+class VolumeSeries:
+    """Per-entity yearly volume metrics; row i of every matrix belongs to entities[i]."""
+
+    def __init__(self, entities, years, level):
+        self.entities = list(entities)
+        self.years = np.array(years, dtype=np.int64)
+        self.level = np.asarray(level, dtype=float).reshape(len(self.entities), len(self.years))
+        self._positions = {entity: i for i, entity in enumerate(self.entities)}
+        # Content digest, so figures cached on a series (see caching.args_key) follow its data
+        sha = hashlib.sha256(repr((self.entities, self.years.tolist())).encode("utf-8"))
+        sha.update(np.ascontiguousarray(self.level).tobytes())
+        self.digest = sha.hexdigest()
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.yoy = np.full_like(self.level, np.nan)
+            self.yoy[:, 1:] = (self.level[:, 1:] / self.level[:, :-1] - 1) * 100
+
+        # Trailing mean over full windows only
+        window = min(ROLLING_YEARS, len(self.years))
+        cumulative = np.concatenate([np.zeros((len(self.entities), 1)), np.cumsum(self.level, axis=1)], axis=1)
+        self.rolling = np.full_like(self.level, np.nan)
+        if window:
+            self.rolling[:, window - 1:] = (cumulative[:, window:] - cumulative[:, :-window]) / window
+
+        # Between the first and last year with a positive volume
+        self.cagr = np.full(len(self.entities), np.nan)
+        positive = self.level > 0
+        has_span = positive.sum(axis=1) >= 2
+        if has_span.any():
+            first = positive.argmax(axis=1)[has_span]
+            last = len(self.years) - 1 - positive[:, ::-1].argmax(axis=1)[has_span]
+            rows = np.flatnonzero(has_span)
+            growth = self.level[rows, last] / self.level[rows, first]
+            self.cagr[has_span] = (growth ** (1 / (self.years[last] - self.years[first])) - 1) * 100
+
+        # Series are shared by every session through the cache
+        for values in (self.years, self.level, self.yoy, self.rolling, self.cagr):
+            values.flags.writeable = False
+
+    def __eq__(self, other):
+        return isinstance(other, VolumeSeries) and other.digest == self.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in (self.years, self.level, self.yoy, self.rolling, self.cagr))
+
+    def rows(self, entities):
+        """Row of each entity, skipping the ones without a series."""
+        return np.array([self._positions[e] for e in entities if e in self._positions], dtype=np.int64)
+
+    def states(self):
+        """Every entity but the national total, sorted."""
+        return sorted(entity for entity in self.entities if entity != NATIONAL)
+
+    def to_json(self):
+        """Level matrix and labels; the other metrics are derived again on load."""
+        return {
+            "entities": self.entities,
+            "years": self.years.tolist(),
+            "level": [[None if np.isnan(v) else v for v in row] for row in self.level.tolist()]
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        level = np.array([[np.nan if v is None else v for v in row] for row in data["level"]], dtype=float)
+        return cls(data["entities"], data["years"], level)
+
+def volume_series(df_volume, excluded_years=()):
+    """VolumeSeries of the nation and of every state from yearly (Año, EntidadFederativa) volumes."""
+    df = df_volume[~df_volume["Año"].isin(excluded_years)]
+    by_state = df.pivot_table(
+        index="EntidadFederativa", columns="Año", values=VOLUME_COLUMN, aggfunc="sum", observed=True
+    )
+    by_state.index = by_state.index.astype(str)
+    by_state = by_state.sort_index()
+    national = df.groupby("Año")[VOLUME_COLUMN].sum().reindex(by_state.columns)
+    level = np.vstack([national.to_numpy(dtype=float)[None, :], by_state.to_numpy(dtype=float)])
+    return VolumeSeries([NATIONAL, *by_state.index], by_state.columns, level)
@@ -0,0 +1,108 @@
+"""
+Chunked loader for the CRE volume history (volumes.csv).
+
+The file is read CHUNK_ROWS rows at a time with explicit dtypes (or record batch
+by record batch from its Arrow snapshot, see snapshots.py). Each chunk is summed
+by (year, state, fuel), or by (year, month, state, fuel) for the monthly grain,
+with the diesel sub-products folded into "Diesel" and states given their canonical
+spelling, then added to the running totals. Only the totals are kept, so memory
+grows with the number of distinct keys (about 32 states x 3 fuels per year or
+month) rather than with the rows of the history.
+
+Usage:
+    python volumes.py data/volumes.csv [--monthly] [--chunk-rows 200000]
+"""
+import argparse
+import time
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+from geography import canonical_state_names
+from snapshots import is_snapshot_current, snapshot_path
+
+# Configuration
+DATA_DIR = Path("data")
+VOLUME_COLUMN = "Volumen Vendido (litros)"
+CHUNK_ROWS = 200_000
+DIESEL_VARIANTS = {
+    "Diésel Automotriz": "Diesel",
+    "DUBA": "Diesel",
+    "Diésel Agricola-Marino": "Diesel"
+}
+# Columns read from the CSV; Producto is implied by SubProducto
+CSV_DTYPES = {
+    "Año": "int16",
+    "Mes": "int8",
+    "EntidadFederativa": "category",
+    "SubProducto": "category",
+    VOLUME_COLUMN: "float64"
+}
+YEARLY_KEYS = ["Año", "EntidadFederativa", "SubProducto"]
+MONTHLY_KEYS = ["Año", "Mes", "EntidadFederativa", "SubProducto"]
+
+def fold_diesel_variants(subproducts):
+    """Relabel the diesel sub-products as a single "Diesel" fuel."""
+    return subproducts.astype(str).replace(DIESEL_VARIANTS)
+
+# -------------------------------------------------------------------------
+# Reading
+# -------------------------------------------------------------------------
+
+def _csv_chunks(path, chunk_rows):
+    # thousands="," also parses volumes written as "1,500,412"
+    return pd.read_csv(
+        path, usecols=list(CSV_DTYPES), dtype=CSV_DTYPES, thousands=",", chunksize=chunk_rows
+    )
+
+def _snapshot_chunks(path, memory_map):
+    source = pa.memory_map(str(path)) if memory_map else pa.OSFile(str(path))
+    with pa.ipc.open_file(source) as reader:
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i).select(list(CSV_DTYPES)).to_pandas()
+
+def _aggregate_chunk(chunk, keys):
+    """Volume of one chunk summed by keys, with folded fuels and canonical state names."""
+    grouped = chunk.groupby(keys, observed=True)[VOLUME_COLUMN].sum().reset_index()
+    grouped["EntidadFederativa"] = canonical_state_names(grouped["EntidadFederativa"]).astype(str)
+    grouped["SubProducto"] = fold_diesel_variants(grouped["SubProducto"])
+    return grouped.groupby(keys)[VOLUME_COLUMN].sum()
+
+def load_volumes(path=DATA_DIR / "volumes.csv", monthly=False, chunk_rows=CHUNK_ROWS, memory_map=False):
+    """
+    Volume sold by (Año, EntidadFederativa, SubProducto), plus Mes with monthly,
+    one row per key sorted by key. Reads the Arrow snapshot when it is current and
+    the CSV in chunks of chunk_rows rows otherwise.
+    """
+    keys = MONTHLY_KEYS if monthly else YEARLY_KEYS
+    if is_snapshot_current(path):
+        chunks = _snapshot_chunks(snapshot_path(path), memory_map)
+    else:
+        chunks = _csv_chunks(path, chunk_rows)
+
+    totals = None
+    for chunk in chunks:
+        grouped = _aggregate_chunk(chunk, keys)
+        totals = grouped if totals is None else totals.add(grouped, fill_value=0)
+    if totals is None:
+        return pd.DataFrame({col: pd.Series(dtype=CSV_DTYPES[col]) for col in [*keys, VOLUME_COLUMN]})
+
+    df = totals.sort_index().reset_index()
+    return df.astype({col: CSV_DTYPES[col] for col in [*keys, VOLUME_COLUMN]})
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate the CRE volume history in chunks.")
+    parser.add_argument("volumes", nargs="?", default=DATA_DIR / "volumes.csv", type=Path)
+    parser.add_argument("--monthly", action="store_true", help="Keep the monthly grain")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = load_volumes(args.volumes, args.monthly, args.chunk_rows)
+    elapsed = time.perf_counter() - start
+    print(df.to_string(index=False, max_rows=20))
+    print(f"{len(df):,} {'monthly' if args.monthly else 'yearly'} totals in {elapsed:.2f}s")
+
+if __name__ == "__main__":
+    main()